@@ -1,28 +1,40 @@
 import json
+import multiprocessing
 import os
-import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import Union, List
 from uuid import uuid4
 
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from fastapi import FastAPI, Body, Request, Response, File, UploadFile, HTTPException
+from fastapi import FastAPI, Body, Request, Response, File, UploadFile, HTTPException, BackgroundTasks
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
 from app.boundary.ImageGenerator import ImageGenerator
 from app.boundary.SignavioAuthenticator import SignavioAuthenticator
 from app.boundary.configuremiddlewares import configure_middlewares
-from app.boundary.constraintmining import get_constraints_for_log_new
-from app.boundary.dbconnect import ConstraintRepository, FittedConstraintRepository, MatchingRepository, ViolationRepository, get_base_config
-from app.boundary.dbconnect import get_db_client
+from app.boundary.constraintmining import get_constraints_for_log_new, get_log_profile, rerank_constraints
+from app.boundary.dbconnect import ConstraintRepository, FittedConstraintRepository, ViolationRepository, get_base_config
+from app.boundary.dbconnect import ensure_indexes, get_db_client, migrate_matchings
+from app.boundary.embeddingstore import EmbeddingStore, get_store_dir
+from app.boundary.logsnapshots import load_log_and_info, invalidate_snapshots
+from app.control.ingestion import IngestionTracker, PENDING, READY
+from app.control.encoded_log import EncodedLog, encode_log, parse_activities
+from app.control.embedding_service import EmbeddingService
+from app.control.encoders import MAX_COSINE_DEVIATION, TORCH, get_checked_encoder
+from app.control.log_cache import LogCache, LoadedLog
+from app.control.operand_index import add_operands, load_operand_index
+from app.control.log_index import LogIndex
+from app.control.log_profile import LogProfile
 from app.control.log_handling import get_variants, get_violated_variants
 from app.model.configuration import AppConfiguration
 from app.model.constraint import Constraint
-from app.control.constraint_checking import check_constraints
+from app.control.constraint_checking import check_constraints, CHECKERS, DECLARE
 
 from semconstmining.parsing.label_parser.nlp_helper import NlpHelper
-from semconstmining.main import get_resource_handler, get_log_and_info
+from semconstmining.main import get_resource_handler
 from semconstmining.config import Config
 from semconstmining.selection.instantiation.recommendation_config import RecommendationConfig
 
@@ -30,7 +42,7 @@ from app.model.fittedConstraint import FittedConstraint
 from app.model.variant import Variant
 from app.model.violatedVariant import ViolatedVariant
 from app.model.violation import Violation
-from app.util.fileutils import check_data_directories_on_start
+from app.util.fileutils import check_data_directories_on_start, store_uploaded_log
 
 import logging
 
@@ -75,6 +87,30 @@ class Settings(BaseSettings):
         'LOG_FORMAT',
         '[%(asctime)s] [%(name)s] [%(process)d] [%(levelname)s] %(message)s')
     max_number_of_constraints: int = 1000
+    # Memory budget of the log cache in bytes and its eviction policy ('lru' or 'cost')
+    log_cache_max_bytes: int = int(os.environ.get('LOG_CACHE_MAX_BYTES', 4 * 1024 ** 3))
+    log_cache_policy: str = os.environ.get('LOG_CACHE_POLICY', 'lru')
+    # Size of the chunks in which uploaded logs are written to disk
+    upload_chunk_size: int = 1024 * 1024
+    # Number of worker processes for conformance checking (1 checks sequentially in the request thread) and the
+    # maximum number of distinct traces that one worker checks at once
+    checking_workers: int = int(os.environ.get('CHECKING_WORKERS', 1))
+    checking_shard_size: int = int(os.environ.get('CHECKING_SHARD_SIZE', 5000))
+    # Minimum similarity of a log term to a constraint operand for the constraint to be instantiated with it
+    similarity_threshold: float = float(os.environ.get('SIMILARITY_THRESHOLD', 0.5))
+    # Share of the operands within the similarity threshold that the operand index has to find
+    operand_index_recall: float = float(os.environ.get('OPERAND_INDEX_RECALL', 0.95))
+    # Maximum number of terms that are encoded in one batch and how long (in ms) the embedding service waits for
+    # concurrent requests to fill a batch
+    embedding_batch_size: int = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+    embedding_wait_ms: float = float(os.environ.get('EMBEDDING_WAIT_MS', 5))
+    # Sentence encoder backend ('torch', 'torch-int8', 'onnx' or 'onnx-int8') and the number of CPU threads it uses
+    # (0 for default; torch's thread count is process-wide, so 'torch-int8' only sets it while it encodes). All
+    # backends but 'torch' load the sentence model of the nlp helper
+    encoder_backend: str = os.environ.get('ENCODER_BACKEND', TORCH)
+    encoder_threads: int = int(os.environ.get('ENCODER_THREADS', 0))
+    # Largest cosine deviation of the backend from 'torch' on startup, above which 'torch' is used instead
+    encoder_max_deviation: float = float(os.environ.get('ENCODER_MAX_DEVIATION', MAX_COSINE_DEVIATION))
 
 
 class State(BaseModel):
@@ -86,6 +122,11 @@ class State(BaseModel):
     @classmethod
     def from_settings(cls, settings: Settings):
         cls.db_client = get_db_client(settings.db_uri)
+        try:
+            ensure_indexes(cls.db_client)
+            migrate_matchings(cls.db_client)
+        except Exception as e:
+            _logger.warning(f"Could not prepare the database: {e}")
         cls.log_path = settings.log_path
         cls.miningconfig = Config(Path(__file__).parents[1].resolve(), "semantic_sap_sam_filtered")
         check_data_directories_on_start(cls.miningconfig)
@@ -93,7 +134,22 @@ class State(BaseModel):
         cls.resource_handler = get_resource_handler(cls.miningconfig, cls.nlp_helper)
         cls.signavio_auth = SignavioAuthenticator(settings.signavio_url, settings.signavio_user,
                                                   settings.signavio_password, settings.signavio_workspace)
-        cls.log_cache = {}
+        cls.log_cache = LogCache(settings.log_cache_max_bytes, settings.log_cache_policy, exclude=(cls.nlp_helper,))
+        cls.ingestion = IngestionTracker()
+        encoder, cls.encoder_parity = get_checked_encoder(cls.miningconfig, cls.nlp_helper, settings.encoder_backend,
+                                                          settings.encoder_threads, keep_cache=False,
+                                                          max_deviation=settings.encoder_max_deviation)
+        if cls.encoder_parity is not None:
+            _logger.info(f"Encoder parity: {cls.encoder_parity}")
+        store_dir = get_store_dir(cls.miningconfig, None if encoder.name == TORCH else encoder.name)
+        cls.embedding_service = EmbeddingService(cls.nlp_helper, EmbeddingStore(store_dir),
+                                                 settings.embedding_batch_size, settings.embedding_wait_ms, encoder)
+        cls.operand_index = load_operand_index(cls.miningconfig)
+        cls.checking_executor = ProcessPoolExecutor(settings.checking_workers,
+                                                    mp_context=multiprocessing.get_context("spawn")) \
+            if settings.checking_workers > 1 else None
+        # builds the profiles of loaded logs, one at a time, while requests fall back to the operand index
+        cls.profile_executor = ThreadPoolExecutor(1, thread_name_prefix="profile")
         return cls()
 
 
@@ -138,10 +194,80 @@ def create_app(settings: Settings) -> FastAPI:
     def on_startup():
         app.state.state = state
 
+    @app.on_event("shutdown")
+    def on_shutdown():
+        if app.state.state.checking_executor is not None:
+            app.state.state.checking_executor.shutdown(cancel_futures=True)
+        app.state.state.profile_executor.shutdown(wait=False, cancel_futures=True)
+        app.state.state.embedding_service.close()
+
+    def get_cached_log(log: str) -> LoadedLog:
+        """
+        Returns the log from the log cache, (re-)loading it from its snapshot or the raw XES if it is not resident.
+        """
+        def load():
+            event_log, log_info = load_log_and_info(conf=app.state.state.miningconfig,
+                                                    nlp_helper=app.state.state.nlp_helper,
+                                                    process=log)
+            log_info.log_id = log
+            return event_log, log_info
+        try:
+            loaded_log = app.state.state.log_cache.get(log, load)
+        except IndexError as e:
+            _logger.error(f"Error while loading log {log}: {e}")
+            raise HTTPException(status_code=422, detail=f"Log {log} not processable")
+        # start profiling a log as soon as it is loaded, so that the first request does not wait for it
+        get_ready_profile_of(loaded_log)
+        return loaded_log
+
+    def build_profile(loaded_log: LoadedLog):
+        return lambda: get_log_profile(
+            app.state.state.db_client, app.state.state.miningconfig, app.state.state.nlp_helper,
+            loaded_log.log_info, settings.similarity_threshold, app.state.state.embedding_service,
+            app.state.state.embedding_service.encoder.name)
+
+    def get_profile_of(loaded_log: LoadedLog) -> LogProfile:
+        """
+        Returns the profile of a cached log, loading or building it once per cached log.
+        """
+        return loaded_log.derive("profile", build_profile(loaded_log))
+
+    def get_ready_profile_of(loaded_log: LoadedLog) -> Union[LogProfile, None]:
+        """
+        Returns the profile of a cached log if it is ready. Otherwise, loading or building it is started in the
+        background and None is returned.
+        """
+        return loaded_log.derive_in_background("profile", build_profile(loaded_log),
+                                               app.state.state.profile_executor)
+
+    def get_log_index(loaded_log: LoadedLog) -> LogIndex:
+        """
+        Returns the hash-based lookups into the `LogInfo` of a cached log, building them once per cached log.
+        """
+        return loaded_log.derive("log_index", lambda: LogIndex(loaded_log.log_info))
+
+    def get_encoded_log(loaded_log: LoadedLog) -> EncodedLog:
+        """
+        Returns the encoded traces of a cached log, building them once per cached log.
+        """
+        return loaded_log.derive("encoded", lambda: encode_log(
+            app.state.state.miningconfig, loaded_log.event_log,
+            parsed_tasks=parse_activities(app.state.state.miningconfig, loaded_log.event_log,
+                                          app.state.state.nlp_helper)))
+
     @app.get("/health")
     def health():
         return "OK"
 
+    @app.get("/logs/cache")
+    def get_log_cache_stats():
+        return json.dumps(app.state.state.log_cache.stats())
+
+    @app.get("/embeddings/stats")
+    def get_embedding_stats():
+        return json.dumps({**app.state.state.embedding_service.stats(),
+                           "encoder_parity": app.state.state.encoder_parity})
+
     @app.get("/logs")
     def get_all_logs():
         return json.dumps({"logs": [file for file in os.listdir(app.state.state.log_path) if file.endswith(".xes")]})
@@ -189,6 +315,10 @@ def create_app(settings: Settings) -> FastAPI:
         constraint_repository = ConstraintRepository(
               database=app.state.state.db_client.get_database("bestPracticeData"))
         constraint_repository.save(constraint)
+        if app.state.state.operand_index is not None:
+            add_operands(app.state.state.miningconfig, app.state.state.nlp_helper, app.state.state.operand_index,
+                         [constraint], settings.similarity_threshold, settings.operand_index_recall,
+                         app.state.state.embedding_service)
         return constraint.model_dump_json()
 
     class LogConf(BaseModel):
@@ -198,52 +328,47 @@ def create_app(settings: Settings) -> FastAPI:
         unary: bool
         binary: bool
         constraint_levels: List[str]
+        # weight of the similarity in the relevance, min_relevance is used if it is not given
+        semantic_weight: Union[float, None] = None
 
+    class RerankConf(BaseModel):
+        log: str
+        semantic_weight: float
+        min_relevance: float
+        top_k: Union[int, None] = 250
+        min_support: float = 0
+        constraint_levels: Union[List[str], None] = None
 
     @app.put("/constraints/log")
     def get_all_constraints_log(log_conf: LogConf):
         if log_conf.log not in os.listdir(app.state.state.log_path):
             return json.dumps({"constraints": []})
         # load the log from disk into cache
-        if log_conf.log not in app.state.state.log_cache:
-            try:
-                event_log, log_info = get_log_and_info(conf=app.state.state.miningconfig,
-                                                                           nlp_helper=app.state.state.nlp_helper,
-                                                                           process=log_conf.log)
-                log_info.log_id = log_conf.log
-                app.state.state.log_cache[log_conf.log] = (event_log, log_info)
-            except IndexError as e:
-                _logger.error(f"Error while loading log {log_conf.log}: {e}")
-                raise HTTPException(status_code=422, detail=f"Log {log_conf.log} not processable")
+        loaded_log = get_cached_log(log_conf.log)
         arities = []
         if log_conf.unary:
             arities.append(app.state.state.miningconfig.UNARY)
         if log_conf.binary:
             arities.append(app.state.state.miningconfig.BINARY)
 
-        matching_repository = MatchingRepository(
-            database=app.state.state.db_client.get_database("bestPracticeData"))
-        matchings=list(matching_repository.find_by({"log_id": log_conf.log}, sort=[("time_of_matching", -1)]))
-        if len(matchings) > 0:
-            matching = matchings[0]
-            print("Matched on ", matching.time_of_matching)
-            already_fitted = matching.considered_constraints
-        else:
-            already_fitted = []
-
+        # constraints that were matched against the log before are excluded by `get_constraints_for_log_new`
         query = {"level": {"$in": log_conf.constraint_levels},
                 "support": {"$gte": log_conf.min_support},
-                "arity": {"$in": arities},
-                "support": {"$gte": log_conf.min_support},
-                "id": {"$nin": already_fitted}}    
-        print(len(already_fitted), "constraints already fitted")
-        rec_config = RecommendationConfig(app.state.state.miningconfig, semantic_weight=log_conf.min_relevance, top_k=250)
+                "arity": {"$in": arities}}
+        semantic_weight = log_conf.min_relevance if log_conf.semantic_weight is None else log_conf.semantic_weight
+        rec_config = RecommendationConfig(app.state.state.miningconfig, semantic_weight=semantic_weight, top_k=250)
         get_constraints_for_log_new(db_client=app.state.state.db_client,
                                     config=app.state.state.miningconfig,
                                     nlp_helper=app.state.state.nlp_helper,
-                                    log_info=app.state.state.log_cache[log_conf.log][1],
+                                    log_info=loaded_log.log_info,
                                     query=query,
-                                    rec_config=rec_config)
+                                    rec_config=rec_config,
+                                    sim_threshold=settings.similarity_threshold,
+                                    operand_index=app.state.state.operand_index,
+                                    embedding_service=app.state.state.embedding_service,
+                                    # the operand index is only used until the profile of the log is ready
+                                    profile=get_ready_profile_of(loaded_log),
+                                    log_index=get_log_index(loaded_log))
         
         fitted_constraint_repository = FittedConstraintRepository(
             database=app.state.state.db_client.get_database("bestPracticeData"))
@@ -252,15 +377,29 @@ def create_app(settings: Settings) -> FastAPI:
                 "relevance": {"$gte": log_conf.min_relevance},
                 "constraint.level": {"$in": log_conf.constraint_levels},
                 "constraint.support": {"$gte": log_conf.min_support},
-                "constraint.arity": {"$in": arities},
-                "constraint.support": {"$gte": log_conf.min_support},
-                "id": {"$nin": already_fitted}}
+                "constraint.arity": {"$in": arities}}
         res = FittedConstraintCollection(
             constraints=list(fitted_constraint_repository.find_by(query)))
         return res.model_dump_json()
 
+    @app.put("/constraints/log/rerank")
+    def rerank_constraints_log(rerank_conf: RerankConf):
+        """
+        Recomputes the relevance of the constraints that were already fitted to the log from their stored score
+        components, e.g., when the client changes the semantic weight, without matching the catalog again.
+        """
+        query = {"constraint.support": {"$gte": rerank_conf.min_support}}
+        if rerank_conf.constraint_levels is not None:
+            query["constraint.level"] = {"$in": rerank_conf.constraint_levels}
+        res = FittedConstraintCollection(
+            constraints=rerank_constraints(app.state.state.db_client, rerank_conf.log, rerank_conf.semantic_weight,
+                                           rerank_conf.min_relevance, rerank_conf.top_k, query))
+        return res.model_dump_json()
+
     @app.post("/violations")
-    def get_violations(constraint_ids: List[str] = Body()):
+    def get_violations(constraint_ids: List[str] = Body(), checker: str = DECLARE):
+        if checker not in CHECKERS:
+            raise HTTPException(status_code=422, detail=f"Unknown checker {checker}, use one of {list(CHECKERS)}")
         constraint_repository = FittedConstraintRepository(
             database=app.state.state.db_client.get_database("bestPracticeData"))
         constraintsToCheck = list(constraint_repository.find_by({"id": {"$in": constraint_ids}}))
@@ -277,12 +416,14 @@ def create_app(settings: Settings) -> FastAPI:
         constraintsToCheck = [c for c in constraintsToCheck if c.id in constraint_ids]
         all_violations = stored_violations
         if len(constraintsToCheck) > 0:
-            if log not in app.state.state.log_cache:
-                app.state.state.log_cache[log] = get_log_and_info(conf=app.state.state.miningconfig,
-                                                                  nlp_helper=app.state.state.nlp_helper, process=log)
+            loaded_log = get_cached_log(log)
             res = check_constraints(constraintsToCheck, app.state.state.miningconfig, log,
-                                    app.state.state.log_cache[log][0],
-                                    app.state.state.nlp_helper)
+                                    loaded_log.event_log,
+                                    app.state.state.nlp_helper,
+                                    encoded=get_encoded_log(loaded_log),
+                                    executor=app.state.state.checking_executor,
+                                    shard_size=settings.checking_shard_size,
+                                    checker=checker)
             new_violations = []
             for level, violations in res.items():
                 new_violations.extend(violations)
@@ -300,9 +441,11 @@ def create_app(settings: Settings) -> FastAPI:
         if len(stored_violations) == 0:
             return VariantCollection(variants=[]).model_dump_json()
         log = stored_violations[0].log
-        log_info = app.state.state.log_cache[log][1]
-        variants = get_variants(log, app.state.state.log_cache[log][0], app.state.state.miningconfig)
-        violated_variants = get_violated_variants(variants, log_info, stored_violations, app.state.state.miningconfig)
+        loaded_log = get_cached_log(log)
+        variants = get_variants(log, loaded_log.event_log, app.state.state.miningconfig,
+                                encoded=get_encoded_log(loaded_log))
+        violated_variants = get_violated_variants(variants, loaded_log.log_info, stored_violations,
+                                                  app.state.state.miningconfig, log_index=get_log_index(loaded_log))
         if len(violated_variants) > 100:
             # sort descending by frequency
             violated_variants = sorted(violated_variants, key=lambda x: x.variant.frequency, reverse=True)
@@ -312,9 +455,10 @@ def create_app(settings: Settings) -> FastAPI:
     def get_log_variants(log: str = Body()):
         if log not in os.listdir(app.state.state.log_path):
             return json.dumps({"variants": []})
+        loaded_log = get_cached_log(log)
         return VariantCollection(
-            variants=get_variants(log, app.state.state.log_cache[log][0], app.state.state.miningconfig)[
-                     :10]).model_dump_json()
+            variants=get_variants(log, loaded_log.event_log, app.state.state.miningconfig,
+                                  encoded=get_encoded_log(loaded_log))[:10]).model_dump_json()
 
     @app.get("/config")
     def get_config(request: Request):
@@ -328,13 +472,36 @@ def create_app(settings: Settings) -> FastAPI:
         return config
 
     @app.post("/logs")
-    async def upload_file(file: UploadFile = File(...)):
-        file_path = os.path.join(app.state.state.log_path, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
+    async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+        upload_path = os.path.join(app.state.state.log_path, f".{uuid4()}.upload")
+        try:
+            with open(upload_path, "wb") as buffer:
+                while chunk := await file.read(settings.upload_chunk_size):
+                    await run_in_threadpool(buffer.write, chunk)
+            log = await run_in_threadpool(store_uploaded_log, upload_path, file.filename, app.state.state.log_path)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        finally:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+        # the content changed, so neither the cached log nor its snapshot may be served anymore
+        app.state.state.log_cache.invalidate(log)
+        invalidate_snapshots(app.state.state.miningconfig, log)
+        # parse and profile the log and warm the caches after the response has been sent
+        app.state.state.ingestion.set_state(log, PENDING)
+        background_tasks.add_task(app.state.state.ingestion.ingest, log, lambda: get_profile_of(get_cached_log(log)))
         return json.dumps({"logs": [file for file in os.listdir(app.state.state.log_path) if file.endswith(".xes")]})
 
+    @app.get("/logs/{log}/status")
+    def get_log_status(log: str):
+        status = app.state.state.ingestion.get_state(log)
+        if status is None:
+            if log not in os.listdir(app.state.state.log_path):
+                raise HTTPException(status_code=404, detail=f"Log {log} not found")
+            status = {"log": log, "state": READY if log in app.state.state.log_cache else "not loaded",
+                      "error": None, "updated": None}
+        return json.dumps(status)
+
     return app
 
 
@@ -1,18 +1,23 @@
+import logging
+import os
 from datetime import datetime
 
-from uuid import uuid4
+from app.boundary.logsnapshots import get_profile_path
 from app.control.recommender import Recommender
-from app.control.constraint_fitter import FittedConstraintGenerator
+from app.control.constraint_fitter import FittedConstraintGenerator, SIM_THRESHOLD
+from app.control.log_profile import LogProfile, build_log_profile
+from app.control.operand_index import matched_operands
+from app.control.similarity_engine import SimilarityEngine
 from app.control.similarity_computer import SimilarityComputer
 from app.control.util import ok
 
 
-from app.boundary.dbconnect import ConstraintRepository, FittedConstraintRepository, MatchingRepository
+from app.boundary.dbconnect import ConstraintRepository, FittedConstraintRepository, MatchedConstraintRepository
+from app.model.constraint import Constraint
 from app.model.fittedConstraint import FittedConstraint
-from app.model.matching import Matching
-
-
+from app.model.matchedConstraint import MatchedConstraint, get_matched_constraint_id
 
+_logger = logging.getLogger(__name__)
 
 
 def get_constraint_components(config, obj_constraints, multi_obj_constraints, act_constraints, res_constraints):
@@ -28,60 +33,216 @@ def get_constraint_components(config, obj_constraints, multi_obj_constraints, ac
     return objects, labels, resources
 
 
+def get_catalog_components(db_client, config):
+    """
+    Returns the distinct objects, labels and resources of all catalog constraints, as `get_constraint_components`
+    does for a selection of constraints.
+    """
+    collection = ConstraintRepository(database=db_client.get_database("bestPracticeData")).get_collection()
+
+    def distinct(field, level):
+        return [value for value in collection.distinct(field, {"level": level}) if ok(config, value)]
+
+    objects = list(dict.fromkeys(distinct("object_type", config.OBJECT) +
+                                 distinct("right_operand", config.MULTI_OBJECT) +
+                                 distinct("left_operand", config.MULTI_OBJECT)))
+    labels = list(dict.fromkeys(distinct("left_operand", config.ACTIVITY) +
+                                distinct("right_operand", config.ACTIVITY) +
+                                distinct("left_operand", config.RESOURCE)))
+    resources = distinct("object_type", config.RESOURCE)
+    return objects, labels, resources
+
+
+def get_log_profile(db_client, config, nlp_helper, log_info, sim_threshold=SIM_THRESHOLD, embedding_service=None,
+                    encoder=None, action_equivalents=None) -> LogProfile:
+    """
+    Returns the persisted profile of the log, building and persisting it if there is none for the current content
+    of the log, the similarity threshold and the encoder backend.
+    """
+    path = get_profile_path(config, log_info.log_id)
+    if os.path.exists(path):
+        try:
+            profile = LogProfile.load(path)
+            if profile.matches(sim_threshold, encoder):
+                return profile
+        except Exception as e:
+            _logger.warning(f"Discarding unreadable profile of log {log_info.log_id}: {e}")
+    objects, labels, resources = get_catalog_components(db_client, config)
+    profile = build_log_profile(config, nlp_helper, log_info, objects, labels, resources, sim_threshold,
+                                embedding_service, encoder, action_equivalents)
+    try:
+        profile.save(path)
+    except Exception as e:
+        _logger.warning(f"Could not write profile of log {log_info.log_id}: {e}")
+    return profile
+
+
+def filter_by_matches(config, objects, labels, resources, known_objects, known_labels, known_resources,
+                      obj_constraints, multi_obj_constraints, act_constraints, res_constraints):
+    """
+    Drops the constraints with an operand that is known but not among the matched operands of its kind. Operands
+    that are not known are kept.
+    """
+    def matched(operand, matches, known):
+        return not ok(config, operand) or operand not in known or operand in matches
+
+    obj_constraints = [c for c in obj_constraints if matched(c.object_type, objects, known_objects)]
+    multi_obj_constraints = [c for c in multi_obj_constraints
+                             if matched(c.left_operand, objects, known_objects) and
+                             matched(c.right_operand, objects, known_objects)]
+    act_constraints = [c for c in act_constraints
+                       if matched(c.left_operand, labels, known_labels) and
+                       matched(c.right_operand, labels, known_labels)]
+    res_constraints = [c for c in res_constraints
+                       if matched(c.left_operand, labels, known_labels) and
+                       matched(c.object_type, resources, known_resources)]
+    return obj_constraints, multi_obj_constraints, act_constraints, res_constraints
+
+
+def filter_by_operand_index(config, nlp, operand_index, log_info, sim_threshold, obj_constraints,
+                            multi_obj_constraints, act_constraints, res_constraints, embedding_service=None):
+    """
+    Drops the constraints with an operand that is not within `sim_threshold` of any log term of its kind, since
+    the fitter would not instantiate them anyway. Operands that are not in the index are kept.
+    """
+    engine = SimilarityEngine(nlp, embedding_service)
+    objects = matched_operands(operand_index, engine, log_info.objects, sim_threshold)
+    labels = matched_operands(operand_index, engine, log_info.labels, sim_threshold)
+    resources = matched_operands(operand_index, engine, log_info.resources_to_tasks, sim_threshold)
+    return filter_by_matches(config, objects, labels, resources, operand_index, operand_index, operand_index,
+                             obj_constraints, multi_obj_constraints, act_constraints, res_constraints)
+
+
+def filter_by_profile(config, profile: LogProfile, obj_constraints, multi_obj_constraints, act_constraints,
+                      res_constraints):
+    """
+    Like `filter_by_operand_index`, but exact, with the similarities of the log profile.
+    """
+    blocks = [profile.blocks[level] for level in (config.OBJECT, config.ACTIVITY, config.RESOURCE)]
+    matches = [profile.matched_operands(level) for level in (config.OBJECT, config.ACTIVITY, config.RESOURCE)]
+    return filter_by_matches(config, *matches, *blocks, obj_constraints, multi_obj_constraints, act_constraints,
+                             res_constraints)
+
+
 def compute_relevance(config, nlp, obj_constraints, multi_obj_constraints, act_constraints, res_constraints,
-                      objects, labels, resources, log_info, precompute=True) -> list[FittedConstraint]:
-    sim_computer = SimilarityComputer(config, nlp, log_info)
+                      objects, labels, resources, log_info, precompute=True,
+                      sim_threshold=None, embedding_service=None,
+                      action_equivalents=None, profile=None) -> list[FittedConstraint]:
+    sim_computer = SimilarityComputer(config, nlp, log_info, sim_threshold=sim_threshold,
+                                      embedding_service=embedding_service, action_equivalents=action_equivalents,
+                                      profile=profile)
     constraints = sim_computer.compute_similarities(log_info, obj_constraints, multi_obj_constraints, act_constraints,
                                                     res_constraints, objects, labels, resources,
                                                     pre_compute=precompute)
-    nlp.store_sims()
     return constraints
 
 
-def recommend_constraints(config, rec_config, constraints, log_info):
-    constraint_fitter = FittedConstraintGenerator(config, log_info)
-    fitted_constraints = constraint_fitter.fit_constraints(constraints)
-    recommender = Recommender(config, rec_config, log_info)
+def recommend_constraints(config, rec_config, constraints, log_info, sim_threshold=SIM_THRESHOLD,
+                          log_index=None) -> list[FittedConstraint]:
+    constraint_fitter = FittedConstraintGenerator(config, log_info, top_k=rec_config.top_k)
+    fitted_constraints = constraint_fitter.fit_constraints(constraints, sim_threshold=sim_threshold)
+    recommender = Recommender(config, rec_config, log_info, log_index)
     selected_constraints = recommender.recommend_by_activation(fitted_constraints)
     recommended_constraints = recommender.recommend(selected_constraints)
-    return recommended_constraints
-
-
-def get_constraints_for_log_new(db_client, config, nlp_helper, log_info, query, rec_config):
+    # only the instantiations that survived activation and relevance filtering become models
+    return [constraint.materialize() for constraint in recommended_constraints]
+
+
+def get_rerank_pipeline(log_id, semantic_weight, min_relevance, top_k=None, query=None) -> list[dict]:
+    """
+    Returns the aggregation pipeline that recomputes the relevance of the fitted constraints of the log from their
+    stored components for `semantic_weight`, as `Recommender.recommend` does, and keeps those of at least
+    `min_relevance` relevance, at most `top_k` per level, most relevant first.
+    The per-level ranking with `$setWindowFields` needs MongoDB 5.0 or later.
+    """
+    match = {"log": log_id, "normalized_support": {"$ne": None}, "sim_score": {"$ne": None}}
+    match.update(query or {})
+    relevance = {"$add": [{"$multiply": [1 - semantic_weight, "$normalized_support"]},
+                          {"$multiply": [semantic_weight, "$sim_score"]}]}
+    pipeline = [{"$match": match},
+                {"$set": {"relevance": {"$cond": [{"$gt": ["$constraint.support", 0]}, relevance, 0]}}},
+                {"$match": {"relevance": {"$gte": min_relevance}}}]
+    if top_k is not None:
+        pipeline += [{"$setWindowFields": {"partitionBy": "$constraint.level", "sortBy": {"relevance": -1},
+                                           "output": {"rank": {"$documentNumber": {}}}}},
+                     {"$match": {"rank": {"$lte": top_k}}},
+                     {"$unset": "rank"}]
+    return pipeline + [{"$sort": {"relevance": -1}}]
+
+
+def rerank_constraints(db_client, log_id, semantic_weight, min_relevance, top_k=None,
+                       query=None) -> list[FittedConstraint]:
+    """
+    Re-ranks the stored fitted constraints of the log in the database, without matching them again.
+    """
+    fitted_constraint_repository = FittedConstraintRepository(database=db_client.get_database("bestPracticeData"))
+    pipeline = get_rerank_pipeline(log_id, semantic_weight, min_relevance, top_k, query)
+    return [fitted_constraint_repository.to_model(document)
+            for document in fitted_constraint_repository.get_collection().aggregate(pipeline)]
+
+
+def get_unmatched_pipeline(log_id, query) -> list[dict]:
+    """
+    Returns the aggregation pipeline that selects the catalog constraints of `query` that were not matched against
+    the log yet, as an anti-join with their markers, each looked up by the unique (log_id, constraint_id) index.
+    """
+    return [{"$match": query},
+            {"$lookup": {"from": MatchedConstraintRepository.Meta.collection_name, "localField": "_id",
+                         "foreignField": "constraint_id",
+                         "pipeline": [{"$match": {"log_id": log_id}}, {"$limit": 1}, {"$project": {"_id": 1}}],
+                         "as": "matched"}},
+            {"$match": {"matched": {"$size": 0}}},
+            {"$unset": "matched"}]
+
+
+def find_unmatched_constraints(db_client, log_id, query) -> list[Constraint]:
     constraint_repository = ConstraintRepository(database=db_client.get_database("bestPracticeData"))
-    obj_query = query.copy()
-    obj_query["level"] = config.OBJECT
-    obj_constraints = list(constraint_repository.find_by(obj_query))
-
-    multi_obj_query = query.copy()
-    multi_obj_query["level"] = config.MULTI_OBJECT
-    multi_obj_constraints = list(constraint_repository.find_by(multi_obj_query))
-
-    act_query = query.copy()
-    act_query["level"] = config.ACTIVITY
-    act_constraints = list(constraint_repository.find_by(act_query))
-
-    res_query = query.copy()
-    res_query["level"] = config.RESOURCE
-    res_constraints = list(constraint_repository.find_by(res_query))
+    return [constraint_repository.to_model(document)
+            for document in constraint_repository.get_collection().aggregate(get_unmatched_pipeline(log_id, query))]
+
+
+def mark_as_matched(db_client, log_id, constraints):
+    matched_constraint_repository = MatchedConstraintRepository(database=db_client.get_database("bestPracticeData"))
+    time_of_matching = datetime.now()
+    markers = [MatchedConstraint(id=get_matched_constraint_id(log_id, constraint.id), log_id=log_id,
+                                 constraint_id=constraint.id, time_of_matching=time_of_matching)
+               for constraint in constraints]
+    if len(markers) > 0:
+        matched_constraint_repository.save_many(markers)
+
+
+def get_constraints_for_log_new(db_client, config, nlp_helper, log_info, query, rec_config,
+                                sim_threshold=SIM_THRESHOLD, operand_index=None, embedding_service=None,
+                                action_equivalents=None, profile=None, log_index=None):
+    # only the catalog constraints that were not matched against the log before
+    obj_constraints = find_unmatched_constraints(db_client, log_info.log_id, query | {"level": config.OBJECT})
+    multi_obj_constraints = find_unmatched_constraints(db_client, log_info.log_id,
+                                                       query | {"level": config.MULTI_OBJECT})
+    act_constraints = find_unmatched_constraints(db_client, log_info.log_id, query | {"level": config.ACTIVITY})
+    res_constraints = find_unmatched_constraints(db_client, log_info.log_id, query | {"level": config.RESOURCE})
+    considered_consts = obj_constraints + multi_obj_constraints + act_constraints + res_constraints
+    if profile is not None:
+        obj_constraints, multi_obj_constraints, act_constraints, res_constraints = filter_by_profile(
+            config, profile, obj_constraints, multi_obj_constraints, act_constraints, res_constraints)
+    elif operand_index is not None:
+        obj_constraints, multi_obj_constraints, act_constraints, res_constraints = filter_by_operand_index(
+            config, nlp_helper, operand_index, log_info, sim_threshold, obj_constraints, multi_obj_constraints,
+            act_constraints, res_constraints, embedding_service)
     objects, labels, resources = get_constraint_components(config, obj_constraints, multi_obj_constraints,
                                                            act_constraints, res_constraints)
-    nlp_helper.pre_compute_embeddings(sentences=objects + labels + resources)
     constraints_with_similarity = compute_relevance(config, nlp_helper, obj_constraints, multi_obj_constraints,
                                                     act_constraints, res_constraints, objects, labels, resources,
-                                                    log_info, precompute=True)
-    matching_repository = MatchingRepository(database=db_client.get_database("bestPracticeData"))
-    considered_consts = obj_constraints + multi_obj_constraints + act_constraints + res_constraints
-    cons_ids = [constraint.id for constraint in considered_consts]
-    const_ids = cons_ids + query["id"]["$nin"]
-    matching_repository.save(Matching(id=str(uuid4()), 
-                                        log_id=log_info.log_id, 
-                                        considered_constraints=const_ids,
-                                        time_of_matching=datetime.now()
-                                        ))
-    recommended_constraints = recommend_constraints(config, rec_config, constraints_with_similarity, log_info)
+                                                    log_info, precompute=True, sim_threshold=sim_threshold,
+                                                    embedding_service=embedding_service,
+                                                    action_equivalents=action_equivalents, profile=profile)
+    recommended_constraints = recommend_constraints(config, rec_config, constraints_with_similarity, log_info,
+                                                    sim_threshold=sim_threshold, log_index=log_index)
     fitted_constraint_repository = FittedConstraintRepository(database=db_client.get_database("bestPracticeData"))
-    fitted_constraint_repository.save_many(recommended_constraints)
+    if len(recommended_constraints) > 0:
+        fitted_constraint_repository.save_many(recommended_constraints)
+    # marked only once their fitted constraints are stored. This includes the constraints whose instantiations were
+    # all cut by top_k or the relevance threshold, which are not matched again for the log
+    mark_as_matched(db_client, log_info.log_id, considered_consts)
     return list(fitted_constraint_repository.find_by({"log": log_info.log_id}))
 
 
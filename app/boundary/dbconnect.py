@@ -1,5 +1,7 @@
+import logging
 import os
 
+from pymongo import ASCENDING, DESCENDING, IndexModel
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from pydantic_mongo import AbstractRepository
@@ -7,23 +9,46 @@ from pydantic_mongo import AbstractRepository
 from app.model.configuration import AppConfiguration
 from app.model.constraint import Constraint
 from app.model.fittedConstraint import FittedConstraint
+from app.model.matchedConstraint import MatchedConstraint, get_matched_constraint_id
 from app.model.matching import Matching
 from app.model.violation import Violation
 
+_logger = logging.getLogger(__name__)
+
+# Each repository lists the indexes of its collection and the shapes (filter, sort) of the queries that the app runs
+# on it, which `check_hot_queries` explains. Model ids are stored as `_id`, which MongoDB always indexes.
+
 
 class ConstraintRepository(AbstractRepository[Constraint]):
     class Meta:
         collection_name = "bestpractices"
+        # catalog queries per level in get_constraints_for_log_new and the support filter of GET /constraints
+        indexes = [IndexModel([("level", ASCENDING), ("arity", ASCENDING), ("support", ASCENDING)],
+                              name="level_arity_support"),
+                   IndexModel([("support", ASCENDING)], name="support")]
+        hot_queries = [({"level": "", "support": {"$gte": 1}, "arity": {"$in": [""]}}, None),
+                       ({"support": {"$gte": 2}}, None)]
 
 
 class FittedConstraintRepository(AbstractRepository[FittedConstraint]):
     class Meta:
         collection_name = "fittedconstraints"
+        # PUT /constraints/log and its re-ranking filter the constraints of a log by level, arity and relevance
+        indexes = [IndexModel([("log", ASCENDING), ("constraint.level", ASCENDING), ("constraint.arity", ASCENDING),
+                               ("relevance", DESCENDING)], name="log_level_arity_relevance")]
+        hot_queries = [({"log": ""}, None),
+                       ({"log": "", "relevance": {"$gte": 0}, "constraint.level": {"$in": [""]},
+                         "constraint.support": {"$gte": 1}, "constraint.arity": {"$in": [""]}}, None),
+                       ({"log": "", "normalized_support": {"$ne": None}, "sim_score": {"$ne": None},
+                         "constraint.support": {"$gte": 0}, "constraint.level": {"$in": [""]}}, None)]
 
 
 class ViolationRepository(AbstractRepository[Violation]):
     class Meta:
         collection_name = "violations"
+        # POST /violations looks up the stored violations of constraints of a log
+        indexes = [IndexModel([("log", ASCENDING), ("constraint.id", ASCENDING)], name="log_constraint")]
+        hot_queries = [({"constraint.id": {"$in": [""]}, "log": ""}, None)]
 
 
 class AppConfigurationRepository(AbstractRepository[AppConfiguration]):
@@ -32,8 +57,100 @@ class AppConfigurationRepository(AbstractRepository[AppConfiguration]):
 
 
 class MatchingRepository(AbstractRepository[Matching]):
+    """
+    Matchings used to list all constraints considered for a log so far; they are only read to migrate them to
+    `MatchedConstraintRepository`.
+    """
     class Meta:
         collection_name = "matchings"
+        # the index on (log_id, time_of_matching) that served the lookup of the newest matching of a log
+        obsolete_indexes = ["log_time"]
+
+
+class MatchedConstraintRepository(AbstractRepository[MatchedConstraint]):
+    class Meta:
+        collection_name = "matchedconstraints"
+        # one marker per log and constraint, looked up for every candidate of the catalog query
+        indexes = [IndexModel([("log_id", ASCENDING), ("constraint_id", ASCENDING)], name="log_constraint",
+                              unique=True)]
+        hot_queries = [({"log_id": "", "constraint_id": ""}, None)]
+
+
+REPOSITORIES = [ConstraintRepository, FittedConstraintRepository, ViolationRepository, AppConfigurationRepository,
+                MatchingRepository, MatchedConstraintRepository]
+
+
+def ensure_indexes(client):
+    """
+    Creates the indexes of all repositories. Existing indexes with the same name and keys are left as they are.
+    """
+    database = client.get_database("bestPracticeData")
+    for repository_class in REPOSITORIES:
+        indexes = getattr(repository_class.Meta, "indexes", [])
+        if len(indexes) > 0:
+            created = repository_class(database=database).get_collection().create_indexes(indexes)
+            _logger.info(f"Ensured indexes {created} on {repository_class.Meta.collection_name}")
+
+
+def migrate_matchings(client, batch_size=1000):
+    """
+    Turns the considered constraints of the stored matchings into markers of `MatchedConstraintRepository` and
+    deletes the matchings and their obsolete indexes.
+    """
+    database = client.get_database("bestPracticeData")
+    matching_repository = MatchingRepository(database=database)
+    matching_collection = matching_repository.get_collection()
+    matched_constraint_repository = MatchedConstraintRepository(database=database)
+    for document in matching_collection.find({}):
+        matching = matching_repository.to_model(document)
+        markers = [MatchedConstraint(id=get_matched_constraint_id(matching.log_id, constraint_id),
+                                     log_id=matching.log_id, constraint_id=constraint_id,
+                                     time_of_matching=matching.time_of_matching)
+                   for constraint_id in dict.fromkeys(matching.considered_constraints)]
+        for start in range(0, len(markers), batch_size):
+            matched_constraint_repository.save_many(markers[start:start + batch_size])
+        matching_collection.delete_one({"_id": matching.id})
+        _logger.info(f"Migrated matching {matching.id} of log {matching.log_id} with {len(markers)} constraints")
+    existing_indexes = matching_collection.index_information()
+    for index in MatchingRepository.Meta.obsolete_indexes:
+        if index in existing_indexes:
+            matching_collection.drop_index(index)
+            _logger.info(f"Dropped index {index} on {MatchingRepository.Meta.collection_name}")
+
+
+def _plan_stages(plan) -> set:
+    """
+    Returns the stages of a query plan of `explain()` and of all its input stages.
+    """
+    stages = {plan["stage"]} if "stage" in plan else set()
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages |= _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages |= _plan_stages(child)
+    return stages
+
+
+def check_hot_queries(client) -> list[dict]:
+    """
+    Explains the hot queries of all repositories and returns, per query, whether its winning plan scans an index
+    or the whole collection. Run by miner.py, not on app startup.
+    """
+    database = client.get_database("bestPracticeData")
+    results = []
+    for repository_class in REPOSITORIES:
+        collection = repository_class(database=database).get_collection()
+        for query, sort in getattr(repository_class.Meta, "hot_queries", []):
+            cursor = collection.find(query)
+            if sort is not None:
+                cursor = cursor.sort(sort)
+            stages = _plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+            uses_index = "COLLSCAN" not in stages and any("IXSCAN" in stage for stage in stages)
+            if not uses_index:
+                _logger.warning(f"Query {query} on {collection.name} does not use an index: {sorted(stages)}")
+            results.append({"collection": collection.name, "query": query, "sort": sort, "uses_index": uses_index,
+                            "stages": sorted(stages)})
+    return results
 
 
 def get_all_constraints(client):
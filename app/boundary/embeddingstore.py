@@ -0,0 +1,128 @@
+"""
+On-disk store of sentence embeddings that is shared by all worker processes.
+
+Embeddings are kept in an append-only float16 matrix file that every process memory-maps read-only, together with an
+append-only term file (one JSON-encoded term per line) whose n-th line names the n-th row. New terms are appended
+under a file lock: rows are written before their terms, so readers never see a term without its embedding, and a
+writer that crashed in between leaves trailing rows that the next writer overwrites.
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from filelock import FileLock
+
+_logger = logging.getLogger(__name__)
+
+STORE_DIR = "embeddings"
+MATRIX_FILE = "embeddings.f16"
+TERMS_FILE = "terms.jsonl"
+META_FILE = "meta.json"
+LOCK_FILE = "embeddings.lock"
+DTYPE = np.float16
+
+
+def get_store_dir(conf, backend=None) -> Path:
+    """
+    Returns the store of the default encoder or, since the embeddings of different encoder backends must not be
+    mixed, the store of `backend`.
+    """
+    store_dir = Path(conf.DATA_INTERIM) / (STORE_DIR if backend is None else f"{STORE_DIR}-{backend}")
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    return store_dir
+
+
+class EmbeddingStore:
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.matrix_path = self.store_dir / MATRIX_FILE
+        self.terms_path = self.store_dir / TERMS_FILE
+        self.meta_path = self.store_dir / META_FILE
+        self.lock = FileLock(str(self.store_dir / LOCK_FILE))
+        self.dtype = DTYPE
+        self.dim = None
+        self.rows = {}
+        self._terms_offset = 0
+        self._n_rows = 0
+        self._matrix = None
+        # guards the term index of this process, the file lock guards the files across processes
+        self._refresh_lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return self._n_rows
+
+    def __contains__(self, term):
+        return term in self.rows
+
+    def refresh(self):
+        """
+        Picks up the terms that other processes appended since the last refresh.
+        """
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        if self.dim is None and os.path.exists(self.meta_path):
+            self.dim = json.loads(self.meta_path.read_text())["dim"]
+        if not os.path.exists(self.terms_path):
+            return
+        with open(self.terms_path, "rb") as f:
+            f.seek(self._terms_offset)
+            lines = f.read()
+        # a line that is still being written has no newline yet
+        complete = lines[:lines.rfind(b"\n") + 1]
+        new_terms = [json.loads(line) for line in complete.splitlines()]
+        n_rows = self._n_rows + len(new_terms)
+        # map the new rows before their terms become visible to concurrent readers
+        if n_rows > 0 and (self._matrix is None or len(self._matrix) < n_rows):
+            self._matrix = np.memmap(self.matrix_path, dtype=DTYPE, mode="r", shape=(n_rows, self.dim))
+        for i, term in enumerate(new_terms):
+            self.rows.setdefault(term, self._n_rows + i)
+        self._n_rows = n_rows
+        self._terms_offset += len(complete)
+
+    def get(self, terms):
+        """
+        Returns the float32 embeddings of the stored terms (one row per term, in order) and the terms that are not
+        stored.
+        """
+        if any(term not in self.rows for term in terms):
+            self.refresh()
+        found = [term for term in terms if term in self.rows]
+        missing = [term for term in terms if term not in self.rows]
+        if len(found) == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32), missing
+        return self._matrix[[self.rows[term] for term in found]].astype(np.float32), missing
+
+    def add(self, terms, embeddings):
+        """
+        Appends the embeddings of terms that are not stored yet.
+        """
+        embeddings = np.asarray(embeddings)
+        with self.lock:
+            self.refresh()
+            positions = {term: i for i, term in enumerate(terms) if term not in self.rows}
+            if len(positions) == 0:
+                return 0
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                self.meta_path.write_text(json.dumps({"dim": self.dim}))
+            new_rows = embeddings[list(positions.values())].astype(DTYPE)
+            with open(self.matrix_path, "ab") as f:
+                # drop rows of a writer that crashed before it could append their terms
+                f.truncate(self._n_rows * self.dim * np.dtype(DTYPE).itemsize)
+                f.write(new_rows.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.terms_path, "ab") as f:
+                f.write(b"".join(json.dumps(term).encode() + b"\n" for term in positions))
+            self.refresh()
+        _logger.info(f"Stored the embeddings of {len(positions)} new terms ({len(self.rows)} in total)")
+        return len(positions)
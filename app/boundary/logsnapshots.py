@@ -0,0 +1,154 @@
+"""
+Disk-backed snapshots of parsed event logs.
+
+Parsing a raw XES file (and building its `LogInfo`) is by far the slowest step when a log is opened for the
+first time after a restart. After the first parse we therefore write the columns of the event log that the app
+actually uses as an uncompressed Arrow IPC (feather) file, together with a pickled `LogInfo`. Snapshots are keyed by
+a content hash of the XES file, so a log that is overwritten via `POST /logs` can never be served from a stale
+snapshot. The `LogProfile` of a log is kept next to its snapshot under the same key.
+"""
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+
+import pyarrow.feather as feather
+from semconstmining.log.loginfo import LogInfo
+from semconstmining.main import get_log_and_info
+
+_logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = "log_snapshots"
+LOG_SUFFIX = ".feather"
+INFO_SUFFIX = ".loginfo.pkl"
+PROFILE_SUFFIX = ".profile.npz"
+HASH_CHUNK_SIZE = 1 << 20
+
+# (path, size, mtime) -> digest, so that unchanged logs are only hashed once per process
+_digest_memo = {}
+
+
+def get_snapshot_dir(conf) -> Path:
+    snapshot_dir = Path(conf.DATA_INTERIM) / SNAPSHOT_DIR
+    if not os.path.exists(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    return snapshot_dir
+
+
+def get_content_hash(file_path) -> str:
+    """
+    Returns the sha256 digest of the file at `file_path`.
+    """
+    stat = os.stat(file_path)
+    memo_key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _digest_memo:
+        return _digest_memo[memo_key]
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    _digest_memo[memo_key] = digest.hexdigest()
+    return _digest_memo[memo_key]
+
+
+def _snapshot_paths(conf, process, digest):
+    base = get_snapshot_dir(conf) / f"{process}-{digest[:16]}"
+    return base.with_name(base.name + LOG_SUFFIX), base.with_name(base.name + INFO_SUFFIX)
+
+
+def get_profile_path(conf, process) -> Path:
+    base = get_snapshot_dir(conf) / f"{process}-{get_content_hash(Path(conf.DATA_LOGS) / process)[:16]}"
+    return base.with_name(base.name + PROFILE_SUFFIX)
+
+
+def _used_columns(conf, event_log):
+    return [column for column in (conf.XES_CASE, conf.XES_NAME, conf.XES_ROLE, conf.XES_TIME)
+            if column in event_log.columns]
+
+
+def _dump_atomically(path: Path, write):
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(conf, nlp_helper, process, event_log, log_info):
+    """
+    Writes the used columns of `event_log` and the serialized `log_info` for `process`.
+    References to the nlp helper and the event log itself are not serialized but re-attached on load.
+    """
+    log_path, info_path = _snapshot_paths(conf, process, get_content_hash(Path(conf.DATA_LOGS) / process))
+    detached = {}
+    info_state = {}
+    for key, value in vars(log_info).items():
+        if value is nlp_helper:
+            detached[key] = "nlp_helper"
+        elif value is event_log:
+            detached[key] = "event_log"
+        else:
+            info_state[key] = value
+    columns = _used_columns(conf, event_log)
+    _dump_atomically(log_path, lambda p: feather.write_feather(event_log[columns].reset_index(drop=True), p,
+                                                               compression="uncompressed"))
+    _dump_atomically(info_path, lambda p: p.write_bytes(pickle.dumps((info_state, detached))))
+    _logger.info(f"Wrote snapshot of log {process} to {log_path}")
+
+
+def load_snapshot(conf, nlp_helper, process):
+    """
+    Returns the snapshotted (event_log, log_info) of `process`, or None if there is no up-to-date snapshot.
+    """
+    log_path, info_path = _snapshot_paths(conf, process, get_content_hash(Path(conf.DATA_LOGS) / process))
+    if not os.path.exists(log_path) or not os.path.exists(info_path):
+        return None
+    try:
+        # the used columns are strings and timestamps, which pandas holds as copies, so the file is read rather
+        # than memory-mapped and the Arrow buffers are released column by column while they are converted
+        event_log = feather.read_table(log_path).to_pandas(split_blocks=True, self_destruct=True)
+        info_state, detached = pickle.loads(info_path.read_bytes())
+    except Exception as e:
+        _logger.warning(f"Discarding unreadable snapshot of log {process}: {e}")
+        # the profile written for the same content stays valid
+        for path in (log_path, info_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+    log_info = LogInfo.__new__(LogInfo)
+    log_info.__dict__.update(info_state)
+    for key, ref in detached.items():
+        setattr(log_info, key, nlp_helper if ref == "nlp_helper" else event_log)
+    return event_log, log_info
+
+
+def invalidate_snapshots(conf, process, keep_digest=None):
+    """
+    Removes the snapshots and profiles of `process`, except those written for the content hash `keep_digest`.
+    """
+    snapshot_dir = get_snapshot_dir(conf)
+    for file in os.listdir(snapshot_dir):
+        for suffix in (LOG_SUFFIX, INFO_SUFFIX, PROFILE_SUFFIX):
+            if not file.endswith(suffix):
+                continue
+            name, _, digest = file[:-len(suffix)].rpartition("-")
+            if name == process and (keep_digest is None or digest != keep_digest[:16]):
+                os.remove(snapshot_dir / file)
+
+
+def load_log_and_info(conf, nlp_helper, process):
+    """
+    Drop-in replacement for `get_log_and_info` that serves the log from its snapshot if possible and
+    writes a snapshot after parsing otherwise.
+    """
+    snapshot = load_snapshot(conf, nlp_helper, process)
+    if snapshot is not None:
+        _logger.info(f"Loaded log {process} from snapshot")
+        return snapshot
+    event_log, log_info = get_log_and_info(conf=conf, nlp_helper=nlp_helper, process=process)
+    # snapshots of earlier content are stale, while the profile of the current content is still valid
+    invalidate_snapshots(conf, process, keep_digest=get_content_hash(Path(conf.DATA_LOGS) / process))
+    try:
+        write_snapshot(conf, nlp_helper, process, event_log, log_info)
+    except Exception as e:
+        _logger.warning(f"Could not write snapshot of log {process}: {e}")
+    return event_log, log_info
@@ -1,27 +1,40 @@
 from typing import List
 from collections import Counter
-import pm4py
+import numpy as np
 from pm4py.objects.log.obj import EventLog, Trace, Event
-from pandas import DataFrame
 
+from app.control.encoded_log import EncodedLog, encode_log, parse_activities, table_mask
+from app.control.native_checker import check_traces, split_supported
 from app.model.fittedConstraint import FittedConstraint
-from semconstmining.mining.model.parsed_label import get_dummy
 from semconstmining.declare.declare import Declare
 from semconstmining.declare.parsers import parse_decl
 from uuid import uuid4
 
 from app.model.violation import Violation
 
+DECLARE = "declare"
+NATIVE = "native"
+CHECKERS = (DECLARE, NATIVE)
 
-def verify_violations(tmp_res, log):
-    counts = Counter(const for vals in tmp_res.values() for const in vals)
-    res = {key: {val for val in vals if counts[val] <= 0.9 * len(log)} for key, vals in tmp_res.items()}
+
+def verify_violations(tmp_res, case_variants):
+    """
+    Drops violations of constraints that are violated by more than 90% of the cases.
+    `tmp_res` holds the violations per distinct trace, `case_variants` maps each case to its distinct trace.
+    """
+    frequencies = Counter(case_variants.values())
+    counts = Counter()
+    for key, vals in tmp_res.items():
+        for const in vals:
+            counts[const] += frequencies[key]
+    res = {key: {val for val in vals if counts[val] <= 0.9 * len(case_variants)} for key, vals in tmp_res.items()}
     return res
 
 
-def get_violations_to_cases(violations):
+def get_violations_to_cases(violations, case_variants):
     violation_to_cases = {}
-    for case, case_violations in violations.items():
+    for case, variant in case_variants.items():
+        case_violations = violations.get(variant, ())
         if len(case_violations) > 0:
             for violation in case_violations:
                 if violation not in violation_to_cases:
@@ -30,164 +43,304 @@ def get_violations_to_cases(violations):
     return violation_to_cases
 
 
-def get_filtered_traces(config, log: DataFrame, parsed_tasks=None, with_resources=False):
-    if parsed_tasks is not None:
-        if with_resources:
-            res = {trace_id: [(parsed_tasks[event[config.XES_NAME]], event[config.XES_ROLE]) if event[config.XES_NAME] in parsed_tasks else get_dummy(config, event[config.XES_NAME], config.EN)
-                              for event_index, event in
-                              trace.iterrows()] for trace_id, trace in log.groupby(config.XES_CASE)}
-            return res
-        else:
-            res = {trace_id: [parsed_tasks[event[config.XES_NAME]] if event[config.XES_NAME] in parsed_tasks else get_dummy(config, event[config.XES_NAME], config.EN)
-                              for event_index, event in
-                              trace.iterrows()] for trace_id, trace in log.groupby(config.XES_CASE)}
-            return res
+def _project(encoded: EncodedLog, config, positions, codes, table, keep_empty=False, with_resources=False):
+    """
+    Projects each case onto its events at the (ascending) `positions`, named after `table[codes[event]]`.
+    Cases without such events are left out unless `keep_empty` is set.
+
+    Cases with identical projections share one trace, which is named after the first of these cases.
+    Returns the `EventLog` of these distinct traces and a dict that maps each projected case to the name of its trace.
+    """
+    projection = EventLog()
+    case_variants = {}
+    variants = {}
+    names = list(table)
+    if with_resources:
+        roles = [res.replace(" and ", " & ") if type(res) == str else "unknown" for res in
+                 (encoded.roles if encoded.roles is not None else [])] + ["unknown"]
+        role_codes = (encoded.role_codes if encoded.role_codes is not None else
+                      np.full(len(codes), -1, dtype=np.int32))
+    if keep_empty:
+        cases = np.arange(encoded.n_cases)
+        bounds = np.searchsorted(positions, encoded.offsets)
     else:
-        res = {trace_id: [event[config.XES_NAME] for event_idx, event in trace.iterrows()] for trace_id, trace
-               in
-               log.groupby(config.XES_CASE)}
-        return res
+        cases, starts = np.unique(np.searchsorted(encoded.offsets, positions, side="right") - 1, return_index=True)
+        bounds = np.append(starts, len(positions))
+    for i, case in enumerate(cases):
+        trace_id = encoded.case_ids[case]
+        selected = positions[bounds[i]:bounds[i + 1]]
+        key = codes[selected].tobytes() + (role_codes[selected].tobytes() if with_resources else b"")
+        if key not in variants:
+            variants[key] = trace_id
+            tmp_trace = Trace()
+            tmp_trace.attributes[config.XES_NAME] = trace_id
+            for pos in selected:
+                event = Event({config.XES_NAME: names[codes[pos]]})
+                if with_resources:
+                    event[config.XES_ROLE] = roles[role_codes[pos]]
+                tmp_trace.append(event)
+            projection.append(tmp_trace)
+        case_variants[trace_id] = variants[key]
+    return projection, case_variants
 
 
-def object_action_log_projection(obj, traces, config):
+def object_action_log_projections(encoded: EncodedLog, config, objects):
+    """
+    Computes `object_action_log_projection` for all given `objects` in a single pass over the log.
+
+    Returns
+    -------
+    projections
+        the projection and case variants of each object that occurs in the log with at least one action.
+    """
+    if encoded is None:
+        raise RuntimeError("You must load a log before.")
+    keep = (table_mask(encoded.objects, objects)[encoded.object_codes] &
+            ~table_mask(encoded.actions, [""])[encoded.action_codes])
+    positions = np.flatnonzero(keep)
+    # group the events by object, the stable sort keeps them in log order within each group
+    positions = positions[np.argsort(encoded.object_codes[positions], kind="stable")]
+    group_codes = encoded.object_codes[positions]
+    bounds = np.append(np.flatnonzero(np.diff(group_codes, prepend=-2)), len(positions))
+    return {encoded.objects[group_codes[start]]: _project(encoded, config, positions[start:end],
+                                                          encoded.action_codes, encoded.actions)
+            for start, end in zip(bounds[:-1], bounds[1:])}
+
+
+def object_action_log_projection(obj, encoded: EncodedLog, config):
     """
     Return for each trace a time-ordered list of the actions for a given object type.
 
     Returns
     -------
     projection
-        traces containing only actions applied to the same obj.
+        distinct traces containing only actions applied to the same obj.
+    case_variants
+        the name of the trace in projection for each case.
     """
-    projection = EventLog()
-    if traces is None:
-        raise RuntimeError("You must load a log before.")
-    for trace_id, trace in traces.items():
-        tmp_trace = Trace()
-        tmp_trace.attributes[config.XES_NAME] = trace_id
-        for parsed in trace:
-            if parsed.main_object == obj:
-                if parsed.main_action != "":
-                    event = Event({config.XES_NAME: parsed.main_action})
-                    tmp_trace.append(event)
-        if len(tmp_trace) > 0:
-            projection.append(tmp_trace)
-    return projection
+    return object_action_log_projections(encoded, config, [obj]).get(obj, (EventLog(), {}))
 
 
-def object_log_projection(traces, config):
+def object_log_projection(encoded: EncodedLog, config):
     """
     Return for each trace a time-ordered list of the actions for a given object type.
 
     Returns
     -------
     projection
-        traces containing only actions applied to the same obj.
+        distinct traces containing only actions applied to the same obj.
+    case_variants
+        the name of the trace in projection for each case.
     """
-    projection = EventLog()
-    if traces is None:
+    if encoded is None:
         raise RuntimeError("You must load a log before.")
-    for trace_id, trace in traces.items():
-        tmp_trace = Trace()
-        tmp_trace.attributes[config.XES_NAME] = trace_id
-        last = ""
-        for parsed in trace:
-            if parsed.main_object not in config.TERMS_FOR_MISSING and parsed.main_object != last:
-                event = Event({config.XES_NAME: parsed.main_object})
-                tmp_trace.append(event)
-            last = parsed.main_object
-        projection.append(tmp_trace)
-    return projection
+    codes = encoded.object_codes
+    # an object is only kept if it differs from the one of the preceding event of the same trace
+    changed = np.ones(len(codes), dtype=bool)
+    changed[1:] = codes[1:] != codes[:-1]
+    starts = encoded.offsets[:-1]
+    changed[starts] = ~table_mask(encoded.objects, [""])[codes[starts]]
+    keep = changed & ~table_mask(encoded.objects, config.TERMS_FOR_MISSING)[codes]
+    return _project(encoded, config, np.flatnonzero(keep), codes, encoded.objects, keep_empty=True)
 
 
-def clean_log_projection(traces, config, with_resources=False):
+def clean_log_projection(encoded: EncodedLog, config, with_resources=False):
     """
-    Same log, just with clean labels.
+    Same log, just with clean labels. Returns the distinct traces and the name of the trace of each case.
     """
-    projection = EventLog()
-    if traces is None:
+    if encoded is None:
         raise RuntimeError("You must load a log before.")
-    for trace_id, trace in traces.items():
-        tmp_trace = Trace()
-        tmp_trace.attributes[config.XES_NAME] = trace_id
-        if with_resources:
-            for parsed, res in trace:
-                if parsed.label not in config.TERMS_FOR_MISSING:
-                    event = Event({config.XES_NAME: parsed.label})
-                    event[config.XES_ROLE] = res.replace(" and ", " & ") if type(
-                        res) == str else "unknown"
-                    tmp_trace.append(event)
-        else:
-            for parsed in trace:
-                if parsed.label not in config.TERMS_FOR_MISSING:
-                    event = Event({config.XES_NAME: parsed.label})
-                    tmp_trace.append(event)
-        if len(tmp_trace) > 0:
-            projection.append(tmp_trace)
-    return projection
+    keep = ~table_mask(encoded.labels, config.TERMS_FOR_MISSING)[encoded.label_codes]
+    return _project(encoded, config, np.flatnonzero(keep), encoded.label_codes, encoded.labels,
+                    with_resources=with_resources)
 
 
-def check_and_add_violations(d4py, constraint_strings_to_constraint, log):
+def _collect_violations(tmp_res, constraint_strings_to_constraint, log, case_variants):
     violations = []
-    d4py.model = parse_decl(constraint_strings_to_constraint.keys())
-    tmp_res = d4py.conformance_checking(consider_vacuity=True)
-    res = verify_violations(tmp_res, d4py.log)
-    violations_to_cases = get_violations_to_cases(res)
+    res = verify_violations(tmp_res, case_variants)
+    violations_to_cases = get_violations_to_cases(res, case_variants)
     for key, val in violations_to_cases.items():
         violations.append(Violation(id=str(uuid4()), log=log, constraint=constraint_strings_to_constraint[key], cases=val,
                                     frequency=len(val)))
     return violations
 
 
-def check_object_level_constraints(object_level_constraints, filtered_traces, config, log):
-    bos = set([x.main_object for trace in filtered_traces.values() for x in trace if
-               x.main_object not in config.TERMS_FOR_MISSING])
-    violations = []
-    for bo in bos:
+def check_and_add_violations(d4py, constraint_strings_to_constraint, log, case_variants):
+    """
+    Checks the constraints on the distinct traces in `d4py.log` and expands the violations to all cases via
+    `case_variants`.
+    """
+    d4py.model = parse_decl(constraint_strings_to_constraint.keys())
+    tmp_res = d4py.conformance_checking(consider_vacuity=True)
+    return _collect_violations(tmp_res, constraint_strings_to_constraint, log, case_variants)
+
+
+def _compact_traces(projection, config, with_resources=False):
+    """
+    Returns the traces of `projection` as plain tuples, which are cheap to send to worker processes.
+    """
+    return [(trace.attributes[config.XES_NAME], tuple(event[config.XES_NAME] for event in trace),
+             tuple(event[config.XES_ROLE] for event in trace) if with_resources else None)
+            for trace in projection]
+
+
+def _event_log(config, traces, with_resources=False):
+    projection = EventLog()
+    for trace_id, names, roles in traces:
+        tmp_trace = Trace()
+        tmp_trace.attributes[config.XES_NAME] = trace_id
+        for i, name in enumerate(names):
+            event = Event({config.XES_NAME: name})
+            if with_resources:
+                event[config.XES_ROLE] = roles[i]
+            tmp_trace.append(event)
+        projection.append(tmp_trace)
+    return projection
+
+
+def conformance_checking(config, constraint_strings, projection=None, traces=None, with_resources=False,
+                         checker=DECLARE):
+    """
+    Returns the violated constraint strings per distinct trace, given either as `projection` or as compact `traces`.
+    With the native checker, constraints it supports are checked by `native_checker.check_traces` and only the
+    remaining ones (e.g., constraints with activation or time conditions) by Declare.
+    """
+    if checker not in CHECKERS:
+        raise ValueError(f"Unknown checker {checker}")
+    tmp_res = {}
+    if checker == NATIVE:
+        supported, constraint_strings = split_supported(constraint_strings)
+        if traces is None:
+            traces = _compact_traces(projection, config)
+        tmp_res = check_traces(supported, [(trace_id, names) for trace_id, names, _ in traces])
+    if len(constraint_strings) > 0:
         d4py = Declare(config)
-        d4py.log = object_action_log_projection(bo, filtered_traces, config)
-        constraint_strings_to_constraint = {c.constraint.constraint_str: c for c in object_level_constraints if c.constraint.object_type == bo}
-        violations.extend(check_and_add_violations(d4py, constraint_strings_to_constraint, log))
+        d4py.log = projection if projection is not None else _event_log(config, traces, with_resources)
+        d4py.model = parse_decl(constraint_strings)
+        for trace_id, violated in d4py.conformance_checking(consider_vacuity=True).items():
+            tmp_res.setdefault(trace_id, set()).update(violated)
+    return tmp_res
+
+
+def check_shard(config, constraint_strings, traces, with_resources=False, checker=DECLARE):
+    """
+    Checks the constraints on a shard of compact traces (see `_compact_traces`). Runs in a worker process.
+    """
+    return conformance_checking(config, constraint_strings, traces=traces, with_resources=with_resources,
+                                checker=checker)
+
+
+def _check_jobs(jobs, config, log, checker=DECLARE):
+    violations = []
+    for constraint_strings_to_constraint, projection, case_variants, with_resources in jobs:
+        tmp_res = conformance_checking(config, list(constraint_strings_to_constraint.keys()), projection=projection,
+                                       with_resources=with_resources, checker=checker)
+        violations.extend(_collect_violations(tmp_res, constraint_strings_to_constraint, log, case_variants))
     return violations
 
 
-def check_multi_object_constraints(multi_object_constraints, filtered_traces, config, log):
-    d4py = Declare(config)
-    d4py.log = object_log_projection(filtered_traces, config)
-    constraint_strings_to_constraint = {c.constraint.constraint_str: c for c in multi_object_constraints}
-    return check_and_add_violations(d4py, constraint_strings_to_constraint, log)
+def _check_jobs_in_parallel(jobs_per_level, config, log, executor, shard_size, checker=DECLARE):
+    """
+    Fans out the checking jobs of all levels to `executor` in shards of at most `shard_size` distinct traces.
+    The per-shard results are merged before violations are verified against all cases of a job.
+    """
+    submitted = {}
+    for level, jobs in jobs_per_level.items():
+        submitted[level] = []
+        for constraint_strings_to_constraint, projection, case_variants, with_resources in jobs:
+            traces = _compact_traces(projection, config, with_resources)
+            constraint_strings = list(constraint_strings_to_constraint.keys())
+            futures = [executor.submit(check_shard, config, constraint_strings, traces[i:i + shard_size],
+                                       with_resources, checker)
+                       for i in range(0, len(traces), shard_size)]
+            submitted[level].append((constraint_strings_to_constraint, case_variants, futures))
+    res = {}
+    for level, jobs in submitted.items():
+        res[level] = []
+        for constraint_strings_to_constraint, case_variants, futures in jobs:
+            tmp_res = {}
+            for future in futures:
+                tmp_res.update(future.result())
+            res[level].extend(_collect_violations(tmp_res, constraint_strings_to_constraint, log, case_variants))
+    return res
+
+
+def _object_level_jobs(object_level_constraints, encoded, config):
+    constraints_per_object = {}
+    for c in object_level_constraints:
+        constraints_per_object.setdefault(c.constraint.object_type, {})[c.constraint.constraint_str] = c
+    bos = [bo for bo in constraints_per_object if bo not in config.TERMS_FOR_MISSING]
+    return [(constraints_per_object[bo], projection, case_variants, False)
+            for bo, (projection, case_variants) in object_action_log_projections(encoded, config, bos).items()]
+
+
+def _multi_object_jobs(multi_object_constraints, encoded, config):
+    if len(multi_object_constraints) == 0:
+        return []
+    projection, case_variants = object_log_projection(encoded, config)
+    return [({c.constraint.constraint_str: c for c in multi_object_constraints}, projection, case_variants, False)]
+
 
+def _activity_level_jobs(activity_level_constraints, encoded, config):
+    if len(activity_level_constraints) == 0:
+        return []
+    projection, case_variants = clean_log_projection(encoded, config)
+    return [({c.constraint.constraint_str: c for c in activity_level_constraints}, projection, case_variants, False)]
 
-def check_activity_level_constraints(activity_level_constraints, filtered_traces, config, log):
-    d4py = Declare(config)
-    d4py.log = clean_log_projection(filtered_traces, config)
-    constraint_strings_to_constraint = {c.constraint.constraint_str: c for c in activity_level_constraints}
-    return check_and_add_violations(d4py, constraint_strings_to_constraint, log)
 
+def _resource_level_jobs(resource_level_constraints, encoded, config):
+    if len(resource_level_constraints) == 0:
+        return []
+    projection, case_variants = clean_log_projection(encoded, config, with_resources=True)
+    return [({c.constraint.constraint_str: c for c in resource_level_constraints}, projection, case_variants, True)]
 
-def check_resource_level_constraints(resource_level_constraints, filtered_traces, config, log):
-    d4py = Declare(config)
-    d4py.log = clean_log_projection(filtered_traces, config, with_resources=True)
-    constraint_strings_to_constraint = {c.constraint.constraint_str: c for c in resource_level_constraints}
-    return check_and_add_violations(d4py, constraint_strings_to_constraint, log)
 
+def check_object_level_constraints(object_level_constraints, encoded, config, log):
+    return _check_jobs(_object_level_jobs(object_level_constraints, encoded, config), config, log)
 
-def check_constraints(constraints: List[FittedConstraint], config, log, event_log, nlp_helper):
-    activities = pm4py.get_event_attribute_values(event_log, config.XES_NAME, case_id_key=config.XES_CASE)
-    activities_to_parsed = {activity: nlp_helper.parse_label(activity) for activity in activities}
-    filtered_traces = get_filtered_traces(config, event_log, parsed_tasks=activities_to_parsed)
+
+def check_multi_object_constraints(multi_object_constraints, encoded, config, log):
+    return _check_jobs(_multi_object_jobs(multi_object_constraints, encoded, config), config, log)
+
+
+def check_activity_level_constraints(activity_level_constraints, encoded, config, log):
+    return _check_jobs(_activity_level_jobs(activity_level_constraints, encoded, config), config, log)
+
+
+def check_resource_level_constraints(resource_level_constraints, encoded, config, log):
+    return _check_jobs(_resource_level_jobs(resource_level_constraints, encoded, config), config, log)
+
+
+def check_constraints(constraints: List[FittedConstraint], config, log, event_log, nlp_helper, encoded=None,
+                      executor=None, shard_size=5000, checker=DECLARE):
+    """
+    Checks the constraints on all four levels. If an `executor` (a process pool) is given, the levels, business
+    objects and shards of at most `shard_size` distinct traces are checked in parallel. `checker` selects the
+    conformance checker, Declare (`"declare"`) or the NumPy-based one (`"native"`).
+    """
+    if checker not in CHECKERS:
+        raise ValueError(f"Unknown checker {checker}")
+    if encoded is None:
+        encoded = encode_log(config, event_log, parsed_tasks=parse_activities(config, event_log, nlp_helper))
     object_level_constraints = [c for c in constraints if c.constraint.level == config.OBJECT]
     multi_object_constraints = [c for c in constraints if c.constraint.level == config.MULTI_OBJECT]
     activity_level_constraints = [c for c in constraints if c.constraint.level == config.ACTIVITY]
     resource_level_constraints = [c for c in constraints if c.constraint.level == config.RESOURCE]
-    res = {
+    jobs = {
         # First we check the object-level constraints
-        config.OBJECT: check_object_level_constraints(object_level_constraints, filtered_traces, config, log),
+        config.OBJECT: _object_level_jobs(object_level_constraints, encoded, config),
         # Then we check the multi-object constraints,
-        config.MULTI_OBJECT: check_multi_object_constraints(multi_object_constraints, filtered_traces, config, log)
+        config.MULTI_OBJECT: _multi_object_jobs(multi_object_constraints, encoded, config),
         # Then we check the activity-level constraints
-        , config.ACTIVITY: check_activity_level_constraints(activity_level_constraints, filtered_traces, config, log)
-        # Then we check the resource constraints
-        , config.RESOURCE: check_resource_level_constraints(resource_level_constraints, filtered_traces, config, log)
-        if config.XES_ROLE in event_log.columns else {}
+        config.ACTIVITY: _activity_level_jobs(activity_level_constraints, encoded, config),
     }
+    # Then we check the resource constraints
+    if config.XES_ROLE in event_log.columns:
+        jobs[config.RESOURCE] = _resource_level_jobs(resource_level_constraints, encoded, config)
+    if executor is None:
+        res = {level: _check_jobs(level_jobs, config, log, checker) for level, level_jobs in jobs.items()}
+    else:
+        res = _check_jobs_in_parallel(jobs, config, log, executor, shard_size, checker)
+    if config.RESOURCE not in res:
+        res[config.RESOURCE] = {}
     return res
@@ -1,15 +1,87 @@
-from copy import deepcopy
+from heapq import heappop, heappush
 
 from app.model.fittedConstraint import FittedConstraint
 
+SIM_THRESHOLD = 0.5
+
+
+def ranked_candidates(sims: dict, sim_threshold):
+    """
+    Returns the (term, similarity) pairs of at least `sim_threshold` similarity, most similar first.
+    """
+    return sorted(((term, sim) for term, sim in sims.items() if sim >= sim_threshold), key=lambda x: -x[1])
+
+
+def best_pairs(left, right):
+    """
+    Yields the index pairs of the ranked `left` and `right` candidates in descending order of their summed
+    similarity. Since both lists are sorted, the frontier of a pair is only its right and lower neighbour, so
+    stopping after k pairs costs O(k log k) instead of enumerating all of them.
+    """
+    if len(left) == 0 or len(right) == 0:
+        return
+    heap = [(-(left[0][1] + right[0][1]), 0, 0)]
+    seen = {(0, 0)}
+    while heap:
+        _, i, j = heappop(heap)
+        yield i, j
+        for ni, nj in ((i + 1, j), (i, j + 1)):
+            if ni < len(left) and nj < len(right) and (ni, nj) not in seen:
+                seen.add((ni, nj))
+                heappush(heap, (-(left[ni][1] + right[nj][1]), ni, nj))
+
+
+class Instantiation:
+    """
+    A candidate instantiation of a fitted constraint template. It references the template (and thereby its
+    `Constraint`) and only holds what is substituted, so that fitting does not copy models. It offers the attributes
+    of a `FittedConstraint` that fitting and recommending use; `materialize` builds the `FittedConstraint` for the
+    instantiations that are kept.
+    """
+
+    __slots__ = ("template", "id", "constraint_str", "left_operand", "right_operand", "object_type", "similarity",
+                 "relevance", "normalized_support", "sim_score", "max_level_support")
+
+    def __init__(self, template: FittedConstraint, id, constraint_str, left_operand, right_operand, object_type):
+        self.template = template
+        self.id = id
+        self.constraint_str = constraint_str
+        self.left_operand = left_operand
+        self.right_operand = right_operand
+        self.object_type = object_type
+        self.similarity = template.similarity
+        self.relevance = template.relevance
+        self.normalized_support = None
+        self.sim_score = None
+        self.max_level_support = None
+
+    @property
+    def constraint(self):
+        return self.template.constraint
+
+    def materialize(self) -> FittedConstraint:
+        # all fields come from the validated template, so pydantic validation is skipped
+        return FittedConstraint.model_construct(id=self.id, log=self.template.log, constraint_str=self.constraint_str,
+                                                left_operand=self.left_operand, right_operand=self.right_operand,
+                                                object_type=self.object_type, similarity=self.similarity,
+                                                relevance=self.relevance, constraint=self.template.constraint,
+                                                normalized_support=self.normalized_support,
+                                                sim_score=self.sim_score, max_level_support=self.max_level_support)
+
 
 class FittedConstraintGenerator:
 
-    def __init__(self, config, log_info):
+    def __init__(self, config, log_info, top_k=None):
         self.config = config
         self.log_info = log_info
+        # maximum number of instantiations of a binary template; all support the same constraint, so the most
+        # similar ones are also the most relevant ones
+        self.top_k = top_k
 
-    def fit_constraints(self, constraints, sim_threshold=0.5):
+    def fit_constraints(self, constraints, sim_threshold=SIM_THRESHOLD) -> list[Instantiation]:
+        """
+        Instantiates the constraints with the log terms that are at least `sim_threshold` similar to their operands.
+        """
         fitted_constraint_lists = [self.fit_constraint(constraint, sim_threshold) for constraint in constraints]
         fitted_constraints = [self.update_sims(fitted_constraint) for fitted_constraints in fitted_constraint_lists
                               for fitted_constraint in fitted_constraints if fitted_constraint is not None]
@@ -27,22 +99,21 @@ class FittedConstraintGenerator:
         return fitted_constraints
 
     def instantiate_obj_const(self, fitted_constraint_template: FittedConstraint, obj, act_l, act_r=None):
-        fitted_constraint = deepcopy(fitted_constraint_template)
-        fitted_constraint.object_type = obj
-        fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
-            fitted_constraint.constraint.object_type, obj)
-        fitted_constraint.id = fitted_constraint.id + "_" + self.config.OBJECT + "_" + obj
         if act_l == act_r:
             return None
+        constraint = fitted_constraint_template.constraint
+        constraint_str = fitted_constraint_template.constraint_str.replace(constraint.object_type, obj)
+        left_operand = fitted_constraint_template.left_operand
+        right_operand = fitted_constraint_template.right_operand
         if act_l is not None:
-            fitted_constraint.left_operand = act_l
-            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
-                fitted_constraint.constraint.left_operand, act_l)
+            left_operand = act_l
+            constraint_str = constraint_str.replace(constraint.left_operand, act_l)
         if act_r is not None:
-            fitted_constraint.right_operand = act_r
-            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
-                fitted_constraint.constraint.right_operand, act_r)
-        return fitted_constraint
+            right_operand = act_r
+            constraint_str = constraint_str.replace(constraint.right_operand, act_r)
+        return Instantiation(fitted_constraint_template,
+                             fitted_constraint_template.id + "_" + self.config.OBJECT + "_" + obj,
+                             constraint_str, left_operand, right_operand, obj)
 
     def fit_object_constraint(self, fitted_constraint_template: FittedConstraint, sim_threshold):
         sim_dict = fitted_constraint_template.similarity
@@ -61,55 +132,62 @@ class FittedConstraintGenerator:
         return fitted_constraints
 
     def instantiate_multi_obj_or_act_constraint(self, fitted_constraint_template: FittedConstraint, l_obj=None, r_obj=None):
-        fitted_constraint = deepcopy(fitted_constraint_template)
+        left_operand = fitted_constraint_template.left_operand if l_obj is None else l_obj
+        right_operand = fitted_constraint_template.right_operand if r_obj is None else r_obj
+        if left_operand == right_operand:
+            return None
+        constraint = fitted_constraint_template.constraint
+        constraint_str = fitted_constraint_template.constraint_str
+        constraint_id = fitted_constraint_template.id
         if l_obj is not None:
-            fitted_constraint.left_operand = l_obj
-            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
-                fitted_constraint.constraint.left_operand, l_obj)
-            fitted_constraint.id = fitted_constraint.id + "_" + self.config.OBJECT + "_" + l_obj
+            constraint_str = constraint_str.replace(constraint.left_operand, l_obj)
+            constraint_id = constraint_id + "_" + self.config.OBJECT + "_" + l_obj
         if r_obj is not None:
-            fitted_constraint.right_operand = r_obj
-            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
-                fitted_constraint.constraint.right_operand, r_obj)
-            fitted_constraint.id = fitted_constraint.id + "_" + self.config.OBJECT + "_" + r_obj
-        if fitted_constraint.left_operand == fitted_constraint.right_operand:
-            return None
-        return fitted_constraint
+            constraint_str = constraint_str.replace(constraint.right_operand, r_obj)
+            constraint_id = constraint_id + "_" + self.config.OBJECT + "_" + r_obj
+        return Instantiation(fitted_constraint_template, constraint_id, constraint_str, left_operand, right_operand,
+                             fitted_constraint_template.object_type)
 
     def fit_multi_object_or_activity_constraint(self, fitted_constraint_template: FittedConstraint, sim_threshold):
         sim_dict = fitted_constraint_template.similarity
         fitted_constraints = []
         if self.config.LEFT_OPERAND in sim_dict and self.config.RIGHT_OPERAND in sim_dict:
-            obj_sim_l = sim_dict[self.config.LEFT_OPERAND]
-            obj_sim_r = sim_dict[self.config.RIGHT_OPERAND]
-            for obj_l, sim_l in obj_sim_l.items():
-                if sim_l >= sim_threshold:
-                    for obj_r, sim_r in obj_sim_r.items():
-                        if sim_r >= sim_threshold and obj_l != obj_r:
-                            fitted_constraint = self.instantiate_multi_obj_or_act_constraint(fitted_constraint_template, obj_l, obj_r)
-                            if fitted_constraint is not None:
-                                fitted_constraints.append(fitted_constraint)
+            obj_sim_l = ranked_candidates(sim_dict[self.config.LEFT_OPERAND], sim_threshold)
+            obj_sim_r = ranked_candidates(sim_dict[self.config.RIGHT_OPERAND], sim_threshold)
+            # best first, so that no remaining pair can beat the ones taken once there are top_k of them
+            for i, j in best_pairs(obj_sim_l, obj_sim_r):
+                if self.top_k is not None and len(fitted_constraints) >= self.top_k:
+                    break
+                obj_l, obj_r = obj_sim_l[i][0], obj_sim_r[j][0]
+                if obj_l != obj_r:
+                    fitted_constraint = self.instantiate_multi_obj_or_act_constraint(fitted_constraint_template, obj_l, obj_r)
+                    if fitted_constraint is not None:
+                        fitted_constraints.append(fitted_constraint)
         return fitted_constraints
 
     def instantiate_resource_constraint(self, fitted_constraint_template: FittedConstraint, act, res):
-        fitted_constraint = deepcopy(fitted_constraint_template)
-        fitted_constraint = self.instantiate_multi_obj_or_act_constraint(fitted_constraint, act, None)
-        fitted_constraint.constraint_str = fitted_constraint.constraint.constraint_str.replace(
-            fitted_constraint.constraint.object_type, res)
-        fitted_constraint.id = fitted_constraint.constraint.id + "_" + self.config.RESOURCE + act + "_" + res
-        return fitted_constraint
+        if act == fitted_constraint_template.right_operand:
+            return None
+        constraint = fitted_constraint_template.constraint
+        return Instantiation(fitted_constraint_template,
+                             fitted_constraint_template.id + "_" + self.config.RESOURCE + act + "_" + res,
+                             constraint.constraint_str.replace(constraint.object_type, res), act,
+                             fitted_constraint_template.right_operand, fitted_constraint_template.object_type)
 
     def fit_resource_constraint(self, fitted_constraint_template: FittedConstraint, sim_threshold):
         fitted_constraints = []
-        if self.config.LEFT_OPERAND in fitted_constraint_template.similarity:
-            act_sim = fitted_constraint_template.similarity[self.config.LEFT_OPERAND]
-            for act, sim in act_sim.items():
-                if sim >= sim_threshold and self.config.RESOURCE in fitted_constraint_template.similarity:
-                    for res, sim_res in fitted_constraint_template.similarity[self.config.RESOURCE].items():
-                        if sim_res >= sim_threshold:
-                            fitted_constraint = self.instantiate_resource_constraint(fitted_constraint_template, act, res)
-                            if fitted_constraint is not None:
-                                fitted_constraints.append(fitted_constraint)
+        if (self.config.LEFT_OPERAND in fitted_constraint_template.similarity and
+                self.config.RESOURCE in fitted_constraint_template.similarity):
+            act_sim = ranked_candidates(fitted_constraint_template.similarity[self.config.LEFT_OPERAND], sim_threshold)
+            res_sim = ranked_candidates(fitted_constraint_template.similarity[self.config.RESOURCE], sim_threshold)
+            # the relevance only depends on the activity, so activities are taken best first and resources in order
+            for act, _ in act_sim:
+                for res, _ in res_sim:
+                    if self.top_k is not None and len(fitted_constraints) >= self.top_k:
+                        return fitted_constraints
+                    fitted_constraint = self.instantiate_resource_constraint(fitted_constraint_template, act, res)
+                    if fitted_constraint is not None:
+                        fitted_constraints.append(fitted_constraint)
         return fitted_constraints
 
     def update_sims(self, fitted_constraint: FittedConstraint):
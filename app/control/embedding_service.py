@@ -0,0 +1,165 @@
+"""
+In-process service that encodes the terms of concurrent requests in shared batches.
+
+Callers ask for the embeddings of their terms. Terms that are cached (in the `EmbeddingStore` or, without a store,
+in the nlp helper) are returned right away, terms that another caller is already waiting for are not queued again,
+and the remaining terms are queued. A single worker thread collects queued terms for up to `max_wait_ms` (or until
+`max_batch_size` terms are queued), encodes them as one batch and hands the vectors back to every waiter.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from app.control.encoders import NlpHelperEncoder, _to_numpy
+
+_logger = logging.getLogger(__name__)
+
+
+class EmbeddingService:
+
+    def __init__(self, nlp_helper, store=None, max_batch_size=64, max_wait_ms=5.0, encoder=None):
+        self.nlp_helper = nlp_helper
+        self.store = store
+        # with a store, encoded terms do not need to stay in the nlp helper's per-process cache
+        self.encoder = NlpHelperEncoder(nlp_helper, keep_cache=store is None) if encoder is None else encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = deque()
+        # term -> future of its embedding, for terms that are queued or being encoded
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.requested_terms = 0
+        self.cached_terms = 0
+        self.coalesced_terms = 0
+        self.encoded_terms = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+
+    def embed(self, terms) -> np.ndarray:
+        """
+        Returns the float32 embeddings of `terms`, one row per term. Raises a `RuntimeError` once the service is
+        closed.
+        """
+        self._check_open()
+        terms = list(terms)
+        vectors = self._lookup(terms)
+        missing = list(dict.fromkeys(term for term in terms if term not in vectors))
+        futures = {}
+        with self._cond:
+            self._check_open()
+            self.requested_terms += len(terms)
+            self.cached_terms += len(terms) - len(missing)
+            for term in missing:
+                if term in self._pending:
+                    self.coalesced_terms += 1
+                else:
+                    self._pending[term] = Future()
+                    self._queue.append(term)
+                futures[term] = self._pending[term]
+            if len(missing) > 0:
+                self._start()
+                self._cond.notify_all()
+        for term, future in futures.items():
+            vectors[term] = future.result()
+        if len(terms) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[term] for term in terms])
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("The embedding service is closed")
+
+    def _lookup(self, terms):
+        if self.store is not None:
+            stored, missing = self.store.get(terms)
+            missing = set(missing)
+            return dict(zip([term for term in terms if term not in missing], stored))
+        known = self.nlp_helper.known_embeddings
+        return {term: _to_numpy(known[term]) for term in terms if term in known}
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._cond:
+            while len(self._queue) == 0 and not self._closed:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch_size))]
+
+    def _run(self):
+        while not self._closed:
+            batch = self._next_batch()
+            if len(batch) == 0:
+                continue
+            start = time.perf_counter()
+            try:
+                vectors = self._encode(batch)
+            except Exception as e:
+                _logger.warning(f"Encoding a batch of {len(batch)} terms failed: {e}")
+                self._resolve(batch, error=e)
+                continue
+            with self._cond:
+                self.batches += 1
+                self.encoded_terms += len(batch)
+                self.encode_seconds += time.perf_counter() - start
+            self._resolve(batch, vectors)
+
+    def _encode(self, batch):
+        vectors = self.encoder.encode(batch)
+        if self.store is not None:
+            self.store.add(batch, vectors)
+            # return what later readers of the store will get
+            vectors = vectors.astype(self.store.dtype).astype(np.float32)
+        return vectors
+
+    def _resolve(self, batch, vectors=None, error=None):
+        with self._cond:
+            futures = [self._pending.pop(term) for term in batch]
+        for i, future in enumerate(futures):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(vectors[i])
+
+    def close(self):
+        """
+        Stops the worker. The batch that is being encoded is still handed back, the callers that wait for queued
+        terms receive a `RuntimeError`.
+        """
+        with self._cond:
+            self._closed = True
+            queued = [self._pending.pop(term) for term in self._queue]
+            self._queue.clear()
+            self._cond.notify_all()
+        for future in queued:
+            future.set_exception(RuntimeError("The embedding service was closed before the term was encoded"))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"encoder": self.encoder.name,
+                    "requested_terms": self.requested_terms,
+                    "cached_terms": self.cached_terms,
+                    "coalesced_terms": self.coalesced_terms,
+                    "encoded_terms": self.encoded_terms,
+                    "batches": self.batches,
+                    "max_batch_size": self.max_batch_size,
+                    "max_wait_ms": self.max_wait * 1000,
+                    "mean_batch_size": self.encoded_terms / self.batches if self.batches > 0 else 0.0,
+                    "batch_fill_rate": (self.encoded_terms / (self.batches * self.max_batch_size)
+                                        if self.batches > 0 else 0.0),
+                    "encode_seconds": self.encode_seconds,
+                    "queued_terms": len(self._queue)}
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from semconstmining.mining.model.parsed_label import get_dummy
+
+
+class EncodedLog:
+    """
+    Compact, dictionary-encoded representation of an event log.
+
+    Events are stored case by case in CSR layout: the events of the i-th case (in the sort order of the case ids)
+    are `activity_codes[offsets[i]:offsets[i + 1]]`, in the order in which they appear in the event log.
+    Activities, roles and the parsed objects, actions and clean labels are stored once in lookup tables and
+    referenced by int32 codes; a code of -1 denotes a missing value.
+    """
+
+    def __init__(self, case_ids, offsets, activity_codes, activities, role_codes=None, roles=None):
+        self.case_ids = case_ids
+        self.offsets = offsets
+        self.activity_codes = activity_codes
+        self.activities = activities
+        self.role_codes = role_codes
+        self.roles = roles
+        # filled by `add_parsed_labels`
+        self.parsed = None
+        self.objects = None
+        self.actions = None
+        self.labels = None
+        self.object_codes = None
+        self.action_codes = None
+        self.label_codes = None
+
+    @property
+    def n_cases(self):
+        return len(self.case_ids)
+
+    @property
+    def has_parsed_labels(self):
+        return self.object_codes is not None
+
+    def case_index(self):
+        """
+        Returns for each event the index of the case it belongs to.
+        """
+        return np.repeat(np.arange(self.n_cases, dtype=np.int32), np.diff(self.offsets))
+
+    def trace_codes(self, i, codes=None):
+        codes = self.activity_codes if codes is None else codes
+        return codes[self.offsets[i]:self.offsets[i + 1]]
+
+    def add_parsed_labels(self, config, parsed_tasks):
+        """
+        Encodes the main object, main action and clean label of the parsed activities. Activities that were not
+        parsed are treated like the dummy label produced by `get_dummy`.
+        """
+        self.parsed = [parsed_tasks[activity] if activity in parsed_tasks else get_dummy(config, activity, config.EN)
+                       for activity in self.activities]
+        activity_objects, self.objects = _factorize([p.main_object for p in self.parsed])
+        activity_actions, self.actions = _factorize([p.main_action for p in self.parsed])
+        activity_labels, self.labels = _factorize([p.label for p in self.parsed])
+        self.object_codes = activity_objects[self.activity_codes]
+        self.action_codes = activity_actions[self.activity_codes]
+        self.label_codes = activity_labels[self.activity_codes]
+        return self
+
+
+def _factorize(values):
+    codes, table = pd.factorize(np.array(values, dtype=object), use_na_sentinel=False)
+    return codes.astype(np.int32), np.asarray(table)
+
+
+def table_mask(table, terms):
+    """
+    Returns a boolean mask over the codes of the lookup `table` that marks the codes of the given `terms`.
+    """
+    terms = set(terms)
+    return np.array([term in terms for term in table], dtype=bool)
+
+
+def encode_log(config, event_log: DataFrame, parsed_tasks=None) -> EncodedLog:
+    """
+    Builds the `EncodedLog` of `event_log`. Cases are ordered like `event_log.groupby(config.XES_CASE)`, events
+    within a case keep their order in the event log.
+    """
+    case_codes, case_ids = pd.factorize(event_log[config.XES_CASE].to_numpy(), sort=True)
+    # like groupby, events without case id are dropped
+    with_case = np.flatnonzero(case_codes >= 0)
+    order = with_case[np.argsort(case_codes[with_case], kind="stable")]
+    offsets = np.zeros(len(case_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(case_codes[with_case], minlength=len(case_ids)), out=offsets[1:])
+    activity_codes, activities = pd.factorize(event_log[config.XES_NAME].to_numpy()[order], use_na_sentinel=False)
+    role_codes, roles = None, None
+    if config.XES_ROLE in event_log.columns:
+        role_codes, roles = pd.factorize(event_log[config.XES_ROLE].to_numpy()[order])
+        role_codes = role_codes.astype(np.int32)
+    encoded = EncodedLog(np.asarray(case_ids), offsets, activity_codes.astype(np.int32), np.asarray(activities),
+                         role_codes, None if roles is None else np.asarray(roles))
+    if parsed_tasks is not None:
+        encoded.add_parsed_labels(config, parsed_tasks)
+    return encoded
+
+
+def parse_activities(config, event_log: DataFrame, nlp_helper):
+    """
+    Returns the parsed label of every distinct activity of `event_log`.
+    """
+    return {activity: nlp_helper.parse_label(activity) for activity in event_log[config.XES_NAME].dropna().unique()}
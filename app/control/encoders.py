@@ -0,0 +1,232 @@
+"""
+Sentence encoder backends for the embedding service.
+
+`torch` encodes with the sentence model of the nlp helper and is the reference. The other backends load the same
+model for CPU inference: `torch-int8` with dynamically quantized linear layers, `onnx` as an exported ONNX Runtime
+graph and `onnx-int8` as its dynamically quantized version. Exported graphs are cached in DATA_INTERIM/encoders.
+`check_parity` reports how far a backend's embeddings deviate from the reference.
+"""
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+TORCH = "torch"
+TORCH_INT8 = "torch-int8"
+ONNX = "onnx"
+ONNX_INT8 = "onnx-int8"
+BACKENDS = (TORCH, TORCH_INT8, ONNX, ONNX_INT8)
+ENCODER_DIR = "encoders"
+# largest cosine deviation from the reference at which a backend is used, see `get_checked_encoder`
+MAX_COSINE_DEVIATION = 0.02
+
+# terms of the kind the app encodes, used to check a backend against the reference
+PARITY_TERMS = ["create purchase order", "approve invoice", "check credit limit", "send reminder to customer",
+                "purchase order", "invoice", "clerk", "accounting manager", "ship goods", "reject claim",
+                "receive payment", "update customer master data"]
+
+
+def _to_numpy(embedding):
+    if hasattr(embedding, "detach"):
+        embedding = embedding.detach().cpu().numpy()
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def encode(nlp_helper, terms) -> np.ndarray:
+    """
+    Encodes `terms` with the sentence model of the nlp helper, one row per term.
+    """
+    nlp_helper.pre_compute_embeddings(sentences=[term for term in terms if term not in nlp_helper.known_embeddings])
+    if len(terms) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([_to_numpy(nlp_helper.known_embeddings[term]) for term in terms])
+
+
+def get_sentence_model(nlp_helper):
+    """
+    Returns the sentence-transformers model of the nlp helper, or None if the helper does not expose one.
+    """
+    return getattr(nlp_helper, "sent_model", None)
+
+
+def get_sentence_model_name(nlp_helper) -> str:
+    """
+    Returns the name (or local path) of the sentence model of the nlp helper, which the other backends load.
+    """
+    model = get_sentence_model(nlp_helper)
+    if model is None:
+        raise ValueError("The nlp helper does not expose the sentence model that the encoder backends load")
+    return model[0].auto_model.config.name_or_path
+
+
+class NlpHelperEncoder:
+    """
+    Encodes with the sentence model of the nlp helper. Unless `keep_cache` is set, terms are encoded with the model
+    itself and do not enter the helper's embedding cache (e.g., because an embedding store keeps them). The cache
+    is shared with request threads, so it is never emptied here.
+    """
+
+    name = TORCH
+
+    def __init__(self, nlp_helper, keep_cache=True):
+        self.nlp_helper = nlp_helper
+        self.keep_cache = keep_cache
+
+    def encode(self, terms) -> np.ndarray:
+        terms = list(terms)
+        model = get_sentence_model(self.nlp_helper)
+        if self.keep_cache or model is None:
+            return encode(self.nlp_helper, terms)
+        if len(terms) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(model.encode(terms, convert_to_numpy=True), dtype=np.float32)
+
+
+class QuantizedTorchEncoder:
+    """
+    Encodes with a sentence-transformers model whose linear layers are dynamically quantized to int8.
+    The number of torch threads is a process-wide setting, so `num_threads` only applies while this encoder
+    encodes and the previous number is restored afterwards; models used concurrently by other threads (e.g., the
+    one of the nlp helper) run with it in the meantime.
+    """
+
+    name = TORCH_INT8
+
+    def __init__(self, model_name, num_threads=None, batch_size=64):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name, device="cpu")
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+
+    def encode(self, terms) -> np.ndarray:
+        import torch
+
+        previous_threads = torch.get_num_threads()
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        try:
+            return np.asarray(self.model.encode(list(terms), batch_size=self.batch_size, convert_to_numpy=True),
+                              dtype=np.float32)
+        finally:
+            torch.set_num_threads(previous_threads)
+
+
+class OnnxEncoder:
+    """
+    Encodes with an ONNX Runtime export of the transformer of a sentence-transformers model followed by mean
+    pooling, optionally with dynamically int8-quantized weights.
+    """
+
+    def __init__(self, model_name, model_dir, quantize=False, num_threads=None, batch_size=64):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.name = ONNX_INT8 if quantize else ONNX
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        path = _export(model_name, Path(model_dir), self.tokenizer, quantize)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.batch_size = batch_size
+
+    def encode(self, terms) -> np.ndarray:
+        terms = list(terms)
+        batches = []
+        for i in range(0, len(terms), self.batch_size):
+            inputs = self.tokenizer(terms[i:i + self.batch_size], padding=True, truncation=True, return_tensors="np")
+            mask = inputs["attention_mask"].astype(np.int64)
+            hidden = self.session.run(["last_hidden_state"], {"input_ids": inputs["input_ids"].astype(np.int64),
+                                                              "attention_mask": mask})[0]
+            mask = mask[:, :, None].astype(np.float32)
+            batches.append((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+        if len(batches) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(batches).astype(np.float32)
+
+
+def _export(model_name, model_dir, tokenizer, quantize):
+    os.makedirs(model_dir, exist_ok=True)
+    base = model_dir / model_name.replace("/", "__")
+    path = base.with_name(base.name + ".onnx")
+    if not os.path.exists(path):
+        import torch
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(model_name).eval()
+        inputs = tokenizer(["create purchase order"], return_tensors="pt")
+        tmp_path = path.with_name(path.name + ".tmp")
+        torch.onnx.export(model, (inputs["input_ids"], inputs["attention_mask"]), str(tmp_path),
+                          input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "tokens"},
+                                        "attention_mask": {0: "batch", 1: "tokens"},
+                                        "last_hidden_state": {0: "batch", 1: "tokens"}},
+                          opset_version=14)
+        os.replace(tmp_path, path)
+        _logger.info(f"Exported {model_name} to {path}")
+    if not quantize:
+        return path
+    quantized_path = base.with_name(base.name + ".int8.onnx")
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(path), str(quantized_path), weight_type=QuantType.QInt8)
+        _logger.info(f"Quantized {path} to {quantized_path}")
+    return quantized_path
+
+
+def get_encoder_dir(conf) -> Path:
+    return Path(conf.DATA_INTERIM) / ENCODER_DIR
+
+
+def get_encoder(conf, nlp_helper, backend=TORCH, num_threads=None, keep_cache=True):
+    """
+    Returns the encoder for `backend`. All backends but `torch` load the sentence model of the nlp helper.
+    """
+    if backend == TORCH:
+        return NlpHelperEncoder(nlp_helper, keep_cache=keep_cache)
+    if backend == TORCH_INT8:
+        return QuantizedTorchEncoder(get_sentence_model_name(nlp_helper), num_threads)
+    if backend in (ONNX, ONNX_INT8):
+        return OnnxEncoder(get_sentence_model_name(nlp_helper), get_encoder_dir(conf), quantize=backend == ONNX_INT8,
+                           num_threads=num_threads)
+    raise ValueError(f"Unknown encoder backend {backend}, use one of {list(BACKENDS)}")
+
+
+def get_checked_encoder(conf, nlp_helper, backend=TORCH, num_threads=None, keep_cache=True,
+                        max_deviation=MAX_COSINE_DEVIATION):
+    """
+    Returns the encoder for `backend` and its parity with the reference (None for `torch`). A backend whose
+    maximum cosine deviation exceeds `max_deviation` is replaced by `torch`.
+    """
+    encoder = get_encoder(conf, nlp_helper, backend, num_threads, keep_cache)
+    if encoder.name == TORCH:
+        return encoder, None
+    parity = check_parity(NlpHelperEncoder(nlp_helper, keep_cache=False), encoder)
+    parity["max_allowed_deviation"] = max_deviation
+    parity["used"] = parity["max_cosine_deviation"] <= max_deviation
+    if not parity["used"]:
+        _logger.warning(f"Falling back to the {TORCH} encoder, as {encoder.name} deviates by up to "
+                        f"{parity['max_cosine_deviation']:.2e} from it (at most {max_deviation:.2e} allowed)")
+        return get_encoder(conf, nlp_helper, TORCH, keep_cache=keep_cache), parity
+    return encoder, parity
+
+
+def check_parity(reference, encoder, terms=None) -> dict:
+    """
+    Returns the mean and maximum cosine deviation (1 - cosine similarity) of the embeddings of `encoder` from
+    those of the `reference` encoder.
+    """
+    terms = PARITY_TERMS if terms is None else list(terms)
+    expected = reference.encode(terms)
+    actual = encoder.encode(terms)
+    cosine = (expected * actual).sum(axis=1) / (np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    deviation = 1 - cosine
+    return {"backend": encoder.name, "terms": len(terms),
+            "mean_cosine_deviation": float(deviation.mean()), "max_cosine_deviation": float(deviation.max())}
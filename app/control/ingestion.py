@@ -0,0 +1,38 @@
+import threading
+from datetime import datetime
+
+PENDING = "pending"
+PARSING = "parsing"
+READY = "ready"
+FAILED = "failed"
+
+
+class IngestionTracker:
+    """
+    Keeps track of the background ingestion of uploaded logs, so that clients can poll the state of a log
+    instead of blocking on the first analysis request.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def set_state(self, log, state, error=None):
+        with self._lock:
+            self._states[log] = {"log": log, "state": state, "error": error, "updated": datetime.now().isoformat()}
+
+    def get_state(self, log):
+        with self._lock:
+            return self._states.get(log)
+
+    def ingest(self, log, load):
+        """
+        Runs `load()` for `log` and records its progress. Failures are recorded, not raised.
+        """
+        self.set_state(log, PARSING)
+        try:
+            load()
+        except Exception as e:
+            self.set_state(log, FAILED, error=str(getattr(e, "detail", e)))
+            return
+        self.set_state(log, READY)
@@ -0,0 +1,235 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from pandas import DataFrame
+
+_logger = logging.getLogger(__name__)
+
+LRU = "lru"
+COST = "cost"
+
+
+def estimate_size(obj, exclude=()) -> int:
+    """
+    Estimates the number of bytes held by `obj`, following containers and object attributes.
+    Objects in `exclude` (e.g., the shared nlp helper) are not counted.
+    """
+    seen = {id(x) for x in exclude}
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, DataFrame):
+            size += int(current.memory_usage(deep=True).sum())
+        elif isinstance(current, np.ndarray):
+            size += current.nbytes
+        else:
+            size += sys.getsizeof(current)
+            if isinstance(current, dict):
+                stack.extend(current.keys())
+                stack.extend(current.values())
+            elif isinstance(current, (list, tuple, set, frozenset)):
+                stack.extend(current)
+            elif hasattr(current, "__dict__") and not isinstance(current, type):
+                stack.append(vars(current))
+    return size
+
+
+class LoadedLog:
+    """
+    A log held in the `LogCache`, i.e., the event log data frame together with its `LogInfo`.
+    """
+
+    def __init__(self, log, event_log, log_info, load_seconds=0.0, exclude=()):
+        self.log = log
+        self.event_log = event_log
+        self.log_info = log_info
+        self.load_seconds = load_seconds
+        self.exclude = (event_log,) + tuple(exclude)
+        self.size = estimate_size(event_log) + estimate_size(log_info, exclude=self.exclude)
+        self.derived = {}
+        self.cache = None
+        self._lock = threading.Lock()
+        self._derive_locks = {}
+        self._pending = {}
+
+    def derive(self, name, build):
+        """
+        Returns the structure `name` derived from this log, building it with `build()` on first access.
+        Derived structures live as long as the log stays in the cache and count towards its size.
+        Each structure is built under its own lock, so a slow build does not block the others.
+        """
+        with self._lock:
+            if name in self.derived:
+                return self.derived[name]
+            lock = self._derive_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self.derived:
+                value = build()
+                grown = estimate_size(value, exclude=self.exclude + (self.log_info,))
+                self.derived[name] = value
+                cache = self.cache
+                if cache is not None:
+                    cache._grow(self, grown)
+                else:
+                    self.size += grown
+            return self.derived[name]
+
+    def derive_in_background(self, name, build, executor):
+        """
+        Returns the structure `name` if it has been derived. Otherwise, starts deriving it on `executor` unless that
+        is already underway and returns None, so that the caller can fall back instead of waiting for the build.
+        A failed build is logged and started again by the next call.
+        """
+        with self._lock:
+            if name in self.derived:
+                return self.derived[name]
+            if name in self._pending:
+                return None
+            future = self._pending[name] = executor.submit(self.derive, name, build)
+
+        def done(f):
+            with self._lock:
+                self._pending.pop(name, None)
+            if f.exception() is not None:
+                _logger.warning(f"Could not derive {name} of log {self.log}: {f.exception()}")
+        future.add_done_callback(done)
+        return None
+
+
+class LogCache:
+    """
+    Memory-bounded cache of loaded logs.
+
+    Entries are evicted once their estimated total size exceeds `max_bytes`, either in least-recently-used order
+    (`policy="lru"`) or cost-aware, i.e., preferring entries that were cheap to load relative to their size
+    (`policy="cost"`, GreedyDual-Size).
+    """
+
+    def __init__(self, max_bytes: int, policy: str = LRU, exclude=()):
+        if policy not in (LRU, COST):
+            raise ValueError(f"Unknown eviction policy {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.exclude = tuple(exclude)
+        self._entries = OrderedDict()
+        self._priorities = {}
+        self._loading = {}
+        self._inflation = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+
+    def __contains__(self, log):
+        return log in self._entries
+
+    def get(self, log, loader) -> LoadedLog:
+        """
+        Returns the cached entry for `log`, calling `loader()` to obtain (event_log, log_info) if it is not cached.
+
+        Loading is single-flight: concurrent callers that miss on the same log wait for the first caller's load
+        instead of loading the log again. If the load fails, every waiter receives the exception and nothing is
+        cached, so the next call tries again.
+        """
+        with self._lock:
+            if log in self._entries:
+                self.hits += 1
+                self._touch(log)
+                return self._entries[log]
+            self.misses += 1
+            future = self._loading.get(log)
+            leader = future is None
+            if leader:
+                future = self._loading[log] = Future()
+        if not leader:
+            return future.result()
+        try:
+            start = time.perf_counter()
+            event_log, log_info = loader()
+            entry = LoadedLog(log, event_log, log_info, time.perf_counter() - start, exclude=self.exclude)
+        except BaseException as e:
+            with self._lock:
+                if self._loading.get(log) is future:
+                    del self._loading[log]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if self._loading.get(log) is future:
+                del self._loading[log]
+                self._insert(entry)
+        future.set_result(entry)
+        return entry
+
+    def invalidate(self, log):
+        """
+        Drops `log` from the cache. A load of `log` that is in flight is not cached once it completes.
+        """
+        with self._lock:
+            if log in self._entries:
+                self._remove(log)
+            self._loading.pop(log, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"policy": self.policy,
+                    "max_bytes": self.max_bytes,
+                    "resident_bytes": self.resident_bytes,
+                    "entries": {log: entry.size for log, entry in self._entries.items()},
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+    def _priority(self, entry: LoadedLog):
+        return self._inflation + entry.load_seconds / max(entry.size, 1)
+
+    def _touch(self, log):
+        self._entries.move_to_end(log)
+        if self.policy == COST:
+            self._priorities[log] = self._priority(self._entries[log])
+
+    def _insert(self, entry: LoadedLog):
+        if entry.log in self._entries:
+            self._remove(entry.log)
+        entry.cache = self
+        self._entries[entry.log] = entry
+        self._priorities[entry.log] = self._priority(entry)
+        self.resident_bytes += entry.size
+        self._evict(entry)
+
+    def _grow(self, entry: LoadedLog, grown):
+        with self._lock:
+            entry.size += grown
+            if self._entries.get(entry.log) is entry:
+                self.resident_bytes += grown
+                self._evict(entry)
+
+    def _evict(self, entry: LoadedLog):
+        while self.resident_bytes > self.max_bytes and len(self._entries) > 1:
+            victim = self._select_victim(exclude=entry.log)
+            if self.policy == COST:
+                self._inflation = self._priorities[victim]
+            _logger.info(f"Evicting log {victim} ({self._entries[victim].size} bytes) from the log cache")
+            self._remove(victim)
+            self.evictions += 1
+
+    def _select_victim(self, exclude):
+        candidates = [log for log in self._entries if log != exclude]
+        if self.policy == LRU:
+            return candidates[0]
+        return min(candidates, key=lambda log: self._priorities[log])
+
+    def _remove(self, log):
+        entry = self._entries.pop(log)
+        entry.cache = None
+        self._priorities.pop(log, None)
+        self.resident_bytes -= entry.size
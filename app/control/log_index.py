@@ -0,0 +1,48 @@
+"""
+Hash-based lookups into the `LogInfo` of a log.
+
+`LogInfo` keeps the objects, actions and labels of a log as lists and maps clean terms to the original activity
+labels they occur in, so that membership checks scan lists. A `LogIndex` is built once per cached log and answers
+them with frozensets, plus reverse maps from an original activity label to the clean labels, objects and actions
+that occur in it.
+"""
+
+
+def _originals(value) -> frozenset:
+    # a term maps to one original label or to a collection of them
+    return frozenset((value,)) if isinstance(value, str) else frozenset(value)
+
+
+def _reverse(term_to_originals: dict) -> dict:
+    original_to_terms = {}
+    for term, originals in term_to_originals.items():
+        for original in originals:
+            original_to_terms.setdefault(original, set()).add(term)
+    return {original: frozenset(terms) for original, terms in original_to_terms.items()}
+
+
+class LogIndex:
+
+    def __init__(self, log_info):
+        self.objects = frozenset(log_info.objects)
+        self.actions = frozenset(log_info.actions)
+        self.labels = frozenset(log_info.labels)
+        self.label_to_original_labels = {label: _originals(originals)
+                                         for label, originals in log_info.label_to_original_label.items()}
+        self.object_to_original_labels = {obj: _originals(originals)
+                                          for obj, originals in log_info.object_to_original_labels.items()}
+        self.action_to_original_labels = {action: _originals(originals)
+                                          for action, originals in log_info.action_to_original_labels.items()}
+        # original activity label -> clean labels, objects and actions that occur in it
+        self.original_to_labels = _reverse(self.label_to_original_labels)
+        self.original_to_objects = _reverse(self.object_to_original_labels)
+        self.original_to_actions = _reverse(self.action_to_original_labels)
+
+    def labels_of(self, activity) -> frozenset:
+        return self.original_to_labels.get(activity, frozenset())
+
+    def objects_of(self, activity) -> frozenset:
+        return self.original_to_objects.get(activity, frozenset())
+
+    def actions_of(self, activity) -> frozenset:
+        return self.original_to_actions.get(activity, frozenset())
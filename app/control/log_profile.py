@@ -0,0 +1,113 @@
+"""
+Log-side precomputation for constraint matching.
+
+What matching a log against the catalog needs from the log does not depend on the filters of a request: the
+embeddings of the log's objects, labels and resources, the catalog actions that are equivalent to log actions and the
+similarities of the whole catalog vocabulary to the log terms. A `LogProfile` holds all of it, so that a matching
+request only filters, fits and ranks. Catalog operands that were added after the profile was built get their
+similarities on demand.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from app.control.similarity_computer import get_action_equivalents
+from app.control.similarity_engine import SimilarityBlock, SimilarityEngine
+
+_logger = logging.getLogger(__name__)
+
+# number of catalog operands whose dense similarities to the log terms are computed at once
+CHUNK_SIZE = 4096
+
+
+class LogProfile:
+
+    def __init__(self, log_id, threshold, encoder, blocks: dict, embeddings: dict, action_equivalents: dict):
+        self.log_id = log_id
+        self.threshold = threshold
+        # name of the encoder backend the embeddings come from
+        self.encoder = encoder
+        # level -> SimilarityBlock of the catalog operands against the log terms of that level
+        self.blocks = blocks
+        # log term -> normalized embedding
+        self.embeddings = embeddings
+        self.action_equivalents = action_equivalents
+
+    def matches(self, threshold, encoder) -> bool:
+        """
+        Returns whether the profile was built with the given similarity threshold and encoder backend.
+        """
+        return self.threshold == threshold and self.encoder == encoder
+
+    def matched_operands(self, level) -> set:
+        """
+        Returns the catalog operands of `level` that are within the threshold of at least one log term.
+        """
+        block = self.blocks[level]
+        counts = np.diff(block.indptr)
+        return {operand for operand, i in block.rows.items() if counts[i] > 0}
+
+    def engine(self, nlp_helper, embedding_service=None) -> SimilarityEngine:
+        """
+        Returns a similarity engine that knows the embeddings of the log terms.
+        """
+        engine = SimilarityEngine(nlp_helper, embedding_service)
+        if len(self.embeddings) > 0:
+            engine.add_embeddings(list(self.embeddings), np.stack(list(self.embeddings.values())))
+        return engine
+
+    def save(self, path):
+        arrays = {}
+        for level, block in self.blocks.items():
+            arrays[f"{level}.operands"] = np.array(block.operands, dtype=str)
+            arrays[f"{level}.terms"] = np.array(block.terms.tolist(), dtype=str)
+            arrays[f"{level}.indptr"] = block.indptr
+            arrays[f"{level}.indices"] = block.indices
+            arrays[f"{level}.data"] = block.data
+        terms = list(self.embeddings)
+        arrays["embedding_terms"] = np.array(terms, dtype=str)
+        arrays["embeddings"] = np.stack([self.embeddings[term] for term in terms]) if len(terms) > 0 \
+            else np.zeros((0, 0), dtype=np.float32)
+        meta = {"log_id": self.log_id, "threshold": self.threshold, "encoder": self.encoder,
+                "levels": list(self.blocks), "action_equivalents": self.action_equivalents}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            blocks = {level: SimilarityBlock.from_csr(data[f"{level}.operands"].tolist(),
+                                                      data[f"{level}.terms"].tolist(), data[f"{level}.indptr"],
+                                                      data[f"{level}.indices"], data[f"{level}.data"],
+                                                      meta["threshold"])
+                      for level in meta["levels"]}
+            embeddings = dict(zip(data["embedding_terms"].tolist(), data["embeddings"]))
+        return cls(meta["log_id"], meta["threshold"], meta["encoder"], blocks, embeddings,
+                   meta["action_equivalents"])
+
+
+def build_log_profile(config, nlp_helper, log_info, objects, labels, resources, threshold=None,
+                      embedding_service=None, encoder=None, action_equivalents=None) -> LogProfile:
+    """
+    Builds the profile of the log against the catalog vocabulary, i.e., its `objects`, `labels` and `resources`.
+    """
+    engine = SimilarityEngine(nlp_helper, embedding_service)
+    log_terms = {config.OBJECT: list(log_info.objects),
+                 config.ACTIVITY: list(log_info.labels),
+                 config.RESOURCE: list(log_info.resources_to_tasks)}
+    blocks = {level: engine.block(operands, log_terms[level], threshold, chunk_size=CHUNK_SIZE)
+              for level, operands in ((config.OBJECT, objects), (config.ACTIVITY, labels),
+                                      (config.RESOURCE, resources))}
+    terms = list(dict.fromkeys(term for level_terms in log_terms.values() for term in level_terms))
+    embeddings = dict(zip(terms, engine.embed(terms))) if len(terms) > 0 else {}
+    if action_equivalents is None:
+        action_equivalents = get_action_equivalents(nlp_helper, log_info.actions)
+    _logger.info("Profiled log {} against {} catalog operands, kept {} similarities".format(
+        log_info.log_id, sum(len(block.rows) for block in blocks.values()),
+        sum(block.nnz for block in blocks.values())))
+    return LogProfile(log_info.log_id, threshold, encoder, blocks, embeddings, action_equivalents)
@@ -0,0 +1,217 @@
+"""
+NumPy-based conformance checking of Declare constraints without activation, correlation or time conditions.
+
+Traces are integer-encoded and indexed once per check (occurrence counts, first and last positions and
+directly-follows counts per trace and activity). Each template is then evaluated for all of its constraints at once
+as array expressions over these indexes, instead of replaying every trace for every constraint.
+"""
+import re
+
+import numpy as np
+from semconstmining.declare.enums import Template
+
+_CONSTRAINT_RE = re.compile(r"^\s*(?P<template>[^\[\d]+?)\s*(?P<n>\d*)\s*\[(?P<operands>.*)\]\s*(?P<conditions>.*)$")
+
+
+class TraceIndex:
+    """
+    Occurrence indexes of a set of integer-encoded traces.
+    """
+
+    def __init__(self, traces, vocabulary):
+        self.vocabulary = vocabulary
+        # codes of unknown activities point to an extra column that never occurs
+        self.n_codes = len(vocabulary) + 1
+        lengths = np.array([len(names) for _, names in traces], dtype=np.int64)
+        self.n_traces = len(traces)
+        self.offsets = np.zeros(self.n_traces + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.codes = np.array([vocabulary[name] for _, names in traces for name in names], dtype=np.int64)
+        self.trace_of = np.repeat(np.arange(self.n_traces, dtype=np.int64), lengths)
+        positions = np.arange(len(self.codes), dtype=np.int64) - self.offsets[self.trace_of]
+        cells = self.trace_of * self.n_codes + self.codes
+        self.counts = np.bincount(cells, minlength=self.n_traces * self.n_codes).reshape(self.n_traces, self.n_codes)
+        self.first = np.full((self.n_traces, self.n_codes), np.iinfo(np.int64).max, dtype=np.int64)
+        self.last = np.full((self.n_traces, self.n_codes), -1, dtype=np.int64)
+        # events are ordered by trace and position, so the first (last) event of a cell is its first (last) occurrence
+        unique_cells, first_index = np.unique(cells, return_index=True)
+        self.first.flat[unique_cells] = positions[first_index]
+        unique_cells, last_index = np.unique(cells[::-1], return_index=True)
+        self.last.flat[unique_cells] = positions[::-1][last_index]
+        non_empty = lengths > 0
+        self.first_code = np.full(self.n_traces, -1, dtype=np.int64)
+        self.last_code = np.full(self.n_traces, -1, dtype=np.int64)
+        self.first_code[non_empty] = self.codes[self.offsets[:-1][non_empty]]
+        self.last_code[non_empty] = self.codes[self.offsets[1:][non_empty] - 1]
+        # directly-follows pairs within the same trace
+        same_trace = self.trace_of[1:] == self.trace_of[:-1]
+        pair_keys = (self.trace_of[1:] * self.n_codes + self.codes[:-1]) * self.n_codes + self.codes[1:]
+        self.pair_keys, self.pair_counts = np.unique(pair_keys[same_trace], return_counts=True)
+
+    def code(self, operands):
+        return np.array([self.vocabulary.get(operand, self.n_codes - 1) for operand in operands], dtype=np.int64)
+
+    def follows_counts(self, a, b):
+        """
+        Returns how often each b directly follows each a, per trace (rows) and operand pair (columns).
+        """
+        keys = (np.arange(self.n_traces, dtype=np.int64)[:, None] * self.n_codes + a[None, :]) * self.n_codes + b[None, :]
+        if len(self.pair_keys) == 0:
+            return np.zeros(keys.shape, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        return np.where(self.pair_keys[found] == keys, self.pair_counts[found], 0)
+
+    def alternation_violations(self, a_code, b_code, precedence=False):
+        """
+        Returns the traces that violate alternate response (or alternate precedence) for one operand pair.
+        Only the a and b events of each trace are considered: a response is violated by an a that is followed by
+        another a or ends the trace, a precedence by a b that is preceded by another b or starts the trace.
+        """
+        mask = (self.codes == a_code) | (self.codes == b_code)
+        trace_of = self.trace_of[mask]
+        is_activation = self.codes[mask] == (b_code if precedence else a_code)
+        violated = np.zeros(self.n_traces, dtype=bool)
+        if len(trace_of) == 0:
+            return violated
+        same_trace = trace_of[1:] == trace_of[:-1]
+        repeated = is_activation[1:] & is_activation[:-1] & same_trace
+        violated[trace_of[1:][repeated]] = True
+        if precedence:
+            starts = np.concatenate(([True], ~same_trace))
+            violated[trace_of[starts & is_activation]] = True
+        else:
+            ends = np.concatenate((~same_trace, [True]))
+            violated[trace_of[ends & is_activation]] = True
+        return violated
+
+
+def _unary(evaluate):
+    def evaluate_group(index, a, b, n):
+        return evaluate(index, index.counts[:, a], a, n)
+    return evaluate_group
+
+
+def _binary(evaluate):
+    def evaluate_group(index, a, b, n):
+        return evaluate(index, a, b)
+    return evaluate_group
+
+
+def _response(index, a, b):
+    return (index.counts[:, a] > 0) & (index.last[:, a] > index.last[:, b])
+
+
+def _precedence(index, a, b):
+    return (index.counts[:, b] > 0) & (index.first[:, a] > index.first[:, b])
+
+
+def _chain_response(index, a, b):
+    return index.counts[:, a] > index.follows_counts(a, b)
+
+
+def _chain_precedence(index, a, b):
+    return index.counts[:, b] > index.follows_counts(a, b)
+
+
+def _alternate(index, a, b, precedence):
+    return np.stack([index.alternation_violations(a_code, b_code, precedence) for a_code, b_code in zip(a, b)],
+                    axis=1) if len(a) > 0 else np.zeros((index.n_traces, 0), dtype=bool)
+
+
+def _not_response(index, a, b):
+    return (index.counts[:, a] > 0) & (index.counts[:, b] > 0) & (index.first[:, a] < index.last[:, b])
+
+
+def _not_chain_response(index, a, b):
+    return index.follows_counts(a, b) > 0
+
+
+# evaluators return the violations per trace (rows) and constraint of the template group (columns)
+EVALUATORS = {
+    Template.EXISTENCE: _unary(lambda index, counts, a, n: counts < n),
+    Template.ABSENCE: _unary(lambda index, counts, a, n: counts >= n),
+    Template.EXACTLY: _unary(lambda index, counts, a, n: counts != n),
+    Template.INIT: _unary(lambda index, counts, a, n: index.first_code[:, None] != a[None, :]),
+    Template.END: _unary(lambda index, counts, a, n: index.last_code[:, None] != a[None, :]),
+    Template.CHOICE: _binary(lambda index, a, b: (index.counts[:, a] == 0) & (index.counts[:, b] == 0)),
+    Template.EXCLUSIVE_CHOICE: _binary(lambda index, a, b: (index.counts[:, a] > 0) == (index.counts[:, b] > 0)),
+    Template.RESPONDED_EXISTENCE: _binary(lambda index, a, b: (index.counts[:, a] > 0) & (index.counts[:, b] == 0)),
+    Template.CO_EXISTENCE: _binary(lambda index, a, b: (index.counts[:, a] > 0) != (index.counts[:, b] > 0)),
+    Template.RESPONSE: _binary(_response),
+    Template.PRECEDENCE: _binary(_precedence),
+    Template.SUCCESSION: _binary(lambda index, a, b: _response(index, a, b) | _precedence(index, a, b)),
+    Template.ALTERNATE_RESPONSE: _binary(lambda index, a, b: _alternate(index, a, b, precedence=False)),
+    Template.ALTERNATE_PRECEDENCE: _binary(lambda index, a, b: _alternate(index, a, b, precedence=True)),
+    Template.ALTERNATE_SUCCESSION: _binary(lambda index, a, b: _alternate(index, a, b, precedence=False) |
+                                           _alternate(index, a, b, precedence=True)),
+    Template.CHAIN_RESPONSE: _binary(_chain_response),
+    Template.CHAIN_PRECEDENCE: _binary(_chain_precedence),
+    Template.CHAIN_SUCCESSION: _binary(lambda index, a, b: _chain_response(index, a, b) |
+                                       _chain_precedence(index, a, b)),
+    Template.NOT_RESPONDED_EXISTENCE: _binary(lambda index, a, b: (index.counts[:, a] > 0) &
+                                              (index.counts[:, b] > 0)),
+    Template.NOT_RESPONSE: _binary(_not_response),
+    Template.NOT_PRECEDENCE: _binary(_not_response),
+    Template.NOT_SUCCESSION: _binary(_not_response),
+    Template.NOT_CHAIN_RESPONSE: _binary(_not_chain_response),
+    Template.NOT_CHAIN_PRECEDENCE: _binary(_not_chain_response),
+    Template.NOT_CHAIN_SUCCESSION: _binary(_not_chain_response),
+}
+
+TEMPLATES_BY_NAME = {template.templ_str: template for template in EVALUATORS}
+
+
+def parse_constraint(constraint_str):
+    """
+    Returns (template, operands, n) of a constraint string, or None if the constraint is not supported natively,
+    e.g., because of its template, because it has activation, correlation or time conditions, or because it is a
+    binary constraint on a single activity. The evaluators compare the positions of two distinct activities, which
+    does not give the Declare semantics of, e.g., Response[a, a].
+    """
+    match = _CONSTRAINT_RE.match(constraint_str)
+    if match is None or match.group("template") not in TEMPLATES_BY_NAME:
+        return None
+    if match.group("conditions").replace("|", "").strip() != "":
+        return None
+    template = TEMPLATES_BY_NAME[match.group("template")]
+    operands = [operand.strip() for operand in match.group("operands").split(", ")]
+    if template.is_binary and operands[0] == operands[-1]:
+        return None
+    n = int(match.group("n")) if match.group("n") else 1
+    return template, operands, n
+
+
+def split_supported(constraint_strings):
+    """
+    Splits constraint strings into those that the native checker supports and the rest.
+    """
+    supported, unsupported = [], []
+    for constraint_str in constraint_strings:
+        (supported if parse_constraint(constraint_str) is not None else unsupported).append(constraint_str)
+    return supported, unsupported
+
+
+def check_traces(constraint_strings, traces):
+    """
+    Checks the (supported) constraints on compact traces, i.e., (name, activity names) tuples.
+    Returns, like `Declare.conformance_checking`, the set of violated constraint strings per trace name.
+    """
+    vocabulary = {}
+    for _, names in traces:
+        for name in names:
+            vocabulary.setdefault(name, len(vocabulary))
+    index = TraceIndex(traces, vocabulary)
+    groups = {}
+    for constraint_str in constraint_strings:
+        template, operands, n = parse_constraint(constraint_str)
+        groups.setdefault(template, []).append((constraint_str, operands, n))
+    res = {trace_name: set() for trace_name, _ in traces}
+    trace_names = [trace_name for trace_name, _ in traces]
+    for template, constraints in groups.items():
+        a = index.code([operands[0] for _, operands, _ in constraints])
+        b = index.code([operands[-1] for _, operands, _ in constraints])
+        n = np.array([n for _, _, n in constraints], dtype=np.int64)
+        violated = EVALUATORS[template](index, a, b, n)
+        for trace, constraint in zip(*np.nonzero(violated)):
+            res[trace_names[trace]].add(constraints[constraint][0])
+    return res
@@ -0,0 +1,246 @@
+"""
+Approximate nearest-neighbour index over the operands of the best-practice catalog.
+
+Most catalog constraints are far from every term of a given log, yet the similarity stage scores all of them. The
+`OperandIndex` is an inverted-file (IVF) index over the normalized embeddings of all distinct catalog operands:
+operands are clustered with spherical k-means, and a query only scans the operands of the `n_probe` clusters whose
+centroids are most similar to it. `n_probe` is calibrated so that the operands found within a similarity threshold
+match brute force with at least a target recall.
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from app.control.similarity_engine import get_embeddings, normalize
+from app.control.util import ok
+
+_logger = logging.getLogger(__name__)
+
+INDEX_FILE = "operand_index.npz"
+CALIBRATION_SAMPLE_SIZE = 1000
+
+
+class OperandIndex:
+
+    def __init__(self, terms, embeddings, centroids, n_probe=1, trained_size=None):
+        self.terms = list(terms)
+        self.rows = {term: i for i, term in enumerate(self.terms)}
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.n_probe = n_probe
+        # number of operands the centroids were trained on, the index is retrained once it has doubled
+        self.trained_size = len(self.terms) if trained_size is None else trained_size
+        self._lock = threading.Lock()
+        self._build_lists()
+
+    @classmethod
+    def build(cls, terms, embeddings, n_lists=None, n_iter=10, seed=0):
+        """
+        Builds the index over the given terms and their normalized embeddings.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n_lists = n_lists or max(1, int(np.sqrt(len(terms))))
+        centroids = _spherical_kmeans(embeddings, n_lists, n_iter, seed)
+        return cls(terms, embeddings, centroids, n_probe=max(1, len(centroids) // 8))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.rows
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def _build_lists(self):
+        if len(self.terms) == 0 or self.n_lists == 0:
+            self.assignments = np.zeros(len(self.terms), dtype=np.int64)
+        else:
+            self.assignments = np.argmax(self.embeddings @ self.centroids.T, axis=1)
+        self.order = np.argsort(self.assignments, kind="stable")
+        self.offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.assignments, minlength=self.n_lists), out=self.offsets[1:])
+
+    def add(self, terms, embeddings):
+        """
+        Adds terms that are not indexed yet. New terms are assigned to the existing clusters; once the index has
+        doubled in size since the clusters were trained, they are retrained on all terms.
+        """
+        with self._lock:
+            positions = {term: i for i, term in enumerate(terms)}
+            new_terms = [term for term in positions if term not in self.rows]
+            if len(new_terms) == 0:
+                return 0
+            new_embeddings = np.asarray(embeddings, dtype=np.float32)[[positions[term] for term in new_terms]]
+            self.embeddings = new_embeddings if len(self.terms) == 0 else np.concatenate((self.embeddings,
+                                                                                         new_embeddings))
+            for term in new_terms:
+                self.rows[term] = len(self.terms)
+                self.terms.append(term)
+            if self.n_lists == 0 or len(self.terms) >= 2 * max(self.trained_size, 1):
+                self.centroids = _spherical_kmeans(self.embeddings, max(1, int(np.sqrt(len(self.terms)))))
+                self.trained_size = len(self.terms)
+                self.n_probe = min(self.n_probe, self.n_lists)
+            self._build_lists()
+            return len(new_terms)
+
+    def search(self, queries, threshold) -> list:
+        """
+        Returns, for each (normalized) query embedding, the indexed terms with a similarity of at least
+        `threshold` among the operands of the `n_probe` closest clusters.
+        """
+        with self._lock:
+            return self._search(queries, threshold, self.n_probe)
+
+    def search_exact(self, queries, threshold) -> list:
+        with self._lock:
+            return self._search(queries, threshold, self.n_lists)
+
+    def _search(self, queries, threshold, n_probe):
+        queries = np.asarray(queries, dtype=np.float32)
+        if len(self.terms) == 0 or len(queries) == 0:
+            return [[] for _ in range(len(queries))]
+        n_probe = min(n_probe, self.n_lists)
+        centroid_sims = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_sims, n_probe - 1, axis=1)[:, :n_probe]
+        res = []
+        for query, probe in zip(queries, probes):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+            sims = self.embeddings[candidates] @ query
+            res.append([self.terms[i] for i in candidates[sims >= threshold]])
+        return res
+
+    def recall(self, queries, threshold, n_probe=None, query_terms=None) -> float:
+        """
+        Returns the share of the brute-force matches of the queries that the index finds with `n_probe` clusters.
+        If the queries are indexed terms themselves (`query_terms`), their trivial self-matches are not counted.
+        """
+        with self._lock:
+            exact = self._search(queries, threshold, self.n_lists)
+            approx = self._search(queries, threshold, self.n_probe if n_probe is None else n_probe)
+        return _recall(approx, exact, query_terms)
+
+    def calibrate(self, queries, threshold, recall_target, query_terms=None):
+        """
+        Sets `n_probe` to the smallest number of probed clusters that reaches `recall_target` on the queries.
+        """
+        with self._lock:
+            exact = self._search(queries, threshold, self.n_lists)
+            self.n_probe = max(self.n_lists, 1)
+            for n_probe in range(1, self.n_lists + 1):
+                if _recall(self._search(queries, threshold, n_probe), exact, query_terms) >= recall_target:
+                    self.n_probe = n_probe
+                    break
+        _logger.info(f"Probing {self.n_probe} of {self.n_lists} clusters for a recall of at least {recall_target}")
+        return self.n_probe
+
+    def calibrate_on_sample(self, threshold, recall_target, sample_size=CALIBRATION_SAMPLE_SIZE, seed=0):
+        """
+        Calibrates `n_probe` on a sample of the indexed operands (log terms are not known in advance).
+        """
+        sample = np.random.default_rng(seed).permutation(len(self.terms))[:sample_size]
+        return self.calibrate(self.embeddings[sample], threshold, recall_target,
+                              query_terms=[self.terms[i] for i in sample])
+
+    def save(self, path):
+        with self._lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, terms=np.array(self.terms, dtype=str), embeddings=self.embeddings,
+                         centroids=self.centroids, n_probe=self.n_probe, trained_size=self.trained_size)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["terms"].tolist(), data["embeddings"], data["centroids"], int(data["n_probe"]),
+                       int(data["trained_size"]))
+
+
+def _recall(approx, exact, query_terms=None):
+    if query_terms is not None:
+        exact = [[term for term in matches if term != query_term] for matches, query_term in zip(exact, query_terms)]
+    n_exact = sum(len(matches) for matches in exact)
+    if n_exact == 0:
+        return 1.0
+    return sum(len(set(a) & set(e)) for a, e in zip(approx, exact)) / n_exact
+
+
+def _spherical_kmeans(embeddings, n_clusters, n_iter=10, seed=0):
+    if len(embeddings) == 0:
+        return np.zeros((0, embeddings.shape[1] if embeddings.ndim == 2 else 0), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(embeddings))
+    centroids = embeddings[rng.choice(len(embeddings), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        assignments = np.argmax(embeddings @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, embeddings)
+        empty = np.bincount(assignments, minlength=n_clusters) == 0
+        # re-seed empty clusters with random operands
+        sums[empty] = embeddings[rng.choice(len(embeddings), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32)
+
+
+def get_index_path(conf) -> Path:
+    return Path(conf.DATA_INTERIM) / INDEX_FILE
+
+
+def get_operands(config, constraints):
+    """
+    Returns the distinct operands (left and right operands and object types) of the constraints.
+    """
+    operands = (operand for c in constraints for operand in (c.left_operand, c.right_operand, c.object_type))
+    return list(dict.fromkeys(operand for operand in operands if ok(config, operand)))
+
+
+def build_operand_index(config, nlp_helper, constraints, threshold, recall_target, embedding_service=None):
+    """
+    Builds the operand index over the constraints, calibrates it and stores it.
+    """
+    operands = get_operands(config, constraints)
+    embeddings = normalize(get_embeddings(nlp_helper, operands, embedding_service)) if len(operands) > 0 \
+        else np.zeros((0, 0))
+    index = OperandIndex.build(operands, embeddings)
+    index.calibrate_on_sample(threshold, recall_target)
+    index.save(get_index_path(config))
+    _logger.info(f"Indexed {len(operands)} operands in {index.n_lists} clusters")
+    return index
+
+
+def load_operand_index(config):
+    path = get_index_path(config)
+    if not os.path.exists(path):
+        _logger.warning(f"No operand index at {path}, constraints are matched without prefiltering")
+        return None
+    return OperandIndex.load(path)
+
+
+def add_operands(config, nlp_helper, index: OperandIndex, constraints, threshold, recall_target,
+                 embedding_service=None):
+    """
+    Adds the operands of new constraints to the index and stores it. If the clusters were retrained, the number of
+    probed clusters is calibrated again.
+    """
+    operands = [operand for operand in get_operands(config, constraints) if operand not in index]
+    if len(operands) == 0:
+        return
+    index.add(operands, normalize(get_embeddings(nlp_helper, operands, embedding_service)))
+    if index.trained_size == len(index):
+        index.calibrate_on_sample(threshold, recall_target)
+    index.save(get_index_path(config))
+
+
+def matched_operands(index: OperandIndex, engine, log_terms, threshold) -> set:
+    """
+    Returns the indexed operands that are at least `threshold` similar to any of the log terms.
+    """
+    log_terms = list(log_terms)
+    if len(log_terms) == 0:
+        return set()
+    return {operand for matches in index.search(engine.embed(log_terms), threshold) for operand in matches}
@@ -4,6 +4,9 @@ from semconstmining.selection.instantiation.recommendation_config import Recomme
 
 import logging
 
+import numpy as np
+
+from app.control.log_index import LogIndex
 from app.model.fittedConstraint import FittedConstraint
 
 _logger = logging.getLogger(__name__)
@@ -11,10 +14,14 @@ _logger = logging.getLogger(__name__)
 
 class Recommender:
 
-    def __init__(self, config, recommender_config: RecommendationConfig, log_info: LogInfo):
+    def __init__(self, config, recommender_config: RecommendationConfig, log_info: LogInfo, log_index=None):
         self.config = config
         self.recommender_config = recommender_config
         self.log_info = log_info
+        self.log_index = LogIndex(log_info) if log_index is None else log_index
+        self.terms_per_level = {self.config.MULTI_OBJECT: self.log_index.objects,
+                                self.config.OBJECT: self.log_index.actions,
+                                self.config.ACTIVITY: self.log_index.labels}
         self.activation_based_on = {
             Template.ABSENCE.templ_str: [],
             Template.EXISTENCE.templ_str: [],
@@ -65,67 +72,67 @@ class Recommender:
             return 0
         if len(self.activation_based_on[fitted_constraint.constraint.constraint_type]) == 0:
             return 1
-        res = []
+        # the log terms an operand of a constraint of this level has to be among
+        terms = self.terms_per_level.get(fitted_constraint.constraint.level, frozenset())
+        checked = False
         for column in self.activation_based_on[fitted_constraint.constraint.constraint_type]:
             if column == self.config.LEFT_OPERAND:
-                if fitted_constraint.left_operand is None or fitted_constraint.left_operand == "":
-                    res.append(0)
-                elif fitted_constraint.constraint.level == self.config.MULTI_OBJECT and fitted_constraint.left_operand in self.log_info.objects:
-                    res.append(1)
-                elif fitted_constraint.constraint.level == self.config.OBJECT and fitted_constraint.left_operand in self.log_info.actions:
-                    res.append(1)
-                elif fitted_constraint.constraint.level == self.config.ACTIVITY and fitted_constraint.left_operand in self.log_info.labels:
-                    res.append(1)
-                else:
-                    res.append(0)
+                operand = fitted_constraint.left_operand
             elif column == self.config.RIGHT_OPERAND:
-                if fitted_constraint.right_operand is None or fitted_constraint.right_operand == "":
-                    res.append(0)
-                elif fitted_constraint.constraint.level == self.config.MULTI_OBJECT and fitted_constraint.right_operand in self.log_info.objects:
-                    res.append(1)
-                elif fitted_constraint.constraint.level == self.config.OBJECT and fitted_constraint.right_operand in self.log_info.actions:
-                    res.append(1)
-                elif fitted_constraint.constraint.level == self.config.ACTIVITY and fitted_constraint.right_operand in self.log_info.labels:
-                    res.append(1)
-                else:
-                    res.append(0)
-        return 1 if (len(res) > 0 and any(res)) or (len(res) == 0) else 0
+                operand = fitted_constraint.right_operand
+            else:
+                continue
+            checked = True
+            if operand is not None and operand != "" and operand in terms:
+                return 1
+        return 0 if checked else 1
 
     def recommend(self, constraints):
+        """
+        Scores the constraints by support and similarity and keeps those of at least `relevance_thresh` relevance,
+        at most `top_k` per level if the config has a `top_k`.
+        """
         if len(constraints) == 0:
             return constraints
-
-        act_consts_support = [fitted_constraint.constraint.support for fitted_constraint in constraints
-                              if fitted_constraint.constraint.level == self.config.ACTIVITY]
-        max_support_act = max(act_consts_support) if len(act_consts_support) > 0 else 0
-        obj_consts_support = [fitted_constraint.constraint.support for fitted_constraint in constraints
-                                if fitted_constraint.constraint.level == self.config.OBJECT]
-        max_support_obj = max(obj_consts_support) if len(obj_consts_support) > 0 else 0
-        multi_obj_consts_support = [fitted_constraint.constraint.support for fitted_constraint in constraints
-                                    if fitted_constraint.constraint.level == self.config.MULTI_OBJECT]
-        max_support_multi_obj = max(multi_obj_consts_support) if len(multi_obj_consts_support) > 0 else 0
-        res_consts_support = [fitted_constraint.constraint.support for fitted_constraint in constraints
-                                if fitted_constraint.constraint.level == self.config.RESOURCE]
-        max_support_res = max(res_consts_support) if len(res_consts_support) > 0 else 0
-        max_support_per_level = {
-            self.config.ACTIVITY: max_support_act,
-            self.config.OBJECT: max_support_obj,
-            self.config.MULTI_OBJECT: max_support_multi_obj,
-            self.config.RESOURCE: max_support_res
-        }
-        for fitted_constraint in constraints:
-            sim_score = self.get_sim_score(fitted_constraint)
-            fitted_constraint.relevance = (1 - self.recommender_config.semantic_weight) * (
-                    fitted_constraint.constraint.support / max_support_per_level[fitted_constraint.constraint.level]) + \
-                                          self.recommender_config.semantic_weight * sim_score \
-                if fitted_constraint.constraint.support > 0 else 0
-
+        levels = [self.config.ACTIVITY, self.config.OBJECT, self.config.MULTI_OBJECT, self.config.RESOURCE]
+        level_codes = {level: code for code, level in enumerate(levels)}
+        codes = np.fromiter((level_codes[c.constraint.level] for c in constraints), dtype=np.int64,
+                            count=len(constraints))
+        support = np.fromiter((c.constraint.support for c in constraints), dtype=np.float64, count=len(constraints))
+        sim_scores = np.fromiter((self.get_sim_score(c) or 0.0 for c in constraints), dtype=np.float64,
+                                 count=len(constraints))
+        max_support = np.zeros(len(levels))
+        np.maximum.at(max_support, codes, support)
+        weight = self.recommender_config.semantic_weight
+        relevance = np.zeros(len(constraints))
+        supported = support > 0
+        normalized_support = np.zeros(len(constraints))
+        normalized_support[supported] = support[supported] / max_support[codes[supported]]
+        relevance[supported] = (1 - weight) * normalized_support[supported] + weight * sim_scores[supported]
         _logger.info("Computed relevance scores.")
-        constraints = [constraint for constraint in constraints if
-                       constraint.relevance >= self.recommender_config.relevance_thresh]
+        selected = np.flatnonzero(relevance >= self.recommender_config.relevance_thresh)
+        top_k = self.recommender_config.top_k
+        if top_k is not None:
+            # at most top_k per level, so that every level that a client may ask for is represented
+            selected = np.sort(np.concatenate([self._top_k(selected[codes[selected] == code], relevance, top_k)
+                                               for code in range(len(levels))]))
+        constraints = [constraints[i] for i in selected]
+        for constraint, score, norm_support, sim_score, level_support in zip(
+                constraints, relevance[selected].tolist(), normalized_support[selected].tolist(),
+                sim_scores[selected].tolist(), max_support[codes[selected]].tolist()):
+            constraint.relevance = score
+            constraint.normalized_support = norm_support
+            constraint.sim_score = sim_score
+            constraint.max_level_support = level_support
         _logger.info("Recommended {} constraints".format(len(constraints)))
         return constraints
 
+    @staticmethod
+    def _top_k(indices, relevance, k):
+        if len(indices) <= k:
+            return indices
+        return indices[np.argpartition(-relevance[indices], k - 1)[:k]]
+
     def get_sim_score(self, fitted_constraint: FittedConstraint):
         if (fitted_constraint.constraint.level == self.config.OBJECT and fitted_constraint.object_type in
                 fitted_constraint.similarity):
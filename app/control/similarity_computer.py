@@ -1,7 +1,6 @@
-import itertools
 import logging
-from uuid import uuid4
 
+from app.control.similarity_engine import SimilarityEngine
 from app.control.util import ok
 from app.model.constraint import Constraint
 from app.model.fittedConstraint import FittedConstraint
@@ -9,23 +8,50 @@ from app.model.fittedConstraint import FittedConstraint
 _logger = logging.getLogger(__name__)
 
 
+def get_action_equivalents(nlp_helper, actions):
+    """
+    Maps every synonym or similar action of the log `actions` to the log action. If a term is equivalent to
+    several log actions, the last one wins.
+    """
+    equivalents = {}
+    for ext in actions:
+        for term in nlp_helper.get_synonyms(ext):
+            equivalents[term] = ext
+        for term in nlp_helper.get_similar_actions(ext):
+            equivalents[term] = ext
+    return equivalents
+
+
 class SimilarityComputer:
 
-    def __init__(self, config, nlp_helper, log_info):
+    def __init__(self, config, nlp_helper, log_info, sim_threshold=None, embedding_service=None,
+                 action_equivalents=None, profile=None):
         self.config = config
+        # similarities below the threshold are dropped right away, since the fitter would not instantiate them
+        self.sim_threshold = sim_threshold
         self.nlp_helper = nlp_helper
         self.sims = {}
         self.log_info = log_info
+        # with a `LogProfile`, the similarities to the catalog vocabulary were computed ahead of the request
+        self.profile = profile
+        self.engine = SimilarityEngine(nlp_helper, embedding_service) if profile is None \
+            else profile.engine(nlp_helper, embedding_service)
+        # built on first use if it is not passed in with the (cached) log
+        self.action_equivalents = action_equivalents if profile is None else profile.action_equivalents
         self.counter = 0
 
     def compute_similarities(self, log_info, act_constraints, obj_constraints, multi_obj_constraints, res_constraints,
                              objects, labels, resources, pre_compute=False):
-        if pre_compute:
-            self.nlp_helper.pre_compute_embeddings(sentences=self.log_info.labels + self.log_info.names +
-                                                             list(self.log_info.resources_to_tasks.keys()) +
-                                                             self.log_info.objects + self.log_info.actions)
-        self.sims = self.precompute_sims(objects, labels, resources)
-        fitted_constraints = [FittedConstraint(id=str(uuid4()),
+        if self.profile is not None:
+            self.sims = self.profile.blocks
+        else:
+            if pre_compute:
+                self.engine.embed(self.log_info.labels + list(self.log_info.resources_to_tasks.keys()) +
+                                  self.log_info.objects)
+            self.sims = self.precompute_sims(objects, labels, resources)
+        # the fields are built here from validated constraints, so pydantic validation is skipped. The ids are
+        # derived from the log and the constraint, so that matching a constraint again overwrites its instantiations
+        fitted_constraints = [FittedConstraint.model_construct(id=log_info.log_id + "_" + constraint.id,
                                                log=log_info.log_id,
                                                left_operand=constraint.left_operand,
                                                right_operand=constraint.right_operand,
@@ -36,7 +62,6 @@ class SimilarityComputer:
                                                constraint=constraint)
                               for constraint in act_constraints +
                               obj_constraints + multi_obj_constraints + res_constraints]
-        self.nlp_helper.store_sims()
         return fitted_constraints
 
     def _compute_similarities(self, constraint: Constraint):
@@ -52,63 +77,41 @@ class SimilarityComputer:
         elif constraint.level == self.config.RESOURCE:
             return self.get_similarities_for_resource_constraint(constraint)
 
+    def _sims(self, block, operand):
+        # operands that were not precomputed (e.g., missing terms) get their row on demand
+        if operand not in self.sims[block]:
+            return self.engine.block([operand], self.sims[block].terms, self.sim_threshold).row(operand)
+        return self.sims[block].row(operand)
+
     def get_similarities_for_object_constraint(self, constraint: Constraint):
-        object_sims = {self.config.OBJECT: {}, self.config.ACTION: {}}
-        for ext in self.log_info.objects:
-            combi = [(constraint.object_type, ext)]
-            object_sims[self.config.OBJECT][ext] = self.nlp_helper.get_sims(combi)[0]
-        for ext in self.log_info.actions:
-            synonyms = self.nlp_helper.get_synonyms(ext)
-            similar_actions = self.nlp_helper.get_similar_actions(ext)
-            if ok(self.config, constraint.left_operand):
-                if constraint.left_operand in synonyms or constraint.left_operand in similar_actions:
-                    object_sims[self.config.ACTION][constraint.left_operand] = ext
-            if ok(self.config, constraint.right_operand):
-                if constraint.right_operand in synonyms or constraint.right_operand in similar_actions:
-                    object_sims[self.config.ACTION][constraint.right_operand] = ext
+        object_sims = {self.config.OBJECT: self._sims(self.config.OBJECT, constraint.object_type),
+                       self.config.ACTION: {}}
+        if self.action_equivalents is None:
+            self.action_equivalents = get_action_equivalents(self.nlp_helper, self.log_info.actions)
+        for operand in (constraint.left_operand, constraint.right_operand):
+            if ok(self.config, operand) and operand in self.action_equivalents:
+                object_sims[self.config.ACTION][operand] = self.action_equivalents[operand]
         return object_sims
 
     def get_similarities_for_multi_object_constraint(self, constraint: Constraint):
         object_sims = {}
         if ok(self.config, constraint.left_operand):
-            object_sims[self.config.LEFT_OPERAND] = {}
+            object_sims[self.config.LEFT_OPERAND] = self._sims(self.config.OBJECT, constraint.left_operand)
         if ok(self.config, constraint.right_operand):
-            object_sims[self.config.RIGHT_OPERAND] = {}
-        for ext in self.log_info.objects:
-            if self.config.LEFT_OPERAND in object_sims:
-                combi = [(constraint.left_operand, ext)]
-                object_sims[self.config.LEFT_OPERAND][ext] = self.nlp_helper.get_sims(combi)[0]
-            if self.config.RIGHT_OPERAND in object_sims:
-                combi = [(constraint.left_operand, ext)]
-                object_sims[self.config.RIGHT_OPERAND][ext] = self.nlp_helper.get_sims(combi)[0]
+            object_sims[self.config.RIGHT_OPERAND] = self._sims(self.config.OBJECT, constraint.right_operand)
         return object_sims
 
     def get_similarities_for_activity_constraint(self, constraint: Constraint):
         label_sims = {}
         if ok(self.config, constraint.left_operand):
-            label_sims[self.config.LEFT_OPERAND] = {}
+            label_sims[self.config.LEFT_OPERAND] = self._sims(self.config.ACTIVITY, constraint.left_operand)
         if ok(self.config, constraint.right_operand):
-            label_sims[self.config.RIGHT_OPERAND] = {}
-        for ext in self.log_info.labels:
-            if self.config.LEFT_OPERAND in label_sims:
-                combi = [(constraint.left_operand, ext)]
-                label_sims[self.config.LEFT_OPERAND][ext] = self.nlp_helper.get_sims(combi)[0]
-            if self.config.RIGHT_OPERAND in label_sims:
-                combi = [(constraint.right_operand, ext)]
-                label_sims[self.config.RIGHT_OPERAND][ext] = self.nlp_helper.get_sims(combi)[0]
+            label_sims[self.config.RIGHT_OPERAND] = self._sims(self.config.ACTIVITY, constraint.right_operand)
         return label_sims
 
     def get_similarities_for_resource_constraint(self, constraint: Constraint):
-        label_sims = {self.config.LEFT_OPERAND: {}, self.config.RESOURCE: {}}
-        if ok(self.config, constraint.left_operand):
-            label_sims[self.config.LEFT_OPERAND] = {}
-        for ext in self.log_info.labels:
-            if self.config.LEFT_OPERAND in label_sims:
-                combi = [(constraint.left_operand, ext)]
-                label_sims[self.config.LEFT_OPERAND][ext] = self.nlp_helper.get_sims(combi)[0]
-        for ext in self.log_info.resources_to_tasks:
-            combi = [(constraint.object_type, ext)]
-            label_sims[self.config.RESOURCE][ext] = self.nlp_helper.get_sims(combi)[0]
+        label_sims = {self.config.LEFT_OPERAND: self._sims(self.config.ACTIVITY, constraint.left_operand),
+                      self.config.RESOURCE: self._sims(self.config.RESOURCE, constraint.object_type)}
         return label_sims
 
     def get_max_scores(self, fitted_constraint: FittedConstraint):
@@ -127,13 +130,18 @@ class SimilarityComputer:
         return score
 
     def precompute_sims(self, objects, labels, resources):
-        object_combis = [(x, y) for x, y in itertools.product(objects, self.log_info.objects) if x != y]
-        label_combis = [(x, y) for x, y in itertools.product(labels, self.log_info.labels) if x != y]
-        resource_combis = [(x, y) for x, y in itertools.product(resources, self.log_info.resources_to_tasks) if x != y]
+        """
+        Computes the similarities of the constraint objects, labels and resources to the objects, labels and
+        resources of the log, as one `SimilarityBlock` per level.
+        """
         _logger.info(
             "Precomputing similarities for {} object combinations, {} label combinations and {} resource combinations".format(
-                len(object_combis), len(label_combis), len(resource_combis)))
-        sims = self.nlp_helper.get_sims(object_combis)
-        sims += self.nlp_helper.get_sims(label_combis)
-        sims += self.nlp_helper.get_sims(resource_combis)
-        return {x: y for x, y in zip(object_combis + label_combis + resource_combis, sims)}
+                len(objects) * len(self.log_info.objects), len(labels) * len(self.log_info.labels),
+                len(resources) * len(self.log_info.resources_to_tasks)))
+        sims = {self.config.OBJECT: self.engine.block(objects, self.log_info.objects, self.sim_threshold),
+                self.config.ACTIVITY: self.engine.block(labels, self.log_info.labels, self.sim_threshold),
+                self.config.RESOURCE: self.engine.block(resources, list(self.log_info.resources_to_tasks),
+                                                        self.sim_threshold)}
+        _logger.info("Kept {} similarities at or above threshold {}".format(sum(block.nnz for block in sims.values()),
+                                                                          self.sim_threshold))
+        return sims
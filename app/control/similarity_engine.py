@@ -0,0 +1,119 @@
+"""
+Batched cosine similarities between the operands of catalog constraints and the terms of a log.
+
+Instead of asking the nlp helper for one (operand, term) pair at a time, the distinct operands and terms are embedded
+once and each block of similarities (e.g., all operands against all log labels) is computed as a single product of
+row-normalized embedding matrices. Constraints then look up their similarities by row.
+"""
+import numpy as np
+
+from app.control.encoders import encode
+
+
+def get_embeddings(nlp_helper, terms, service=None) -> np.ndarray:
+    """
+    Returns the sentence embeddings of `terms` as a float32 matrix (one row per term), through the
+    `EmbeddingService` if there is one and directly from the nlp helper otherwise.
+    """
+    if service is not None:
+        return service.embed(terms)
+    return encode(nlp_helper, terms)
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class SimilarityBlock:
+    """
+    The similarities of a set of operands (rows) to a set of log terms (columns), stored sparsely in CSR layout.
+    Only similarities of at least `threshold` are kept (all of them if `threshold` is None).
+    """
+
+    def __init__(self, operands, terms, matrix: np.ndarray, threshold=None):
+        self.terms = np.array(terms, dtype=object)
+        self.rows = {operand: i for i, operand in enumerate(operands)}
+        self.threshold = threshold
+        keep = np.ones(matrix.shape, dtype=bool) if threshold is None else matrix >= threshold
+        self.indptr = np.zeros(len(operands) + 1, dtype=np.int64)
+        np.cumsum(keep.sum(axis=1), out=self.indptr[1:])
+        self.indices = np.nonzero(keep)[1]
+        self.data = matrix[keep]
+
+    @classmethod
+    def from_csr(cls, operands, terms, indptr, indices, data, threshold=None) -> "SimilarityBlock":
+        block = cls.__new__(cls)
+        block.terms = np.array(terms, dtype=object)
+        block.rows = {operand: i for i, operand in enumerate(operands)}
+        block.threshold = threshold
+        block.indptr = np.asarray(indptr, dtype=np.int64)
+        block.indices = np.asarray(indices, dtype=np.int64)
+        block.data = np.asarray(data, dtype=np.float32)
+        return block
+
+    @property
+    def operands(self) -> list:
+        return list(self.rows)
+
+    def __contains__(self, operand):
+        return operand in self.rows
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def row(self, operand) -> dict:
+        """
+        Returns the (kept) similarities of `operand` to the log terms.
+        """
+        i = self.rows[operand]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return dict(zip(self.terms[self.indices[start:end]].tolist(), self.data[start:end].tolist()))
+
+
+class SimilarityEngine:
+    """
+    Computes `SimilarityBlock`s with the embeddings of the nlp helper. Normalized embeddings are kept per engine, so
+    terms that occur in several blocks are embedded once.
+    """
+
+    def __init__(self, nlp_helper, service=None):
+        self.nlp_helper = nlp_helper
+        self.service = service
+        self._embeddings = {}
+
+    def embed(self, terms) -> np.ndarray:
+        missing = list(dict.fromkeys(term for term in terms if term not in self._embeddings))
+        if len(missing) > 0:
+            self._embeddings.update(zip(missing, normalize(get_embeddings(self.nlp_helper, missing, self.service))))
+        if len(terms) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([self._embeddings[term] for term in terms])
+
+    def add_embeddings(self, terms, embeddings: np.ndarray):
+        """
+        Adds already normalized embeddings of `terms`, e.g., the persisted ones of a log profile.
+        """
+        self._embeddings.update(zip(terms, embeddings))
+
+    def block(self, operands, terms, threshold=None, chunk_size=None) -> SimilarityBlock:
+        """
+        Computes the block of `operands` against `terms`. With a `chunk_size`, the dense similarities are computed
+        for that many operands at a time, which bounds the memory needed for large vocabularies.
+        """
+        operands = list(dict.fromkeys(operands))
+        terms = list(terms)
+        if len(operands) == 0 or len(terms) == 0:
+            return SimilarityBlock(operands, terms, np.zeros((len(operands), len(terms)), dtype=np.float32),
+                                   threshold)
+        term_embeddings = self.embed(terms)
+        if chunk_size is None or len(operands) <= chunk_size:
+            return SimilarityBlock(operands, terms, self.embed(operands) @ term_embeddings.T, threshold)
+        chunks = [SimilarityBlock(operands[i:i + chunk_size], terms,
+                                  self.embed(operands[i:i + chunk_size]) @ term_embeddings.T, threshold)
+                  for i in range(0, len(operands), chunk_size)]
+        offsets = np.cumsum([0] + [chunk.nnz for chunk in chunks[:-1]])
+        indptr = np.concatenate([[0]] + [chunk.indptr[1:] + offset for chunk, offset in zip(chunks, offsets)])
+        return SimilarityBlock.from_csr(operands, terms, indptr, np.concatenate([chunk.indices for chunk in chunks]),
+                                        np.concatenate([chunk.data for chunk in chunks]), threshold)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 from app.model.constraint import Constraint
@@ -13,3 +15,8 @@ class FittedConstraint(BaseModel):
     similarity: dict
     relevance: float
     constraint: Constraint
+    # components of the relevance, so that it can be recomputed for another semantic weight without matching again:
+    # support / max_level_support and the similarity score of the instantiated operands
+    normalized_support: Optional[float] = None
+    sim_score: Optional[float] = None
+    max_level_support: Optional[float] = None
@@ -0,0 +1,17 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+def get_matched_constraint_id(log_id: str, constraint_id: str) -> str:
+    return f"{log_id}::{constraint_id}"
+
+
+class MatchedConstraint(BaseModel):
+    """
+    Marks a catalog constraint as matched against a log, so that it is not matched again.
+    """
+    id: str
+    log_id: str
+    constraint_id: str
+    time_of_matching: datetime
@@ -1,6 +1,9 @@
 # importing the zipfile module
+import gzip
 import os
-from zipfile import ZipFile
+import shutil
+import zlib
+from zipfile import BadZipFile, ZipFile
 from semconstmining.config import Config
 from sentence_transformers import SentenceTransformer
 
@@ -42,4 +45,57 @@ def check_data_directories_on_start(conf: Config):
             os.remove(conf.DATA_DATASET / file)
 
 
+# raised when reading a corrupt, truncated or mislabeled .gz or .zip upload
+CORRUPT_ARCHIVE_ERRORS = (BadZipFile, gzip.BadGzipFile, EOFError, zlib.error)
 
+
+def get_log_name(filename: str, archive=None) -> str:
+    """
+    Returns the name under which an uploaded file is stored in the logs directory.
+    Gzipped logs are stored decompressed, zipped logs under the name of the contained XES file.
+    """
+    filename = os.path.basename(filename)
+    if filename.endswith(".gz"):
+        return filename[:-len(".gz")]
+    if filename.endswith(".zip"):
+        try:
+            with ZipFile(archive, 'r') as zip_ref:
+                members = [name for name in zip_ref.namelist() if name.endswith(".xes")]
+        except BadZipFile as e:
+            raise ValueError(f"{filename} is not a valid zip file: {e}")
+        if len(members) == 0:
+            raise ValueError(f"{filename} does not contain an XES file")
+        return os.path.basename(members[0])
+    return filename
+
+
+def store_uploaded_log(upload_path, filename: str, log_dir) -> str:
+    """
+    Moves the uploaded file at `upload_path` into `log_dir`, decompressing .gz and .zip uploads on the way.
+    The log only becomes visible under its final name once it is completely written.
+    Returns the name of the stored log. Raises a `ValueError` if the upload is not a valid archive.
+    """
+    log_name = get_log_name(filename, upload_path)
+    target_path = os.path.join(log_dir, log_name)
+    if filename.endswith(".gz") or filename.endswith(".zip"):
+        tmp_path = upload_path + ".part"
+        try:
+            with open(tmp_path, "wb") as target:
+                if filename.endswith(".gz"):
+                    with gzip.open(upload_path, "rb") as source:
+                        shutil.copyfileobj(source, target)
+                else:
+                    with ZipFile(upload_path, 'r') as zip_ref:
+                        member = [name for name in zip_ref.namelist() if os.path.basename(name) == log_name][0]
+                        with zip_ref.open(member) as source:
+                            shutil.copyfileobj(source, target)
+            os.replace(tmp_path, target_path)
+        except CORRUPT_ARCHIVE_ERRORS as e:
+            raise ValueError(f"{os.path.basename(filename)} is not a valid archive: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            os.remove(upload_path)
+    else:
+        os.replace(upload_path, target_path)
+    return log_name
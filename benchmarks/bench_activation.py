@@ -0,0 +1,88 @@
+"""
+Compares activation filtering with the `LogIndex` to the original scans of the term lists of the `LogInfo`.
+
+Run from the root of the project: python -m benchmarks.bench_activation [n_candidates] [n_terms]
+"""
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from app.control.constraint_fitter import Instantiation
+from app.control.recommender import Recommender
+from app.model.constraint import Constraint
+from app.model.fittedConstraint import FittedConstraint
+
+Config = SimpleNamespace(OBJECT="Object", MULTI_OBJECT="Multi-object", ACTIVITY="Activity", RESOURCE="Resource",
+                         LEFT_OPERAND="left_operand", RIGHT_OPERAND="right_operand", ACTION="action")
+LEVELS = [Config.ACTIVITY, Config.OBJECT, Config.MULTI_OBJECT, Config.RESOURCE]
+
+
+def make_log_info(n_terms, seed=0):
+    rng = random.Random(seed)
+    objects = [f"object {i}" for i in range(n_terms)]
+    actions = [f"action {i}" for i in range(n_terms)]
+    labels = [f"{rng.choice(actions)} {rng.choice(objects)}" for _ in range(n_terms)]
+    return SimpleNamespace(objects=objects, actions=actions, labels=labels, label_to_original_label={},
+                           object_to_original_labels={}, action_to_original_labels={})
+
+
+def make_candidates(recommender, log_info, n, seed=0):
+    rng = random.Random(seed)
+    types = [t for t in recommender.activation_based_on if isinstance(t, str)]
+    terms = log_info.objects + log_info.actions + log_info.labels + [f"missing {i}" for i in range(100)] + [""]
+    candidates = []
+    for i in range(n):
+        constraint = Constraint(id=f"c{i}", constraint_type=rng.choice(types), constraint_str="", arity="Binary",
+                                level=rng.choice(LEVELS), left_operand="", right_operand="", object_type="",
+                                processmodel_id="m", support=1, provision_type="", provider="")
+        template = FittedConstraint(id=f"f{i}", log="log.xes", constraint_str="", left_operand="",
+                                    right_operand="", object_type="", similarity={}, relevance=0,
+                                    constraint=constraint)
+        candidates.append(Instantiation(template, f"f{i}", "", rng.choice(terms), rng.choice(terms),
+                                        rng.choice(terms)))
+    return candidates
+
+
+def compute_activation_by_scan(recommender, fitted_constraint):
+    """
+    The original `Recommender._compute_activation`, which scans the term lists of the `LogInfo`.
+    """
+    config = recommender.config
+    log_info = recommender.log_info
+    if fitted_constraint.constraint.constraint_type not in recommender.activation_based_on:
+        return 0
+    if len(recommender.activation_based_on[fitted_constraint.constraint.constraint_type]) == 0:
+        return 1
+    res = []
+    for column in recommender.activation_based_on[fitted_constraint.constraint.constraint_type]:
+        operand = fitted_constraint.left_operand if column == config.LEFT_OPERAND else fitted_constraint.right_operand
+        level = fitted_constraint.constraint.level
+        if operand is None or operand == "":
+            res.append(0)
+        elif level == config.MULTI_OBJECT and operand in log_info.objects:
+            res.append(1)
+        elif level == config.OBJECT and operand in log_info.actions:
+            res.append(1)
+        elif level == config.ACTIVITY and operand in log_info.labels:
+            res.append(1)
+        else:
+            res.append(0)
+    return 1 if (len(res) > 0 and any(res)) or (len(res) == 0) else 0
+
+
+if __name__ == "__main__":
+    n_candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    n_terms = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    log_info = make_log_info(n_terms)
+    recommender = Recommender(Config, SimpleNamespace(semantic_weight=0.5, relevance_thresh=0, top_k=None), log_info)
+    candidates = make_candidates(recommender, log_info, n_candidates)
+    start = time.perf_counter()
+    expected = [c for c in candidates if compute_activation_by_scan(recommender, c)]
+    before = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = recommender.recommend_by_activation(candidates)
+    after = time.perf_counter() - start
+    assert [c.id for c in actual] == [c.id for c in expected]
+    print(f"{n_candidates} candidates, {n_terms} terms per kind: list scans {before:.2f}s, "
+          f"log index {after:.3f}s, speedup {before / after:.0f}x ({len(actual)} activated)")
@@ -0,0 +1,46 @@
+"""
+Reports the encode throughput of every sentence encoder backend and its cosine deviation from the reference (the
+sentence model of the nlp helper).
+
+Run from the root of the project: python -m benchmarks.bench_encoders [n_terms] [n_threads]
+"""
+import sys
+import time
+from pathlib import Path
+
+from app.control.encoders import BACKENDS, NlpHelperEncoder, check_parity, get_encoder
+
+WORDS = ["create", "approve", "check", "send", "receive", "update", "reject", "ship", "post", "archive",
+         "purchase order", "invoice", "credit limit", "customer", "payment", "goods", "claim", "master data"]
+
+
+def make_terms(n_terms):
+    return [f"{WORDS[i % 10]} {WORDS[10 + (i // 10) % 8]} {i}" for i in range(n_terms)]
+
+
+def throughput(encoder, terms):
+    # warm up, e.g., the export of onnx graphs and lazy initialization
+    encoder.encode(terms[:8])
+    start = time.perf_counter()
+    encoder.encode(terms)
+    return len(terms) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from semconstmining.config import Config
+    from semconstmining.parsing.label_parser.nlp_helper import NlpHelper
+
+    load_dotenv()
+    n_terms = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    conf = Config(Path(__file__).parents[1].resolve(), "semantic_sap_sam_filtered")
+    nlp_helper = NlpHelper(conf)
+    reference = NlpHelperEncoder(nlp_helper, keep_cache=False)
+    terms = make_terms(n_terms)
+    for backend in BACKENDS:
+        encoder = get_encoder(conf, nlp_helper, backend, n_threads, keep_cache=False)
+        parity = check_parity(reference, encoder)
+        print(f"{backend}: {throughput(encoder, terms):.0f} terms/s, "
+              f"mean cosine deviation {parity['mean_cosine_deviation']:.2e}, "
+              f"max {parity['max_cosine_deviation']:.2e}")
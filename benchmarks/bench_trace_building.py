@@ -0,0 +1,78 @@
+"""
+Compares how /violations builds the traces it checks: the original per-event ParsedLabel lists built with
+iterrows and projected trace by trace, and the encoded log with its array-based projection of distinct traces.
+
+Run from the root of the project: python -m benchmarks.bench_trace_building [n_events]
+"""
+import random
+import sys
+import time
+
+import pandas as pd
+from pm4py.objects.log.obj import EventLog, Trace, Event
+
+from app.control.constraint_checking import clean_log_projection
+from app.control.encoded_log import encode_log
+
+
+class Config:
+    XES_CASE = "case:concept:name"
+    XES_NAME = "concept:name"
+    XES_ROLE = "org:role"
+    EN = "en"
+    TERMS_FOR_MISSING = ["", "None", "nan"]
+
+
+class Parsed:
+
+    def __init__(self, activity):
+        self.main_action, _, self.main_object = activity.partition(" ")
+        self.label = activity.lower()
+
+
+def make_log(n_events, n_cases, n_activities, seed=0):
+    rng = random.Random(seed)
+    return pd.DataFrame({Config.XES_CASE: [f"case {rng.randrange(n_cases)}" for _ in range(n_events)],
+                         Config.XES_NAME: [f"activity {rng.randrange(n_activities)}" for _ in range(n_events)],
+                         Config.XES_ROLE: [rng.choice(["clerk", "manager and clerk"]) for _ in range(n_events)]})
+
+
+def clean_log_projection_iterrows(config, log, parsed_tasks):
+    """
+    The original trace building: parsed labels and roles per event with iterrows, then one trace per case.
+    """
+    traces = {trace_id: [(parsed_tasks[event[config.XES_NAME]], event[config.XES_ROLE])
+                         for event_index, event in trace.iterrows()]
+              for trace_id, trace in log.groupby(config.XES_CASE)}
+    projection = EventLog()
+    for trace_id, trace in traces.items():
+        tmp_trace = Trace()
+        tmp_trace.attributes[config.XES_NAME] = trace_id
+        for parsed, res in trace:
+            if parsed.label not in config.TERMS_FOR_MISSING:
+                event = Event({config.XES_NAME: parsed.label})
+                event[config.XES_ROLE] = res.replace(" and ", " & ") if type(res) == str else "unknown"
+                tmp_trace.append(event)
+        if len(tmp_trace) > 0:
+            projection.append(tmp_trace)
+    return projection
+
+
+def clean_log_projection_encoded(config, log, parsed_tasks):
+    return clean_log_projection(encode_log(config, log, parsed_tasks=parsed_tasks), config, with_resources=True)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    log = make_log(n_events, n_events // 20, 50)
+    parsed_tasks = {activity: Parsed(activity) for activity in log[Config.XES_NAME].unique()}
+    before = timed(clean_log_projection_iterrows, Config, log, parsed_tasks)
+    after = timed(clean_log_projection_encoded, Config, log, parsed_tasks)
+    print(f"{n_events} events, clean-label projection with roles: iterrows {before:.2f}s, "
+          f"encoded {after:.3f}s, speedup {before / after:.0f}x")
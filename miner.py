@@ -2,7 +2,13 @@ import os
 from pathlib import Path
 
 import pandas as pd
-from app.boundary.dbconnect import AppConfigurationRepository, ConstraintRepository, get_base_config, get_db_client
+from app.boundary.dbconnect import AppConfigurationRepository, ConstraintRepository, get_base_config, \
+    check_hot_queries, ensure_indexes, get_db_client
+from app.boundary.embeddingstore import EmbeddingStore, get_store_dir
+from app.control.constraint_fitter import SIM_THRESHOLD
+from app.control.embedding_service import EmbeddingService
+from app.control.encoders import MAX_COSINE_DEVIATION, TORCH, get_checked_encoder
+from app.control.operand_index import build_operand_index
 from app.model.constraint import Constraint
 
 
@@ -42,6 +48,21 @@ def check_status_and_populate_db(client, conf, resource_handler):
     configuration_repository.save(base_config)
 
 
+def build_index(client, conf, nlp_helper):
+    constraint_repository = ConstraintRepository(database=client.get_database("bestPracticeData"))
+    constraints = list(constraint_repository.find_by({}))
+    # embed the operands with the backend that the app uses, see `Settings` in app/app.py
+    encoder, _ = get_checked_encoder(conf, nlp_helper, os.environ.get('ENCODER_BACKEND', TORCH),
+                                     int(os.environ.get('ENCODER_THREADS', 0)), keep_cache=False,
+                                     max_deviation=float(os.environ.get('ENCODER_MAX_DEVIATION',
+                                                                        MAX_COSINE_DEVIATION)))
+    store = EmbeddingStore(get_store_dir(conf, None if encoder.name == TORCH else encoder.name))
+    build_operand_index(conf, nlp_helper, constraints,
+                        threshold=float(os.environ.get('SIMILARITY_THRESHOLD', SIM_THRESHOLD)),
+                        recall_target=float(os.environ.get('OPERAND_INDEX_RECALL', 0.95)),
+                        embedding_service=EmbeddingService(nlp_helper, store, encoder=encoder))
+
+
 if __name__ == "__main__":
     from dotenv import load_dotenv
 
@@ -54,4 +75,9 @@ if __name__ == "__main__":
     nlp_helper = NlpHelper(conf)
     resource_handler = get_resource_handler(conf, nlp_helper=nlp_helper)
     client = get_db_client(os.environ.get('DB_URI'))
+    ensure_indexes(client)
     check_status_and_populate_db(client, conf, resource_handler)
+    for result in check_hot_queries(client):
+        print(result["collection"], result["query"], "uses an index" if result["uses_index"] else "scans",
+              result["stages"])
+    build_index(client, conf, nlp_helper)
@@ -0,0 +1,95 @@
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import Settings, State, create_app
+from app.control.ingestion import IngestionTracker, FAILED, READY
+from app.control.log_cache import LogCache
+
+XES = b"<?xml version='1.0' encoding='UTF-8'?><log><trace><event/></trace></log>"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    state = SimpleNamespace(log_path=str(log_dir), log_cache=LogCache(10 ** 9), ingestion=IngestionTracker(),
+                            miningconfig=SimpleNamespace(DATA_INTERIM=str(tmp_path / "interim"),
+                                                         DATA_LOGS=str(log_dir), UNARY="Unary", BINARY="Binary"),
+                            nlp_helper=None, db_client=SimpleNamespace(get_database=lambda name: None),
+                            checking_executor=None, profile_executor=ThreadPoolExecutor(1), operand_index="index",
+                            embedding_service=SimpleNamespace(close=lambda: None, encoder=SimpleNamespace(name="")))
+    monkeypatch.setattr(State, "from_settings", classmethod(lambda cls, settings: state))
+
+    def load_log_and_info(conf, nlp_helper, process):
+        if process.startswith("broken"):
+            raise ValueError("unparsable")
+        return pd.DataFrame({"case:concept:name": ["1"], "concept:name": ["a"]}), SimpleNamespace(
+            labels=["a"], objects=[], actions=["a"], label_to_original_label={"a": ["a"]},
+            object_to_original_labels={}, action_to_original_labels={"a": ["a"]})
+
+    monkeypatch.setattr(app_module, "load_log_and_info", load_log_and_info)
+    monkeypatch.setattr(app_module, "get_log_profile", lambda *args, **kwargs: state.build_profile())
+    state.build_profile = lambda: "profile"
+    with TestClient(create_app(Settings(log_path=str(log_dir), upload_chunk_size=16))) as test_client:
+        yield test_client, log_dir, state
+
+
+def test_upload_gz_is_stored_and_ingested(client):
+    test_client, log_dir, _ = client
+    response = test_client.post("/logs", files={"file": ("log.xes.gz", gzip.compress(XES))})
+    assert response.status_code == 200
+    assert "log.xes" in json.loads(response.json())["logs"]
+    assert (log_dir / "log.xes").read_bytes() == XES
+    # the chunks are written to a temporary file next to the logs, which is gone after the upload
+    assert os.listdir(log_dir) == ["log.xes"]
+    # background tasks of the test client run before the response is returned
+    status = json.loads(test_client.get("/logs/log.xes/status").json())
+    assert status["state"] == READY and status["error"] is None
+
+
+@pytest.mark.parametrize("filename, content", [("log.zip", XES), ("log.xes.gz", XES),
+                                               ("log.xes.gz", gzip.compress(XES)[:-20])])
+def test_corrupt_upload_is_rejected(client, filename, content):
+    test_client, log_dir, _ = client
+    response = test_client.post("/logs", files={"file": (filename, content)})
+    assert response.status_code == 422
+    assert os.listdir(log_dir) == []
+
+
+def test_status(client):
+    test_client, log_dir, _ = client
+    assert test_client.get("/logs/missing.xes/status").status_code == 404
+    (log_dir / "other.xes").write_bytes(XES)
+    assert json.loads(test_client.get("/logs/other.xes/status").json())["state"] == "not loaded"
+    test_client.post("/logs", files={"file": ("broken.xes", XES)})
+    status = json.loads(test_client.get("/logs/broken.xes/status").json())
+    assert status["state"] == FAILED and "unparsable" in status["error"]
+
+
+def test_constraints_fall_back_to_operand_index_until_profile_is_ready(client, monkeypatch):
+    test_client, log_dir, state = client
+    (log_dir / "log.xes").write_bytes(XES)
+    release = threading.Event()
+    state.build_profile = lambda: release.wait(timeout=5) and "profile"
+    requests = []
+    monkeypatch.setattr(app_module, "get_constraints_for_log_new", lambda **kwargs: requests.append(kwargs))
+    monkeypatch.setattr(app_module, "FittedConstraintRepository",
+                        lambda database: SimpleNamespace(find_by=lambda query: []))
+    conf = {"log": "log.xes", "min_relevance": 0.5, "min_support": 0, "unary": True, "binary": True,
+            "constraint_levels": ["Object"]}
+    # the first request loads the log and does not wait for the profile that is built in the background
+    assert test_client.put("/constraints/log", json=conf).status_code == 200
+    assert requests[-1]["profile"] is None and requests[-1]["operand_index"] == "index"
+    release.set()
+    state.profile_executor.submit(lambda: None).result()
+    assert test_client.put("/constraints/log", json=conf).status_code == 200
+    assert requests[-1]["profile"] == "profile"
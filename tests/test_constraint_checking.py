@@ -0,0 +1,144 @@
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from app.control.constraint_checking import NATIVE, check_constraints
+from app.control.encoded_log import encode_log
+from app.control.native_checker import check_traces
+from app.model.constraint import Constraint
+from app.model.fittedConstraint import FittedConstraint
+
+XES_CASE = "case:concept:name"
+XES_NAME = "concept:name"
+XES_ROLE = "org:role"
+
+
+class Config:
+    XES_CASE = XES_CASE
+    XES_NAME = XES_NAME
+    XES_ROLE = XES_ROLE
+    EN = "en"
+    TERMS_FOR_MISSING = ["", "None", "nan"]
+    OBJECT = "Object"
+    MULTI_OBJECT = "Multi-object"
+    ACTIVITY = "Activity"
+    RESOURCE = "Resource"
+
+
+class Parsed:
+
+    def __init__(self, activity):
+        self.main_action, _, self.main_object = activity.partition(" ")
+        self.label = activity
+
+
+def make_log(cases, roles=("clerk", "manager")):
+    """
+    Builds an event log from a list of traces, one per case.
+    """
+    rng = random.Random(0)
+    rows = [(f"case {i}", activity, rng.choice(roles)) for i, trace in enumerate(cases) for activity in trace]
+    return pd.DataFrame(rows, columns=[XES_CASE, XES_NAME, XES_ROLE])
+
+
+def encode(event_log):
+    parsed_tasks = {activity: Parsed(activity) for activity in event_log[XES_NAME].unique()}
+    return encode_log(Config, event_log, parsed_tasks=parsed_tasks)
+
+
+def make_fitted(level, constraint_str, object_type=""):
+    constraint = Constraint(id=constraint_str, constraint_type=constraint_str.split("[")[0],
+                            constraint_str=constraint_str, arity="Unary", level=level, left_operand="",
+                            right_operand="", object_type=object_type, processmodel_id="m", support=1,
+                            provision_type="", provider="")
+    return FittedConstraint(id=constraint_str, log="log.xes", constraint_str=constraint_str, left_operand="",
+                            right_operand="", object_type=object_type, similarity={}, relevance=0,
+                            constraint=constraint)
+
+
+def summarize(violations):
+    return sorted((v.constraint.constraint_str, sorted(v.cases), v.frequency) for v in violations)
+
+
+def check_per_case(event_log, constraint_strings):
+    """
+    Reference: checks every case on its own, without deduplicating traces, and drops the constraints that are
+    violated by more than 90% of the cases.
+    """
+    traces = [(case, tuple(trace[XES_NAME])) for case, trace in event_log.groupby(XES_CASE)]
+    res = check_traces(constraint_strings, traces)
+    cases_per_constraint = {}
+    for case, violated in res.items():
+        for constraint_str in violated:
+            cases_per_constraint.setdefault(constraint_str, []).append(case)
+    return sorted((constraint_str, sorted(cases), len(cases)) for constraint_str, cases in
+                  cases_per_constraint.items() if len(cases) <= 0.9 * len(traces))
+
+
+def test_ninety_percent_filter_counts_cases_not_variants():
+    # 20 cases, but only 4 distinct traces
+    event_log = make_log([["create order", "ship order"]] * 15 + [["create order", "bill order"]] * 3 +
+                         [["ship order", "bill order", "pay order", "check order"],
+                          ["create order", "check order", "cancel order"]])
+    constraint_strings = [
+        # violated by 18 of 20 cases (2 of 4 traces), exactly at the boundary and kept
+        "Existence[check order] | |",
+        # violated by 19 of 20 cases but only 3 of 4 traces, dropped
+        "Existence[cancel order] | |",
+        # violated by all cases and dropped
+        "Existence[refund order] | |",
+        # violated by the single case of the third trace
+        "Existence[create order] | |",
+        # violated by the cases of the first and the last trace
+        "Existence[bill order] | |",
+    ]
+    constraints = [make_fitted(Config.ACTIVITY, constraint_str) for constraint_str in constraint_strings]
+    res = check_constraints(constraints, Config, "log.xes", event_log, None, encoded=encode(event_log),
+                            checker=NATIVE)
+    actual = summarize(res[Config.ACTIVITY])
+    assert actual == check_per_case(event_log, constraint_strings)
+    assert [(constraint_str, frequency) for constraint_str, _, frequency in actual] == [
+        ("Existence[bill order] | |", 16), ("Existence[check order] | |", 18), ("Existence[create order] | |", 1)]
+    # the violations are expanded back to the ids of all cases of a trace
+    assert actual[0][1] == sorted([f"case {i}" for i in range(15)] + ["case 19"])
+
+
+def test_variant_checking_matches_per_case_checking():
+    rng = random.Random(1)
+    activities = ["create order", "ship order", "bill order", "pay order", "check order"]
+    variants = [[rng.choice(activities) for _ in range(rng.randint(1, 6))] for _ in range(15)]
+    event_log = make_log([rng.choice(variants) for _ in range(300)])
+    templates = ["Existence", "Absence", "Init", "End"]
+    constraint_strings = [f"{template}[{activity}] | |" for template in templates for activity in activities]
+    constraints = [make_fitted(Config.ACTIVITY, constraint_str) for constraint_str in constraint_strings]
+    res = check_constraints(constraints, Config, "log.xes", event_log, None, encoded=encode(event_log),
+                            checker=NATIVE)
+    expected = check_per_case(event_log, constraint_strings)
+    assert summarize(res[Config.ACTIVITY]) == expected
+    assert len(expected) > 5
+
+
+def test_sharded_parallel_checking_matches_sequential():
+    rng = random.Random(2)
+    activities = ["create order", "ship order", "bill invoice", "pay invoice", "check order"]
+    variants = [[rng.choice(activities) for _ in range(rng.randint(1, 6))] for _ in range(12)]
+    event_log = make_log([rng.choice(variants) for _ in range(100)])
+    actions = ["create", "ship", "bill", "pay", "check"]
+    constraints = ([make_fitted(Config.OBJECT, f"{template}[{action}] | |", object_type=obj)
+                    for template in ["Existence", "Init"] for action in actions for obj in ["order", "invoice"]] +
+                   [make_fitted(Config.MULTI_OBJECT, f"Response[{a}, {b}] | | |")
+                    for a, b in [("order", "invoice"), ("invoice", "order")]] +
+                   [make_fitted(level, f"{template}[{activity}] | |")
+                    for level in [Config.ACTIVITY, Config.RESOURCE] for template in ["Existence", "End"]
+                    for activity in activities])
+    encoded = encode(event_log)
+    sequential = check_constraints(constraints, Config, "log.xes", event_log, None, encoded=encoded, checker=NATIVE)
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as executor:
+        parallel = check_constraints(constraints, Config, "log.xes", event_log, None, encoded=encoded,
+                                     executor=executor, shard_size=1, checker=NATIVE)
+    assert set(parallel) == set(sequential)
+    for level in sequential:
+        assert summarize(parallel[level]) == summarize(sequential[level])
+    assert all(len(sequential[level]) > 0 for level in sequential)
@@ -0,0 +1,162 @@
+import random
+from copy import deepcopy
+from types import SimpleNamespace
+
+from app.control.constraint_fitter import FittedConstraintGenerator
+from app.control.similarity_computer import SimilarityComputer
+from app.model.constraint import Constraint
+from app.model.fittedConstraint import FittedConstraint
+from tests.test_similarity_engine import DummyNlpHelper
+
+
+class Config:
+    OBJECT = "Object"
+    MULTI_OBJECT = "Multi-object"
+    ACTIVITY = "Activity"
+    RESOURCE = "Resource"
+    LEFT_OPERAND = "left_operand"
+    RIGHT_OPERAND = "right_operand"
+    ACTION = "action"
+
+
+class DeepcopyGenerator(FittedConstraintGenerator):
+    """
+    The original instantiation, which deep-copies the template for every candidate.
+    """
+
+    def instantiate_obj_const(self, fitted_constraint_template, obj, act_l, act_r=None):
+        fitted_constraint = deepcopy(fitted_constraint_template)
+        fitted_constraint.object_type = obj
+        fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
+            fitted_constraint.constraint.object_type, obj)
+        fitted_constraint.id = fitted_constraint.id + "_" + self.config.OBJECT + "_" + obj
+        if act_l == act_r:
+            return None
+        if act_l is not None:
+            fitted_constraint.left_operand = act_l
+            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
+                fitted_constraint.constraint.left_operand, act_l)
+        if act_r is not None:
+            fitted_constraint.right_operand = act_r
+            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
+                fitted_constraint.constraint.right_operand, act_r)
+        return fitted_constraint
+
+    def instantiate_multi_obj_or_act_constraint(self, fitted_constraint_template, l_obj=None, r_obj=None):
+        fitted_constraint = deepcopy(fitted_constraint_template)
+        if l_obj is not None:
+            fitted_constraint.left_operand = l_obj
+            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
+                fitted_constraint.constraint.left_operand, l_obj)
+            fitted_constraint.id = fitted_constraint.id + "_" + self.config.OBJECT + "_" + l_obj
+        if r_obj is not None:
+            fitted_constraint.right_operand = r_obj
+            fitted_constraint.constraint_str = fitted_constraint.constraint_str.replace(
+                fitted_constraint.constraint.right_operand, r_obj)
+            fitted_constraint.id = fitted_constraint.id + "_" + self.config.OBJECT + "_" + r_obj
+        if fitted_constraint.left_operand == fitted_constraint.right_operand:
+            return None
+        return fitted_constraint
+
+    def instantiate_resource_constraint(self, fitted_constraint_template, act, res):
+        fitted_constraint = deepcopy(fitted_constraint_template)
+        fitted_constraint = self.instantiate_multi_obj_or_act_constraint(fitted_constraint, act, None)
+        fitted_constraint.constraint_str = fitted_constraint.constraint.constraint_str.replace(
+            fitted_constraint.constraint.object_type, res)
+        # derived from the template id, which starts with the log id, as the ids of the other instantiations
+        fitted_constraint.id = fitted_constraint_template.id + "_" + self.config.RESOURCE + act + "_" + res
+        return fitted_constraint
+
+
+def make_template(level, left, right="", object_type="", similarity=None):
+    constraint = Constraint(id=f"c-{level}-{left}", constraint_type="Response",
+                            constraint_str=f"Response[{left}, {right}] | | | {object_type}", arity="Binary",
+                            level=level, left_operand=left, right_operand=right, object_type=object_type,
+                            processmodel_id="m", support=3, provision_type="", provider="")
+    return FittedConstraint(id=f"f-{level}-{left}", log="log.xes", constraint_str=constraint.constraint_str,
+                            left_operand=left, right_operand=right, object_type=object_type,
+                            similarity=similarity, relevance=0, constraint=constraint)
+
+
+def make_templates():
+    labels = {"create purchase order": 0.9, "approve purchase order": 0.7, "pay invoice": 0.4, "check order": 0.6}
+    return [
+        make_template(Config.OBJECT, "create", "approve", "order",
+                      {Config.OBJECT: {"purchase order": 0.8, "sales order": 0.55, "invoice": 0.3},
+                       Config.ACTION: {"create": "create", "approve": "release"}}),
+        make_template(Config.OBJECT, "create", "create", "order",
+                      {Config.OBJECT: {"purchase order": 0.8}, Config.ACTION: {"create": "create"}}),
+        make_template(Config.MULTI_OBJECT, "order", "invoice", "",
+                      {Config.LEFT_OPERAND: {"purchase order": 0.8, "invoice": 0.6},
+                       Config.RIGHT_OPERAND: {"invoice": 0.9, "bill": 0.7}}),
+        make_template(Config.ACTIVITY, "create order", "approve order", "", {Config.LEFT_OPERAND: labels,
+                                                                             Config.RIGHT_OPERAND: labels}),
+        make_template(Config.RESOURCE, "create order", "", "clerk",
+                      {Config.LEFT_OPERAND: labels, Config.RESOURCE: {"clerk": 0.9, "manager": 0.5}}),
+    ]
+
+
+def test_instantiations_match_deepcopied_models():
+    expected = DeepcopyGenerator(Config, None).fit_constraints(make_templates(), sim_threshold=0.5)
+    instantiations = FittedConstraintGenerator(Config, None).fit_constraints(make_templates(), sim_threshold=0.5)
+    actual = [instantiation.materialize() for instantiation in instantiations]
+    assert len(actual) > 10
+    assert sorted((c.model_dump() for c in actual), key=lambda c: c["id"]) == \
+           sorted((c.model_dump() for c in expected), key=lambda c: c["id"])
+
+
+def test_instantiations_share_the_template():
+    templates = make_templates()
+    instantiations = FittedConstraintGenerator(Config, None).fit_constraints(templates, sim_threshold=0.5)
+    assert all(any(i.constraint is t.constraint for t in templates) for i in instantiations)
+    # the template is left untouched
+    assert [t.model_dump() for t in templates] == [t.model_dump() for t in make_templates()]
+
+
+def test_top_k_keeps_the_most_similar_pairs():
+    rng = random.Random(0)
+    labels = [f"label {i}" for i in range(40)]
+    left = {label: rng.uniform(0.3, 1) for label in labels}
+    right = {label: rng.uniform(0.3, 1) for label in rng.sample(labels, 30)}
+    template = make_template(Config.ACTIVITY, "create order", "approve order", "",
+                             {Config.LEFT_OPERAND: left, Config.RIGHT_OPERAND: right})
+    pairs = sorted(((l, r) for l in left for r in right if l != r and left[l] >= 0.5 and right[r] >= 0.5),
+                   key=lambda p: -(left[p[0]] + right[p[1]]))
+    top = FittedConstraintGenerator(Config, None, top_k=25).fit_constraints([template], sim_threshold=0.5)
+    assert [(c.left_operand, c.right_operand) for c in top] == pairs[:25]
+    everything = FittedConstraintGenerator(Config, None).fit_constraints([template], sim_threshold=0.5)
+    assert len(everything) == len(pairs)
+    generator = FittedConstraintGenerator(Config, None, top_k=len(pairs))
+    assert len(generator.fit_constraints([template], sim_threshold=0.5)) == len(pairs)
+
+
+def test_top_k_for_resource_constraints_ranks_activities():
+    template = make_templates()[-1]
+    top = FittedConstraintGenerator(Config, None, top_k=3).fit_constraints([template], sim_threshold=0.5)
+    assert [(c.left_operand, c.constraint_str.split("| ")[-1]) for c in top] == [
+        ("create purchase order", "clerk"), ("create purchase order", "manager"), ("approve purchase order", "clerk")]
+
+
+def test_instantiation_ids_are_unique_across_logs():
+    config = SimpleNamespace(**{k: v for k, v in vars(Config).items() if not k.startswith("_")},
+                             TERMS_FOR_MISSING=[""])
+    templates = [make_template(Config.OBJECT, "create", "approve", "order", {}),
+                 make_template(Config.MULTI_OBJECT, "order", "invoice", "", {}),
+                 make_template(Config.ACTIVITY, "create order", "pay invoice", "", {}),
+                 make_template(Config.RESOURCE, "create order", "", "clerk", {})]
+    constraints = [template.constraint for template in templates]
+    ids = {}
+    for log_id in ["a.xes", "b.xes"]:
+        log_info = SimpleNamespace(log_id=log_id, objects=["order", "invoice"], labels=["create order", "pay invoice"],
+                                   resources_to_tasks={"clerk": set()}, actions=["create", "approve"])
+        computer = SimilarityComputer(config, DummyNlpHelper(), log_info, sim_threshold=0.9,
+                                      action_equivalents={"create": "create", "approve": "approve"})
+        fitted = computer.compute_similarities(log_info, constraints[2:3], constraints[:1], constraints[1:2],
+                                               constraints[3:], ["order", "invoice"],
+                                               ["create order", "pay invoice"], ["clerk"])
+        instantiations = FittedConstraintGenerator(config, log_info).fit_constraints(fitted, sim_threshold=0.9)
+        assert {i.constraint.level for i in instantiations} == {template.constraint.level for template in templates}
+        ids[log_id] = {i.id for i in instantiations}
+        assert all(i.startswith(log_id + "_") for i in ids[log_id])
+    # fitted constraints are upserted by id, so the instantiations of one log must not overwrite another's
+    assert ids["a.xes"].isdisjoint(ids["b.xes"])
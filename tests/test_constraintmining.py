@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+from pymongo.errors import OperationFailure
+
+import app.boundary.constraintmining as constraintmining
+from app.boundary.constraintmining import get_constraints_for_log_new
+from app.boundary.dbconnect import ConstraintRepository
+from app.model.constraint import Constraint
+from tests.test_recommender import matches, run_pipeline
+from tests.test_similarity_engine import DummyNlpHelper
+
+
+class Config:
+    OBJECT = "Object"
+    MULTI_OBJECT = "Multi-object"
+    ACTIVITY = "Activity"
+    RESOURCE = "Resource"
+    LEFT_OPERAND = "left_operand"
+    RIGHT_OPERAND = "right_operand"
+    ACTION = "action"
+    TERMS_FOR_MISSING = ["", "None", "nan"]
+
+
+class FakeCollection:
+    """
+    The part of a pymongo collection that the repositories use, on documents held in memory.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+
+    def find(self, query, projection=None):
+        return [dict(document) for document in self.documents.values() if matches(document, query)]
+
+    def aggregate(self, pipeline):
+        return run_pipeline(self.find({}), pipeline, self.database)
+
+    def insert_many(self, documents):
+        for document in documents:
+            self.documents[document["_id"]] = dict(document)
+
+    def update_one(self, query, update, upsert=False):
+        self.documents.setdefault(query["_id"], {"_id": query["_id"]}).update(update["$set"])
+
+    def bulk_write(self, operations):
+        for operation in operations:
+            self.update_one(operation._filter, operation._doc, operation._upsert)
+
+    def delete_one(self, query):
+        self.documents.pop(query["_id"], None)
+
+    def create_indexes(self, indexes):
+        # as MongoDB, an index that exists with the same name and keys is left as it is
+        for index in indexes:
+            document = dict(index.document)
+            document["key"] = list(document["key"].items())
+            name = document.pop("name")
+            if name in self.indexes and self.indexes[name] != document:
+                raise OperationFailure(f"An index named {name} exists with different options")
+            self.indexes[name] = document
+        return [index.document["name"] for index in indexes]
+
+    def index_information(self):
+        return {name: dict(index) for name, index in self.indexes.items()}
+
+    def drop_index(self, name):
+        del self.indexes[name]
+
+
+class FakeDatabase(dict):
+
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        collection.database = self
+        return collection
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.database = FakeDatabase()
+
+    def get_database(self, name):
+        return self.database
+
+
+LOG_INFO = SimpleNamespace(log_id="log.xes", objects=["order", "invoice"],
+                           labels=["create order", "approve invoice", "pay invoice", "ship order"],
+                           actions=["create", "approve", "pay", "ship"], resources_to_tasks={"clerk": set()},
+                           label_to_original_label={}, object_to_original_labels={}, action_to_original_labels={})
+
+
+def make_catalog():
+    constraints = []
+    for i, left in enumerate(LOG_INFO.labels):
+        for j, right in enumerate(LOG_INFO.labels):
+            if left != right:
+                constraints.append(Constraint(id=f"c{i}{j}", constraint_type="Response",
+                                              constraint_str=f"Response[{left}, {right}] | | |", arity="Binary",
+                                              level=Config.ACTIVITY, left_operand=left, right_operand=right,
+                                              object_type="", processmodel_id="m", support=0 if i == 0 else i + j,
+                                              provision_type="", provider=""))
+    return constraints
+
+
+def test_constraints_are_matched_once_per_log(monkeypatch):
+    db_client = FakeClient()
+    ConstraintRepository(database=db_client.get_database("bestPracticeData")).save_many(make_catalog())
+    considered = []
+
+    def compute_relevance(config, nlp, *constraints_per_level, **kwargs):
+        considered.append(sum(len(constraints) for constraints in constraints_per_level[:4]))
+        return original(config, nlp, *constraints_per_level, **kwargs)
+
+    original = constraintmining.compute_relevance
+    monkeypatch.setattr(constraintmining, "compute_relevance", compute_relevance)
+    # the constraints with support 0 fall below the relevance threshold and at most one is kept per level
+    rec_config = SimpleNamespace(semantic_weight=0.5, relevance_thresh=0.6, top_k=1)
+    query = {"level": {"$in": [Config.ACTIVITY]}}
+    first = get_constraints_for_log_new(db_client, Config, DummyNlpHelper(), LOG_INFO, query, rec_config,
+                                        sim_threshold=0.9)
+    assert considered == [12] and len(first) == 1
+    second = get_constraints_for_log_new(db_client, Config, DummyNlpHelper(), LOG_INFO, query, rec_config,
+                                         sim_threshold=0.9)
+    # every considered constraint was marked, including those whose instantiations were cut
+    assert considered == [12, 0]
+    assert [c.model_dump() for c in second] == [c.model_dump() for c in first]
@@ -0,0 +1,136 @@
+from datetime import datetime
+
+import pytest
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.boundary.constraintmining import get_rerank_pipeline, get_unmatched_pipeline
+from app.boundary.dbconnect import REPOSITORIES, ConstraintRepository, FittedConstraintRepository, \
+    MatchedConstraintRepository, MatchingRepository, _plan_stages, check_hot_queries, ensure_indexes, \
+    migrate_matchings
+from tests.test_constraintmining import FakeClient, FakeCollection, FakeDatabase
+
+
+def equality_fields(query) -> set:
+    return {field for field, condition in query.items() if not isinstance(condition, dict) or "$in" in condition}
+
+
+def serving_indexes(repository_class, query) -> list[str]:
+    """
+    The declared indexes whose leading key is filtered by `query` and that hold all of its equality fields, so that
+    the query only scans the index entries of the documents it returns, up to its range conditions.
+    """
+    return [index.document["name"] for index in getattr(repository_class.Meta, "indexes", [])
+            if next(iter(index.document["key"])) in query
+            and equality_fields(query) <= set(index.document["key"])]
+
+
+class PlannedCursor:
+    """
+    Plans a query as MongoDB does for single field predicates: an index is a candidate if the query filters its
+    leading key.
+    """
+
+    def __init__(self, collection, query):
+        self.collection = collection
+        self.query = query
+
+    def sort(self, sort):
+        return self
+
+    def explain(self):
+        for name, index in self.collection.indexes.items():
+            if index["key"][0][0] in self.query:
+                plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": name}}
+                break
+        else:
+            plan = {"stage": "COLLSCAN"}
+        return {"queryPlanner": {"winningPlan": plan}}
+
+
+class PlanningCollection(FakeCollection):
+
+    def find(self, query, projection=None):
+        return PlannedCursor(self, query)
+
+
+class PlanningDatabase(FakeDatabase):
+
+    def __missing__(self, name):
+        collection = self[name] = PlanningCollection()
+        collection.name = name
+        return collection
+
+
+def test_ensure_indexes_is_idempotent():
+    client = FakeClient()
+    ensure_indexes(client)
+    indexes = {name: collection.index_information() for name, collection in client.database.items()}
+    for repository_class in REPOSITORIES:
+        for index in getattr(repository_class.Meta, "indexes", []):
+            assert index.document["name"] in indexes[repository_class.Meta.collection_name]
+    ensure_indexes(client)
+    assert {name: collection.index_information() for name, collection in client.database.items()} == indexes
+    # an index that was changed has to be dropped first
+    collection = client.database[ConstraintRepository.Meta.collection_name]
+    with pytest.raises(OperationFailure):
+        collection.create_indexes([IndexModel([("support", DESCENDING)], name="support")])
+
+
+def test_plan_stages():
+    assert _plan_stages({"stage": "COLLSCAN"}) == {"COLLSCAN"}
+    plan = {"stage": "SUBPLAN", "inputStage": {
+        "stage": "OR", "inputStages": [{"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                                       {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}]}}
+    assert _plan_stages(plan) == {"SUBPLAN", "OR", "FETCH", "IXSCAN", "SORT", "COLLSCAN"}
+    assert _plan_stages({"queryPlan": {"stage": "PROJECTION_SIMPLE", "inputStage": {"stage": "IXSCAN"}},
+                         "slotBasedPlan": {}}) == {"PROJECTION_SIMPLE", "IXSCAN"}
+
+
+def test_hot_queries_use_the_declared_indexes():
+    database = PlanningDatabase()
+    client = FakeClient()
+    client.database = database
+    ensure_indexes(client)
+    results = check_hot_queries(client)
+    assert len(results) == sum(len(getattr(repository_class.Meta, "hot_queries", []))
+                               for repository_class in REPOSITORIES)
+    assert all(result["uses_index"] and "COLLSCAN" not in result["stages"] for result in results)
+    for repository_class in REPOSITORIES:
+        for query, _ in getattr(repository_class.Meta, "hot_queries", []):
+            assert len(serving_indexes(repository_class, query)) > 0, query
+    # without the indexes, the same queries scan the collections
+    database.clear()
+    assert not any(result["uses_index"] for result in check_hot_queries(client))
+
+
+def test_query_shapes_of_the_app_are_hot_queries_served_by_an_index():
+    # the catalog query of PUT /constraints/log for one level, and the marker lookup of its anti-join
+    unmatched = get_unmatched_pipeline("log.xes", {"level": "Activity", "support": {"$gte": 1},
+                                                   "arity": {"$in": ["Unary", "Binary"]}})
+    lookup = unmatched[1]["$lookup"]
+    marker_query = {lookup["foreignField"]: "c1"} | lookup["pipeline"][0]["$match"]
+    # the re-ranking of PUT /constraints/log/rerank
+    rerank = get_rerank_pipeline("log.xes", 0.5, 0.5, 250, {"constraint.support": {"$gte": 0},
+                                                            "constraint.level": {"$in": ["Activity"]}})
+    shapes = [(ConstraintRepository, unmatched[0]["$match"]), (MatchedConstraintRepository, marker_query),
+              (FittedConstraintRepository, rerank[0]["$match"])]
+    assert lookup["from"] == MatchedConstraintRepository.Meta.collection_name
+    for repository_class, query in shapes:
+        assert set(query) in [set(hot_query) for hot_query, _ in repository_class.Meta.hot_queries], query
+        assert len(serving_indexes(repository_class, query)) > 0, query
+
+
+def test_migrate_matchings_drops_the_obsolete_index():
+    client = FakeClient()
+    matchings = client.database[MatchingRepository.Meta.collection_name]
+    matchings.create_indexes([IndexModel([("log_id", ASCENDING), ("time_of_matching", DESCENDING)],
+                                         name="log_time")])
+    matchings.insert_many([{"_id": "m1", "considered_constraints": ["c1", "c2", "c1"], "log_id": "log.xes",
+                            "time_of_matching": datetime(2024, 1, 1)}])
+    migrate_matchings(client)
+    markers = client.database[MatchedConstraintRepository.Meta.collection_name].find({})
+    assert sorted(marker["constraint_id"] for marker in markers) == ["c1", "c2"]
+    assert matchings.find({}) == [] and set(matchings.index_information()) == {"_id_"}
+    # nothing is left to migrate or drop
+    migrate_matchings(client)
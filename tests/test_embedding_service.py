@@ -0,0 +1,139 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.boundary.embeddingstore import EmbeddingStore
+from app.control.embedding_service import EmbeddingService
+
+
+def embedding(sentence):
+    return np.full(4, sum(map(ord, sentence)), dtype=np.float32)
+
+
+class SentenceModel:
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def encode(self, sentences, convert_to_numpy=False):
+        self.batches.append(list(sentences))
+        return np.stack([embedding(sentence) for sentence in sentences])
+
+
+class SlowNlpHelper:
+
+    def __init__(self):
+        self.known_embeddings = {}
+        self.batches = []
+        self.sent_model = SentenceModel(self.batches)
+
+    def pre_compute_embeddings(self, sentences):
+        self.batches.append(list(sentences))
+        time.sleep(0.01)
+        for sentence in sentences:
+            self.known_embeddings[sentence] = embedding(sentence)
+
+
+def test_concurrent_requests_share_batches():
+    nlp_helper = SlowNlpHelper()
+    service = EmbeddingService(nlp_helper, max_batch_size=64, max_wait_ms=50)
+    requests = [[f"term {i}", f"term {i + 1}", "shared"] for i in range(8)]
+    results = [None] * len(requests)
+
+    def request(i):
+        results[i] = service.embed(requests[i])
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for terms, result in zip(requests, results):
+        assert np.array_equal(result[:, 0], [sum(map(ord, term)) for term in terms])
+    encoded = [term for batch in nlp_helper.batches for term in batch]
+    assert sorted(encoded) == sorted(set(encoded))
+    stats = service.stats()
+    assert stats["encoded_terms"] == 10
+    assert stats["batches"] < len(requests)
+    assert 0 < stats["batch_fill_rate"] <= 1
+    service.close()
+
+
+def test_cached_terms_are_not_encoded_again(tmp_path):
+    nlp_helper = SlowNlpHelper()
+    service = EmbeddingService(nlp_helper, EmbeddingStore(tmp_path), max_wait_ms=1)
+    first = service.embed(["order", "invoice"])
+    second = EmbeddingService(SlowNlpHelper(), EmbeddingStore(tmp_path)).embed(["invoice", "order"])
+    assert np.array_equal(first[::-1], second)
+    assert nlp_helper.known_embeddings == {}
+    assert service.stats()["encoded_terms"] == 2
+    assert service.embed(["order"]).shape == (1, 4)
+    assert service.stats()["cached_terms"] == 1
+    service.close()
+
+
+class ConstantEncoder:
+
+    name = "constant"
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, terms):
+        self.batches.append(list(terms))
+        return np.ones((len(terms), 4), dtype=np.float32)
+
+
+def test_encoder_backend_replaces_nlp_helper():
+    nlp_helper = SlowNlpHelper()
+    encoder = ConstantEncoder()
+    service = EmbeddingService(nlp_helper, max_wait_ms=1, encoder=encoder)
+    assert np.array_equal(service.embed(["order", "invoice"]), np.ones((2, 4)))
+    assert nlp_helper.batches == [] and encoder.batches == [["order", "invoice"]]
+    assert service.stats()["encoder"] == "constant"
+    service.close()
+
+
+class BlockingEncoder(ConstantEncoder):
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def encode(self, terms):
+        self.started.set()
+        self.release.wait(timeout=5)
+        return super().encode(terms)
+
+
+def test_close_fails_queued_terms():
+    encoder = BlockingEncoder()
+    service = EmbeddingService(SlowNlpHelper(), max_batch_size=1, max_wait_ms=1, encoder=encoder)
+    results = {}
+
+    def request(term):
+        try:
+            results[term] = service.embed([term])
+        except RuntimeError as e:
+            results[term] = e
+
+    encoding = threading.Thread(target=request, args=("order",))
+    encoding.start()
+    assert encoder.started.wait(timeout=5)
+    queued = threading.Thread(target=request, args=("invoice",))
+    queued.start()
+    while service.stats()["queued_terms"] == 0:
+        time.sleep(0.001)
+    service.close()
+    queued.join(timeout=5)
+    assert isinstance(results["invoice"], RuntimeError)
+    # the batch that was being encoded is still handed back
+    encoder.release.set()
+    encoding.join(timeout=5)
+    assert np.array_equal(results["order"], np.ones((1, 4)))
+    assert encoder.batches == [["order"]]
+    with pytest.raises(RuntimeError, match="closed"):
+        service.embed(["order"])
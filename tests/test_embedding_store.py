@@ -0,0 +1,32 @@
+import numpy as np
+
+from app.boundary.embeddingstore import EmbeddingStore, MATRIX_FILE
+
+
+def test_add_and_get(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    embeddings = np.random.default_rng(0).normal(size=(3, 4)).astype(np.float32)
+    assert store.add(["order", "invoice", "order"], embeddings) == 2
+    stored, missing = store.get(["invoice", "bill", "order"])
+    assert missing == ["bill"]
+    assert np.allclose(stored, embeddings[[1, 2]], atol=1e-2)
+    assert store.add(["order"], embeddings[:1]) == 0
+
+
+def test_other_processes_see_appended_terms(tmp_path):
+    reader = EmbeddingStore(tmp_path)
+    writer = EmbeddingStore(tmp_path)
+    writer.add(["order"], np.ones((1, 4)))
+    stored, missing = reader.get(["order"])
+    assert missing == [] and np.allclose(stored, 1)
+
+
+def test_rows_without_terms_are_overwritten(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    store.add(["order"], np.ones((1, 4)))
+    # a writer that crashed after writing its rows but before appending its terms
+    with open(tmp_path / MATRIX_FILE, "ab") as f:
+        f.write(np.full((2, 4), 7, dtype=np.float16).tobytes())
+    store.add(["invoice"], np.full((1, 4), 2))
+    stored, _ = EmbeddingStore(tmp_path).get(["order", "invoice"])
+    assert np.allclose(stored, [[1] * 4, [2] * 4])
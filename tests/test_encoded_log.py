@@ -0,0 +1,152 @@
+import random
+
+import numpy as np
+import pandas as pd
+from pm4py.objects.log.obj import EventLog, Trace, Event
+
+from app.control.constraint_checking import clean_log_projection, object_action_log_projection, \
+    object_action_log_projections, object_log_projection
+from app.control.encoded_log import encode_log
+from app.control.log_handling import get_variants
+from tests.test_constraint_checking import Config, XES_CASE, XES_NAME, XES_ROLE
+
+
+class ParsedLabel:
+
+    def __init__(self, label, main_object, main_action):
+        self.label = label
+        self.main_object = main_object
+        self.main_action = main_action
+
+
+PARSED_TASKS = {
+    "Create order": ParsedLabel("create order", "order", "create"),
+    "Ship order": ParsedLabel("ship order", "order", "ship"),
+    "Order": ParsedLabel("order", "order", ""),
+    "Approve invoice": ParsedLabel("approve invoice", "invoice", "approve"),
+    "Pay invoice": ParsedLabel("pay invoice", "invoice", "pay"),
+    "Start": ParsedLabel("start", "", "start"),
+    "???": ParsedLabel("", "", ""),
+}
+
+
+def make_log(n_cases, seed=0):
+    rng = random.Random(seed)
+    variants = [[rng.choice(list(PARSED_TASKS)) for _ in range(rng.randint(1, 6))] for _ in range(8)]
+    rows = []
+    for i in rng.sample(range(n_cases), n_cases):
+        for activity in rng.choice(variants):
+            rows.append((f"case {i:03d}", activity, rng.choice(["clerk", "manager and clerk", None])))
+    # the events of a case are contiguous, which the original `get_variants` relied on
+    return pd.DataFrame(rows, columns=[XES_CASE, XES_NAME, XES_ROLE]).sort_values(XES_CASE, kind="stable")
+
+
+def get_variants_original(log, event_log, config):
+    """
+    The original `get_variants`, which assumes that the events of a case are contiguous.
+    """
+    cases = event_log[config.XES_CASE].to_numpy()
+    activities = event_log[config.XES_NAME].to_numpy()
+    variant_to_case = {}
+    c_unq, c_ind, c_counts = np.unique(cases, return_index=True, return_counts=True)
+    for i in range(len(c_ind)):
+        acts = tuple(activities[c_ind[i]:c_ind[i] + c_counts[i]])
+        variant_to_case.setdefault(acts, []).append(c_unq[i])
+    return [(list(variant), cases, len(cases)) for variant, cases in variant_to_case.items()]
+
+
+def get_filtered_traces_original(config, log, parsed_tasks, with_resources=False):
+    """
+    The original per-event ParsedLabel lists, on which all projections were computed.
+    """
+    if with_resources:
+        return {trace_id: [(parsed_tasks[event[config.XES_NAME]], event[config.XES_ROLE])
+                           for event_index, event in trace.iterrows()]
+                for trace_id, trace in log.groupby(config.XES_CASE)}
+    return {trace_id: [parsed_tasks[event[config.XES_NAME]] for event_index, event in trace.iterrows()]
+            for trace_id, trace in log.groupby(config.XES_CASE)}
+
+
+def object_action_log_projection_original(obj, traces, config):
+    projection = EventLog()
+    for trace_id, trace in traces.items():
+        tmp_trace = Trace()
+        tmp_trace.attributes[config.XES_NAME] = trace_id
+        for parsed in trace:
+            if parsed.main_object == obj and parsed.main_action != "":
+                tmp_trace.append(Event({config.XES_NAME: parsed.main_action}))
+        if len(tmp_trace) > 0:
+            projection.append(tmp_trace)
+    return projection
+
+
+def object_log_projection_original(traces, config):
+    projection = EventLog()
+    for trace_id, trace in traces.items():
+        tmp_trace = Trace()
+        tmp_trace.attributes[config.XES_NAME] = trace_id
+        last = ""
+        for parsed in trace:
+            if parsed.main_object not in config.TERMS_FOR_MISSING and parsed.main_object != last:
+                tmp_trace.append(Event({config.XES_NAME: parsed.main_object}))
+            last = parsed.main_object
+        projection.append(tmp_trace)
+    return projection
+
+
+def clean_log_projection_original(traces, config, with_resources=False):
+    projection = EventLog()
+    for trace_id, trace in traces.items():
+        tmp_trace = Trace()
+        tmp_trace.attributes[config.XES_NAME] = trace_id
+        for item in trace:
+            parsed, res = item if with_resources else (item, None)
+            if parsed.label not in config.TERMS_FOR_MISSING:
+                event = Event({config.XES_NAME: parsed.label})
+                if with_resources:
+                    event[config.XES_ROLE] = res.replace(" and ", " & ") if type(res) == str else "unknown"
+                tmp_trace.append(event)
+        if len(tmp_trace) > 0:
+            projection.append(tmp_trace)
+    return projection
+
+
+def events(trace, with_resources=False):
+    return [(event[XES_NAME], event[XES_ROLE] if with_resources else None) for event in trace]
+
+
+def assert_same_projection(actual, expected, with_resources=False):
+    """
+    Expands the distinct traces of `actual` to all cases and compares them with the per-case traces of `expected`.
+    """
+    projection, case_variants = actual
+    distinct = {trace.attributes[XES_NAME]: events(trace, with_resources) for trace in projection}
+    # each distinct projection is kept once
+    assert len(distinct) == len({tuple(trace) for trace in distinct.values()})
+    assert {case: distinct[name] for case, name in case_variants.items()} == \
+           {trace.attributes[XES_NAME]: events(trace, with_resources) for trace in expected}
+
+
+def test_variants_match_original():
+    event_log = make_log(60)
+    expected = get_variants_original("log.xes", event_log, Config)
+    actual = get_variants("log.xes", event_log, Config, encode_log(Config, event_log))
+    assert [(v.activities, v.cases, v.frequency) for v in actual] == expected
+    assert len(actual) < 60
+
+
+def test_projections_match_original():
+    event_log = make_log(60)
+    encoded = encode_log(Config, event_log, parsed_tasks=PARSED_TASKS)
+    traces = get_filtered_traces_original(Config, event_log, PARSED_TASKS)
+    for obj in ["order", "invoice", "", "missing"]:
+        assert_same_projection(object_action_log_projection(obj, encoded, Config),
+                               object_action_log_projection_original(obj, traces, Config))
+    projections = object_action_log_projections(encoded, Config, ["order", "invoice"])
+    assert set(projections) == {"order", "invoice"}
+    assert_same_projection(object_log_projection(encoded, Config), object_log_projection_original(traces, Config))
+    assert_same_projection(clean_log_projection(encoded, Config), clean_log_projection_original(traces, Config))
+    traces_with_roles = get_filtered_traces_original(Config, event_log, PARSED_TASKS, with_resources=True)
+    assert_same_projection(clean_log_projection(encoded, Config, with_resources=True),
+                           clean_log_projection_original(traces_with_roles, Config, with_resources=True),
+                           with_resources=True)
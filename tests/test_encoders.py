@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.control import encoders
+from app.control.encoders import PARITY_TERMS, TORCH, OnnxEncoder, NlpHelperEncoder, check_parity, encode, \
+    get_checked_encoder, get_encoder, get_sentence_model_name
+from tests.test_embedding_service import SlowNlpHelper, embedding
+
+
+class TableEncoder:
+
+    def __init__(self, name, table):
+        self.name = name
+        self.table = table
+
+    def encode(self, terms):
+        return np.array([self.table[term] for term in terms], dtype=np.float32)
+
+
+class FakeTokenizer:
+    """
+    One token per word, padded to the longest term of the batch.
+    """
+
+    def __call__(self, terms, padding, truncation, return_tensors):
+        length = max(len(term.split()) for term in terms)
+        mask = np.array([[1] * len(term.split()) + [0] * (length - len(term.split())) for term in terms])
+        return {"input_ids": np.arange(mask.size).reshape(mask.shape), "attention_mask": mask}
+
+
+class FakeSession:
+    """
+    Returns the token position (plus 1) in every dimension, and a large value for padding tokens.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def run(self, output_names, inputs):
+        mask = inputs["attention_mask"]
+        self.batches.append(mask.shape[0])
+        hidden = np.where(mask[:, :, None] == 1, np.arange(1, mask.shape[1] + 1)[None, :, None], 1000.0)
+        return [np.repeat(hidden, 3, axis=2).astype(np.float32)]
+
+
+def make_onnx_encoder(batch_size):
+    encoder = OnnxEncoder.__new__(OnnxEncoder)
+    encoder.name = "onnx"
+    encoder.tokenizer = FakeTokenizer()
+    encoder.session = FakeSession()
+    encoder.batch_size = batch_size
+    return encoder
+
+
+def test_onnx_encoder_mean_pools_over_unpadded_tokens():
+    encoder = make_onnx_encoder(batch_size=2)
+    embeddings = encoder.encode(["create purchase order", "invoice", "approve invoice"])
+    # the mean of the positions 1..n of the n tokens of each term
+    assert np.allclose(embeddings, [[2, 2, 2], [1, 1, 1], [1.5, 1.5, 1.5]])
+    assert embeddings.dtype == np.float32
+    assert encoder.session.batches == [2, 1]
+    assert encoder.encode([]).shape == (0, 0)
+
+
+def test_check_parity():
+    reference = TableEncoder("reference", {"order": [1, 0], "invoice": [0, 1]})
+    same = TableEncoder("scaled", {"order": [2, 0], "invoice": [0, 3]})
+    assert check_parity(reference, same, ["order", "invoice"]) == {
+        "backend": "scaled", "terms": 2, "mean_cosine_deviation": 0.0, "max_cosine_deviation": 0.0}
+    off = TableEncoder("off", {"order": [1, 0], "invoice": [1, 0]})
+    parity = check_parity(reference, off, ["order", "invoice"])
+    assert parity["mean_cosine_deviation"] == pytest.approx(0.5) and parity["max_cosine_deviation"] == pytest.approx(1)
+
+
+def test_get_encoder():
+    nlp_helper = SlowNlpHelper()
+    encoder = get_encoder(None, nlp_helper)
+    assert isinstance(encoder, NlpHelperEncoder) and encoder.nlp_helper is nlp_helper
+    with pytest.raises(ValueError, match="Unknown encoder backend"):
+        get_encoder(None, nlp_helper, backend="tpu")
+
+
+def test_encoder_without_cache_leaves_the_shared_cache_alone():
+    nlp_helper = SlowNlpHelper()
+    # cached by a request thread that encodes through the helper
+    cached = encode(nlp_helper, ["order"])
+    encoder = NlpHelperEncoder(nlp_helper, keep_cache=False)
+    vectors = encoder.encode(["order", "invoice"])
+    assert np.array_equal(vectors[0], cached[0])
+    assert set(nlp_helper.known_embeddings) == {"order"}
+    # the model was called directly, not through the cache of the helper
+    assert nlp_helper.batches == [["order"], ["order", "invoice"]]
+    assert encoder.encode([]).shape == (0, 0)
+    assert np.array_equal(NlpHelperEncoder(nlp_helper).encode(["invoice"]), vectors[1:])
+    assert set(nlp_helper.known_embeddings) == {"order", "invoice"}
+
+
+def test_sentence_model_name_comes_from_the_nlp_helper():
+    nlp_helper = SlowNlpHelper()
+    # a sentence transformer is a sequence of modules, the first one wraps the transformer model
+    config = SimpleNamespace(name_or_path="sentence-transformers/all-MiniLM-L6-v2")
+    nlp_helper.sent_model = [SimpleNamespace(auto_model=SimpleNamespace(config=config))]
+    assert get_sentence_model_name(nlp_helper) == "sentence-transformers/all-MiniLM-L6-v2"
+    nlp_helper.sent_model = None
+    with pytest.raises(ValueError, match="does not expose"):
+        get_sentence_model_name(nlp_helper)
+
+
+@pytest.mark.parametrize("table, used", [
+    # the embeddings of the helper, scaled
+    ({term: 2 * embedding(term) for term in PARITY_TERMS}, True),
+    # orthogonal to each other, at a cosine deviation of 0.5 from the embeddings of the helper
+    ({term: np.eye(4)[i % 2] for i, term in enumerate(PARITY_TERMS)}, False),
+])
+def test_checked_encoder_falls_back_to_torch_when_it_deviates(monkeypatch, table, used):
+    get_backend = encoders.get_encoder
+
+    def get_fake_encoder(conf, nlp_helper, backend=TORCH, num_threads=None, keep_cache=True):
+        if backend == TORCH:
+            return get_backend(conf, nlp_helper, backend, num_threads, keep_cache)
+        return TableEncoder(backend, table)
+
+    monkeypatch.setattr(encoders, "get_encoder", get_fake_encoder)
+    nlp_helper = SlowNlpHelper()
+    encoder, parity = get_checked_encoder(None, nlp_helper, "onnx", keep_cache=False, max_deviation=0.1)
+    assert parity["backend"] == "onnx" and parity["used"] is used
+    assert parity["max_cosine_deviation"] == pytest.approx(0 if used else 0.5, abs=1e-6)
+    if used:
+        assert encoder.name == "onnx"
+    else:
+        assert isinstance(encoder, NlpHelperEncoder) and not encoder.keep_cache
+    assert nlp_helper.known_embeddings == {}
+    encoder, parity = get_checked_encoder(None, nlp_helper)
+    assert isinstance(encoder, NlpHelperEncoder) and parity is None
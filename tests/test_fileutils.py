@@ -0,0 +1,71 @@
+import gzip
+import os
+from zipfile import ZipFile
+
+import pytest
+
+from app.util.fileutils import store_uploaded_log
+
+XES = b"<?xml version='1.0' encoding='UTF-8'?><log><trace><event/></trace></log>"
+
+
+def write_upload(tmp_path, content):
+    upload_path = tmp_path / ".upload"
+    upload_path.write_bytes(content)
+    return str(upload_path)
+
+
+def test_stores_plain_log(tmp_path):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    upload_path = write_upload(tmp_path, XES)
+    assert store_uploaded_log(upload_path, "log.xes", str(log_dir)) == "log.xes"
+    assert (log_dir / "log.xes").read_bytes() == XES
+    assert not os.path.exists(upload_path)
+
+
+def test_decompresses_gz(tmp_path):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    upload_path = write_upload(tmp_path, gzip.compress(XES))
+    assert store_uploaded_log(upload_path, "log.xes.gz", str(log_dir)) == "log.xes"
+    assert (log_dir / "log.xes").read_bytes() == XES
+    assert os.listdir(tmp_path) == ["logs"]
+
+
+def test_extracts_xes_from_zip(tmp_path):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    archive = tmp_path / "archive.zip"
+    with ZipFile(archive, "w") as zip_ref:
+        zip_ref.writestr("readme.txt", "not a log")
+        zip_ref.writestr("nested/log.xes", XES)
+    upload_path = write_upload(tmp_path, archive.read_bytes())
+    archive.unlink()
+    assert store_uploaded_log(upload_path, "upload.zip", str(log_dir)) == "log.xes"
+    assert (log_dir / "log.xes").read_bytes() == XES
+    assert os.listdir(tmp_path) == ["logs"]
+
+
+@pytest.mark.parametrize("filename, content", [
+    ("log.xes.gz", XES),
+    ("log.xes.gz", gzip.compress(XES)[:-20]),
+    ("log.zip", XES),
+])
+def test_corrupt_archives_raise_value_error_and_leave_no_files(tmp_path, filename, content):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    upload_path = write_upload(tmp_path, content)
+    with pytest.raises(ValueError):
+        store_uploaded_log(upload_path, filename, str(log_dir))
+    assert os.listdir(log_dir) == []
+    # the upload itself is removed by the caller if the name cannot even be determined
+    assert not os.path.exists(upload_path + ".part")
+
+
+def test_zip_without_xes_raises_value_error(tmp_path):
+    archive = tmp_path / "archive.zip"
+    with ZipFile(archive, "w") as zip_ref:
+        zip_ref.writestr("readme.txt", "not a log")
+    with pytest.raises(ValueError):
+        store_uploaded_log(str(archive), "archive.zip", str(tmp_path))
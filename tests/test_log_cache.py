@@ -0,0 +1,178 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from app.control.log_cache import LogCache, estimate_size
+
+
+class DummyLogInfo:
+
+    def __init__(self, labels):
+        self.log_id = None
+        self.labels = labels
+
+
+def make_log(n_events):
+    event_log = pd.DataFrame({"case:concept:name": [str(i // 5) for i in range(n_events)],
+                              "concept:name": [f"activity {i % 7}" for i in range(n_events)]})
+    return event_log, DummyLogInfo(list(event_log["concept:name"].unique()))
+
+
+def test_estimate_size_counts_frames_and_info():
+    event_log, log_info = make_log(100)
+    assert estimate_size(event_log) == event_log.memory_usage(deep=True).sum()
+    assert estimate_size(log_info) > 0
+    assert estimate_size(log_info, exclude=(log_info.labels,)) < estimate_size(log_info)
+
+
+def test_hits_and_misses():
+    cache = LogCache(max_bytes=10 ** 9)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return make_log(50)
+
+    first = cache.get("a.xes", loader)
+    second = cache.get("a.xes", loader)
+    assert first is second
+    assert len(loads) == 1
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["resident_bytes"] == first.size
+
+
+def test_lru_eviction_and_transparent_reload():
+    entry_size = LogCache(max_bytes=10 ** 9).get("x", lambda: make_log(200)).size
+    cache = LogCache(max_bytes=2 * entry_size)
+    cache.get("a.xes", lambda: make_log(200))
+    cache.get("b.xes", lambda: make_log(200))
+    cache.get("a.xes", lambda: make_log(200))
+    cache.get("c.xes", lambda: make_log(200))
+    assert "b.xes" not in cache
+    assert "a.xes" in cache and "c.xes" in cache
+    assert cache.stats()["evictions"] == 1
+    assert cache.resident_bytes <= cache.max_bytes
+    assert cache.get("b.xes", lambda: make_log(200)).log == "b.xes"
+
+
+def test_oversized_entry_stays_resident():
+    cache = LogCache(max_bytes=1)
+    cache.get("a.xes", lambda: make_log(10))
+    cache.get("b.xes", lambda: make_log(10))
+    assert "a.xes" not in cache and "b.xes" in cache
+
+
+def test_invalidate():
+    cache = LogCache(max_bytes=10 ** 9, policy="cost")
+    cache.get("a.xes", lambda: make_log(10))
+    cache.invalidate("a.xes")
+    assert "a.xes" not in cache
+    assert cache.resident_bytes == 0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        LogCache(max_bytes=1, policy="fifo")
+
+
+def test_concurrent_misses_load_once():
+    cache = LogCache(max_bytes=10 ** 9)
+    release = threading.Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        release.wait(timeout=5)
+        return make_log(50)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("a.xes", loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while len(cache._loading) == 0:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+
+
+def test_failed_load_reaches_all_waiters_and_is_not_cached():
+    cache = LogCache(max_bytes=10 ** 9)
+    release = threading.Event()
+
+    def failing_loader():
+        release.wait(timeout=5)
+        raise IndexError("not processable")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get("a.xes", failing_loader)
+        except IndexError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while len(cache._loading) == 0:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 4
+    assert "a.xes" not in cache
+    assert cache.get("a.xes", lambda: make_log(10)).log == "a.xes"
+
+
+def test_derived_structures_count_towards_size():
+    cache = LogCache(max_bytes=10 ** 9)
+    entry = cache.get("a.xes", lambda: make_log(100))
+    size = entry.size
+    builds = []
+
+    def build():
+        builds.append(1)
+        return list(range(1000))
+
+    assert entry.derive("numbers", build) is entry.derive("numbers", build)
+    assert len(builds) == 1
+    assert entry.size > size
+    assert cache.resident_bytes == entry.size
+
+
+def test_background_derivation_does_not_block():
+    cache = LogCache(max_bytes=10 ** 9)
+    entry = cache.get("a.xes", lambda: make_log(100))
+    release = threading.Event()
+    builds = []
+
+    def slow_build():
+        builds.append(1)
+        release.wait(timeout=5)
+        return list(range(1000))
+
+    def failing_build():
+        raise ValueError("no profile")
+
+    with ThreadPoolExecutor(1) as executor:
+        assert entry.derive_in_background("profile", slow_build, executor) is None
+        # the build is started once, and other structures can be derived while it runs
+        assert entry.derive_in_background("profile", slow_build, executor) is None
+        assert entry.derive("numbers", lambda: [1, 2, 3]) == [1, 2, 3]
+        release.set()
+        assert entry.derive("profile", slow_build) == list(range(1000))
+        assert entry.derive_in_background("profile", slow_build, executor) == list(range(1000))
+        assert len(builds) == 1
+        # a failed build is not kept and is started again
+        assert entry.derive_in_background("other", failing_build, executor) is None
+        executor.submit(lambda: None).result()
+        assert "other" not in entry.derived and len(entry._pending) == 0
+        assert entry.derive_in_background("other", lambda: "built", executor) is None
+        executor.submit(lambda: None).result()
+        assert entry.derived["other"] == "built"
@@ -0,0 +1,141 @@
+import random
+from types import SimpleNamespace
+
+from app.control.constraint_fitter import Instantiation
+from app.control.log_handling import get_violated_variants
+from app.control.log_index import LogIndex
+from app.control.recommender import Recommender
+from app.model.variant import Variant
+from app.model.violation import Violation
+from tests.test_constraint_fitter import Config, make_template
+
+LEVELS = [Config.ACTIVITY, Config.OBJECT, Config.MULTI_OBJECT, Config.RESOURCE]
+
+
+def make_log_info(n_terms, seed=0):
+    rng = random.Random(seed)
+    objects = [f"object {i}" for i in range(n_terms)]
+    actions = [f"action {i}" for i in range(n_terms)]
+    originals = [f"{rng.choice(actions)} {rng.choice(objects)}" for _ in range(n_terms)]
+    labels = [original.lower() for original in originals]
+    return SimpleNamespace(objects=objects, actions=actions, labels=labels,
+                           label_to_original_label={label: [original] for label, original in zip(labels, originals)},
+                           object_to_original_labels={obj: [o for o in originals if o.endswith(" " + obj)]
+                                                      for obj in objects},
+                           action_to_original_labels={action: [o for o in originals if o.startswith(action + " ")]
+                                                      for action in actions})
+
+
+def make_candidates(log_info, n, seed=0):
+    rng = random.Random(seed)
+    recommender = Recommender(Config, SimpleNamespace(semantic_weight=0.5, relevance_thresh=0, top_k=None), log_info)
+    types = [t for t in recommender.activation_based_on if isinstance(t, str)]
+    terms = log_info.objects + log_info.actions + log_info.labels + [f"missing {i}" for i in range(100)] + [""]
+    candidates = []
+    for i in range(n):
+        template = make_template(rng.choice(LEVELS), "left", "right", "object", {})
+        template.constraint.constraint_type = rng.choice(types)
+        candidates.append(Instantiation(template, f"c{i}", "", rng.choice(terms), rng.choice(terms),
+                                        rng.choice(terms)))
+    return candidates
+
+
+def compute_activation_by_scan(recommender, fitted_constraint):
+    """
+    The original `Recommender._compute_activation`, which scans the term lists of the `LogInfo`.
+    """
+    config = recommender.config
+    log_info = recommender.log_info
+    if fitted_constraint.constraint.constraint_type not in recommender.activation_based_on:
+        return 0
+    if len(recommender.activation_based_on[fitted_constraint.constraint.constraint_type]) == 0:
+        return 1
+    res = []
+    for column in recommender.activation_based_on[fitted_constraint.constraint.constraint_type]:
+        operand = fitted_constraint.left_operand if column == config.LEFT_OPERAND else fitted_constraint.right_operand
+        level = fitted_constraint.constraint.level
+        if operand is None or operand == "":
+            res.append(0)
+        elif level == config.MULTI_OBJECT and operand in log_info.objects:
+            res.append(1)
+        elif level == config.OBJECT and operand in log_info.actions:
+            res.append(1)
+        elif level == config.ACTIVITY and operand in log_info.labels:
+            res.append(1)
+        else:
+            res.append(0)
+    return 1 if (len(res) > 0 and any(res)) or (len(res) == 0) else 0
+
+
+def get_violated_variants_by_scan(variants, log_info, violations, conf):
+    """
+    The original `get_violated_variants`, which looks up the original labels of every constraint operand.
+    """
+    violated_variants = {}
+    for variant in variants:
+        activity_to_violations = {}
+        for violation in violations:
+            if set(violation.cases).intersection(variant.cases):
+                for activity in variant.activities:
+                    found = activity_to_violations.setdefault(activity, [])
+                    c = violation.constraint
+                    if c.left_operand in log_info.label_to_original_label and \
+                            activity in log_info.label_to_original_label[c.left_operand]:
+                        found.append(c.id)
+                    elif c.right_operand in log_info.label_to_original_label and \
+                            activity in log_info.label_to_original_label[c.right_operand]:
+                        found.append(c.id)
+                    elif c.object_type in log_info.object_to_original_labels and \
+                            activity in log_info.object_to_original_labels[c.object_type]:
+                        if c.left_operand in log_info.action_to_original_labels and \
+                                activity in log_info.action_to_original_labels[c.left_operand]:
+                            found.append(c.id)
+                        elif c.right_operand in log_info.action_to_original_labels and \
+                                activity in log_info.action_to_original_labels[c.right_operand]:
+                            found.append(c.id)
+        if len(activity_to_violations) > 0:
+            violated_variants[variant.id] = activity_to_violations
+    return violated_variants
+
+
+def test_activation_matches_list_scan():
+    log_info = make_log_info(200)
+    candidates = make_candidates(log_info, 5000)
+    recommender = Recommender(Config, SimpleNamespace(semantic_weight=0.5, relevance_thresh=0, top_k=None), log_info)
+    expected = [c for c in candidates if compute_activation_by_scan(recommender, c)]
+    actual = recommender.recommend_by_activation(candidates)
+    assert 0 < len(actual) < len(candidates)
+    assert [c.id for c in actual] == [c.id for c in expected]
+
+
+def test_reverse_maps():
+    log_info = make_log_info(50)
+    index = LogIndex(log_info)
+    for label, originals in log_info.label_to_original_label.items():
+        for original in originals:
+            assert label in index.labels_of(original)
+    assert index.objects_of("no such activity") == frozenset()
+    # a term that maps to a single original label is not matched by substrings of it
+    single = LogIndex(SimpleNamespace(objects=[], actions=[], labels=[], object_to_original_labels={},
+                                      action_to_original_labels={},
+                                      label_to_original_label={"approve": "Approve invoice"}))
+    assert single.labels_of("Approve invoice") == {"approve"} and single.labels_of("Approve") == frozenset()
+
+
+def test_violated_variants_match_scan():
+    rng = random.Random(1)
+    log_info = make_log_info(100)
+    originals = [o for originals in log_info.label_to_original_label.values() for o in originals]
+    variants = [Variant(id=f"v{i}", log="log.xes", activities=rng.sample(originals, 5), frequency=1,
+                        cases=[f"case {i}"]) for i in range(50)]
+    terms = log_info.objects + log_info.actions + log_info.labels
+    violations = []
+    for i, fitted in enumerate(make_candidates(log_info, 200, seed=2)):
+        constraint = fitted.materialize()
+        constraint.left_operand, constraint.right_operand, constraint.object_type = rng.sample(terms, 3)
+        violations.append(Violation(id=f"x{i}", log="log.xes", constraint=constraint, frequency=1,
+                                    cases=[f"case {rng.randrange(60)}"]))
+    expected = get_violated_variants_by_scan(variants, log_info, violations, Config)
+    actual = {v.variant.id: v.activities for v in get_violated_variants(variants, log_info, violations, Config)}
+    assert actual == expected
+    assert any(ids for activities in actual.values() for ids in activities.values())
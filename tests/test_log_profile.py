@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.control.log_profile import LogProfile, build_log_profile
+from app.control.similarity_computer import SimilarityComputer
+from app.control.similarity_engine import SimilarityEngine
+from app.model.constraint import Constraint
+from tests.test_similarity_engine import DummyNlpHelper
+
+Config = SimpleNamespace(OBJECT="Object", MULTI_OBJECT="Multi-object", ACTIVITY="Activity", RESOURCE="Resource",
+                         LEFT_OPERAND="left_operand", RIGHT_OPERAND="right_operand", ACTION="action", TERMS_FOR_MISSING=[])
+
+LOG_INFO = SimpleNamespace(log_id="log.xes", objects=["purchase order", "invoice"],
+                           labels=["create purchase order", "approve invoice", "pay invoice"],
+                           resources_to_tasks={"clerk": set(), "manager": set()}, actions=["create", "approve"])
+
+CATALOG = (["order", "invoice", "bill"], ["create order", "approve invoice", "check invoice"], ["clerk", "accountant"])
+
+
+def make_constraint(level, left, right="", object_type=""):
+    return Constraint(id=f"{level} {left} {right} {object_type}", constraint_type="Response",
+                      constraint_str=f"Response [{left}, {right}] | | |", arity="Binary", level=level,
+                      left_operand=left, right_operand=right, object_type=object_type, processmodel_id="m",
+                      support=1, provision_type="", provider="")
+
+
+def test_profile_blocks_match_engine(tmp_path):
+    nlp_helper = DummyNlpHelper()
+    profile = build_log_profile(Config, nlp_helper, LOG_INFO, *CATALOG, threshold=0.1, action_equivalents={})
+    engine = SimilarityEngine(DummyNlpHelper())
+    expected = engine.block(CATALOG[1], LOG_INFO.labels, 0.1)
+    for operand in CATALOG[1]:
+        assert profile.blocks[Config.ACTIVITY].row(operand) == expected.row(operand)
+    path = tmp_path / "profile.npz"
+    profile.save(path)
+    loaded = LogProfile.load(path)
+    assert loaded.matches(0.1, None) and not loaded.matches(0.5, None)
+    for level, block in profile.blocks.items():
+        for operand in block.operands:
+            assert loaded.blocks[level].row(operand) == block.row(operand)
+    assert set(loaded.embeddings) == set(LOG_INFO.objects + LOG_INFO.labels + list(LOG_INFO.resources_to_tasks))
+    assert loaded.matched_operands(Config.ACTIVITY) == {operand for operand in CATALOG[1] if expected.row(operand)}
+
+
+def test_similarities_with_profile_match_request_time_computation():
+    constraints = [make_constraint(Config.ACTIVITY, "create order", "approve invoice"),
+                   make_constraint(Config.ACTIVITY, "check invoice", "send reminder"),
+                   make_constraint(Config.RESOURCE, "create order", object_type="clerk"),
+                   make_constraint(Config.MULTI_OBJECT, "order", "bill")]
+    profile = build_log_profile(Config, DummyNlpHelper(), LOG_INFO, *CATALOG, threshold=0.1, action_equivalents={})
+    without = SimilarityComputer(Config, DummyNlpHelper(), LOG_INFO, sim_threshold=0.1, action_equivalents={})
+    with_profile = SimilarityComputer(Config, DummyNlpHelper(), LOG_INFO, sim_threshold=0.1, profile=profile)
+    components = (["order", "bill"], ["create order", "approve invoice", "check invoice", "send reminder"], ["clerk"])
+    expected = without.compute_similarities(LOG_INFO, constraints, [], [], [], *components)
+    # "send reminder" is not in the profiled catalog vocabulary and is computed on demand
+    actual = with_profile.compute_similarities(LOG_INFO, constraints, [], [], [], *components)
+    for a, e in zip(actual, expected):
+        assert a.similarity.keys() == e.similarity.keys()
+        for key, sims in e.similarity.items():
+            assert a.similarity[key].keys() == sims.keys()
+            assert np.allclose(list(a.similarity[key].values()), list(sims.values()), atol=1e-5)
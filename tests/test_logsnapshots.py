@@ -0,0 +1,124 @@
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from semconstmining.log.loginfo import LogInfo
+
+import app.boundary.logsnapshots as logsnapshots
+from app.boundary.logsnapshots import get_content_hash, get_profile_path, get_snapshot_dir, invalidate_snapshots, \
+    load_log_and_info, load_snapshot, write_snapshot
+
+
+class UnpicklableNlpHelper:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+@pytest.fixture
+def conf(tmp_path):
+    (tmp_path / "logs").mkdir()
+    return SimpleNamespace(DATA_INTERIM=str(tmp_path / "interim"), DATA_LOGS=str(tmp_path / "logs"),
+                           XES_CASE="case:concept:name", XES_NAME="concept:name", XES_ROLE="org:role",
+                           XES_TIME="time:timestamp")
+
+
+def write_log(conf, process, content):
+    path = Path(conf.DATA_LOGS) / process
+    path.write_bytes(content)
+    return path
+
+
+def make_log_and_info(nlp_helper):
+    event_log = pd.DataFrame({"case:concept:name": ["1", "1", "2"],
+                              "concept:name": ["create order", "ship order", "create order"],
+                              "org:role": ["clerk", None, "manager"],
+                              "time:timestamp": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03"], utc=True),
+                              "unused": [1, 2, 3]})
+    log_info = LogInfo.__new__(LogInfo)
+    log_info.__dict__.update({"labels": ["create order", "ship order"], "objects": ["order"],
+                              "nlp_helper": nlp_helper, "log": event_log})
+    return event_log, log_info
+
+
+def test_snapshot_round_trip(conf):
+    write_log(conf, "log.xes", b"<log/>")
+    nlp_helper = UnpicklableNlpHelper()
+    event_log, log_info = make_log_and_info(nlp_helper)
+    # the nlp helper and the event log are detached, so the unpicklable helper does not break writing
+    write_snapshot(conf, nlp_helper, "log.xes", event_log, log_info)
+    other_helper = UnpicklableNlpHelper()
+    loaded_log, loaded_info = load_snapshot(conf, other_helper, "log.xes")
+    pd.testing.assert_frame_equal(loaded_log, event_log.drop(columns="unused"))
+    assert loaded_info.labels == log_info.labels and loaded_info.objects == log_info.objects
+    assert loaded_info.nlp_helper is other_helper
+    assert loaded_info.log is loaded_log
+
+
+def test_overwritten_log_is_not_served_from_snapshot(conf):
+    path = write_log(conf, "log.xes", b"<log/>")
+    before = get_content_hash(path)
+    event_log, log_info = make_log_and_info(None)
+    write_snapshot(conf, None, "log.xes", event_log, log_info)
+    assert load_snapshot(conf, None, "log.xes") is not None
+    write_log(conf, "log.xes", b"<log><trace/></log>")
+    assert get_content_hash(path) != before
+    assert load_snapshot(conf, None, "log.xes") is None
+
+
+def test_invalidate_snapshots(conf):
+    event_log, log_info = make_log_and_info(None)
+    for process in ["log.xes", "log-2.xes"]:
+        write_log(conf, process, process.encode())
+        write_snapshot(conf, None, process, event_log, log_info)
+    get_profile_path(conf, "log.xes").write_bytes(b"profile")
+    # an older snapshot of the same log, written for other content
+    (get_snapshot_dir(conf) / "log.xes-0123456789abcdef.feather").write_bytes(b"old")
+    invalidate_snapshots(conf, "log.xes")
+    assert load_snapshot(conf, None, "log.xes") is None
+    assert load_snapshot(conf, None, "log-2.xes") is not None
+    assert all(file.startswith("log-2.xes-") for file in (f.name for f in get_snapshot_dir(conf).iterdir()))
+
+
+def test_load_log_and_info_parses_once(conf, monkeypatch):
+    write_log(conf, "log.xes", b"<log/>")
+    parses = []
+
+    def get_log_and_info(conf, nlp_helper, process):
+        parses.append(process)
+        return make_log_and_info(nlp_helper)
+
+    monkeypatch.setattr(logsnapshots, "get_log_and_info", get_log_and_info)
+    first_log, _ = load_log_and_info(conf, None, "log.xes")
+    second_log, second_info = load_log_and_info(conf, None, "log.xes")
+    assert parses == ["log.xes"]
+    pd.testing.assert_frame_equal(second_log, first_log.drop(columns="unused"))
+    assert second_info.log is second_log
+    # an unreadable snapshot is discarded and the log is parsed again
+    next(get_snapshot_dir(conf).glob("*.feather")).write_bytes(b"corrupt")
+    load_log_and_info(conf, None, "log.xes")
+    assert parses == ["log.xes", "log.xes"]
+
+
+def test_snapshot_miss_keeps_the_current_profile(conf, monkeypatch):
+    path = write_log(conf, "log.xes", b"<log/>")
+    monkeypatch.setattr(logsnapshots, "get_log_and_info", lambda conf, nlp_helper, process: make_log_and_info(None))
+    load_log_and_info(conf, None, "log.xes")
+    profile_path = get_profile_path(conf, "log.xes")
+    profile_path.write_bytes(b"profile")
+    stale_profile = get_snapshot_dir(conf) / "log.xes-0123456789abcdef.profile.npz"
+    stale_profile.write_bytes(b"stale")
+    # an unreadable snapshot and a missing LogInfo are written again, the profile of the same content stays
+    next(get_snapshot_dir(conf).glob("*.feather")).write_bytes(b"corrupt")
+    load_log_and_info(conf, None, "log.xes")
+    assert profile_path.read_bytes() == b"profile" and not stale_profile.exists()
+    next(get_snapshot_dir(conf).glob("*.loginfo.pkl")).unlink()
+    load_log_and_info(conf, None, "log.xes")
+    assert profile_path.read_bytes() == b"profile"
+    assert load_snapshot(conf, None, "log.xes") is not None
+    # once the content changes, the profile of the old content goes
+    path.write_bytes(b"<log><trace/></log>")
+    load_log_and_info(conf, None, "log.xes")
+    assert not profile_path.exists()
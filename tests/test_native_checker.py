@@ -0,0 +1,120 @@
+import itertools
+import random
+from pathlib import Path
+
+import pytest
+from pm4py.objects.log.obj import EventLog, Trace, Event
+
+from app.control.native_checker import EVALUATORS, check_traces, parse_constraint, split_supported
+
+ALPHABET = ["a", "b", "c", "d"]
+
+
+@pytest.fixture(scope="module")
+def conf():
+    # the parity tests need the Declare checker of semconstmining, the hand-computed ones below do not
+    pytest.importorskip("semconstmining.declare.declare")
+    from semconstmining.config import Config
+    return Config(Path(__file__).parents[1].resolve(), "semantic_sap_sam_filtered")
+
+
+def make_traces(n_traces, seed=0):
+    rng = random.Random(seed)
+    return [(f"trace {i}", tuple(rng.choice(ALPHABET) for _ in range(rng.randint(1, 8)))) for i in range(n_traces)]
+
+
+def declare_checking(conf, constraint_strings, traces):
+    from semconstmining.declare.declare import Declare
+    from semconstmining.declare.parsers import parse_decl
+    log = EventLog()
+    for trace_id, names in traces:
+        trace = Trace()
+        trace.attributes[conf.XES_NAME] = trace_id
+        for name in names:
+            trace.append(Event({conf.XES_NAME: name}))
+        log.append(trace)
+    d4py = Declare(conf)
+    d4py.log = log
+    d4py.model = parse_decl(constraint_strings)
+    return d4py.conformance_checking(consider_vacuity=True)
+
+
+def constraint_strings(template):
+    if template.is_binary:
+        return [f"{template.templ_str}[{a}, {b}] | | |" for a, b in itertools.permutations(ALPHABET + ["x"], 2)]
+    cardinalities = ["", "2", "3"] if template.supports_cardinality else [""]
+    return [f"{template.templ_str}{n}[{a}] | |" for n in cardinalities for a in ALPHABET + ["x"]]
+
+
+@pytest.mark.parametrize("template", list(EVALUATORS), ids=lambda template: template.templ_str)
+def test_native_checker_matches_declare(conf, template):
+    traces = make_traces(300)
+    constraints = constraint_strings(template)
+    expected = declare_checking(conf, constraints, traces)
+    actual = check_traces(constraints, traces)
+    for trace_id, _ in traces:
+        assert actual[trace_id] == set(expected.get(trace_id, set())), trace_id
+
+
+def test_constraints_with_conditions_are_not_supported():
+    supported, unsupported = split_supported(["Response[a, b] | | |",
+                                              "Response[a, b] |A.org:role is clerk | |",
+                                              "Existence2[a] | |"])
+    assert supported == ["Response[a, b] | | |", "Existence2[a] | |"]
+    assert unsupported == ["Response[a, b] |A.org:role is clerk | |"]
+    assert parse_constraint("Existence2[a] | |")[1:] == (["a"], 2)
+
+
+TRACES = {"ab": ("a", "b"), "ba": ("b", "a"), "aa": ("a", "a"), "a": ("a",), "c": ("c",),
+          "abab": ("a", "b", "a", "b"), "acb": ("a", "c", "b"), "bba": ("b", "b", "a"), "aab": ("a", "a", "b")}
+
+# the traces of `TRACES` that violate each constraint, worked out by hand from the Declare semantics
+EXPECTED_VIOLATIONS = {
+    "Existence[a] | |": {"c"},
+    "Existence2[a] | |": {"ab", "ba", "a", "c", "acb", "bba"},
+    "Existence[x] | |": set(TRACES),
+    "Absence2[a] | |": {"aa", "abab", "aab"},
+    "Exactly[a] | |": {"aa", "c", "abab", "aab"},
+    "Init[a] | |": {"ba", "c", "bba"},
+    "End[a] | |": {"ab", "c", "abab", "acb", "aab"},
+    "Choice[a, b] | | |": {"c"},
+    "Exclusive Choice[a, b] | | |": {"ab", "ba", "abab", "acb", "bba", "aab", "c"},
+    "Responded Existence[a, b] | | |": {"aa", "a"},
+    "Co-Existence[a, b] | | |": {"aa", "a"},
+    "Response[a, b] | | |": {"ba", "aa", "a", "bba"},
+    "Response[x, b] | | |": set(),
+    "Precedence[a, b] | | |": {"ba", "bba"},
+    "Precedence[a, x] | | |": set(),
+    "Succession[a, b] | | |": {"ba", "aa", "a", "bba"},
+    "Alternate Response[a, b] | | |": {"ba", "aa", "a", "bba", "aab"},
+    "Alternate Precedence[a, b] | | |": {"ba", "bba"},
+    "Alternate Succession[a, b] | | |": {"ba", "aa", "a", "bba", "aab"},
+    "Chain Response[a, b] | | |": {"ba", "aa", "a", "acb", "bba", "aab"},
+    "Chain Precedence[a, b] | | |": {"ba", "acb", "bba"},
+    "Chain Succession[a, b] | | |": {"ba", "aa", "a", "acb", "bba", "aab"},
+    "Not Responded Existence[a, b] | | |": {"ab", "ba", "abab", "acb", "bba", "aab"},
+    "Not Response[a, b] | | |": {"ab", "abab", "acb", "aab"},
+    "Not Precedence[a, b] | | |": {"ab", "abab", "acb", "aab"},
+    "Not Succession[a, b] | | |": {"ab", "abab", "acb", "aab"},
+    "Not Chain Response[a, b] | | |": {"ab", "abab", "aab"},
+    "Not Chain Precedence[a, b] | | |": {"ab", "abab", "aab"},
+    "Not Chain Succession[a, b] | | |": {"ab", "abab", "aab"},
+}
+
+
+def test_native_checker_matches_hand_computed_violations():
+    assert {parse_constraint(constraint_str)[0] for constraint_str in EXPECTED_VIOLATIONS} == set(EVALUATORS)
+    actual = check_traces(list(EXPECTED_VIOLATIONS), list(TRACES.items()))
+    for constraint_str, expected in EXPECTED_VIOLATIONS.items():
+        assert {trace for trace, violated in actual.items() if constraint_str in violated} == expected, \
+            constraint_str
+
+
+@pytest.mark.parametrize("template", [template for template in EVALUATORS if template.is_binary],
+                         ids=lambda template: template.templ_str)
+def test_binary_constraints_on_one_activity_fall_back_to_declare(template):
+    # e.g., Response[a, a] needs another a after every a, which the position-based evaluators do not express
+    constraint_str = f"{template.templ_str}[a, a] | | |"
+    assert parse_constraint(constraint_str) is None
+    assert split_supported([constraint_str, f"{template.templ_str}[a, b] | | |"]) == \
+           ([f"{template.templ_str}[a, b] | | |"], [constraint_str])
@@ -0,0 +1,42 @@
+import numpy as np
+
+from app.control.operand_index import OperandIndex
+from app.control.similarity_engine import normalize
+
+
+def make_embeddings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(20, 32)))
+    return normalize(centers[rng.integers(0, 20, n)] + 0.2 * rng.normal(size=(n, 32))).astype(np.float32)
+
+
+def brute_force(terms, embeddings, queries, threshold):
+    return [[terms[i] for i in np.flatnonzero(embeddings @ query >= threshold)] for query in queries]
+
+
+def test_calibrated_index_reaches_recall_target():
+    embeddings, queries = np.split(make_embeddings(2100), [2000])
+    terms = [f"operand {i}" for i in range(len(embeddings))]
+    index = OperandIndex.build(terms, embeddings)
+    index.calibrate_on_sample(0.5, 0.95)
+    assert index.n_probe < index.n_lists
+    exact = brute_force(terms, embeddings, queries, 0.5)
+    assert [sorted(m) for m in index.search_exact(queries, 0.5)] == [sorted(m) for m in exact]
+    assert index.recall(queries, 0.5) >= 0.9
+    for approx, matches in zip(index.search(queries, 0.5), exact):
+        assert set(approx) <= set(matches)
+
+
+def test_add_and_persist(tmp_path):
+    embeddings = make_embeddings(200)
+    terms = [f"operand {i}" for i in range(len(embeddings))]
+    index = OperandIndex.build(terms[:100], embeddings[:100])
+    assert index.add(terms[90:], embeddings[90:]) == 100
+    assert len(index) == 200
+    # the index doubled in size, so its clusters were retrained
+    assert index.trained_size == 200
+    path = tmp_path / "operand_index.npz"
+    index.save(path)
+    loaded = OperandIndex.load(path)
+    assert loaded.terms == index.terms
+    assert loaded.search(embeddings[150:151], 0.99) == [["operand 150"]]
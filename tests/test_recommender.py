@@ -0,0 +1,178 @@
+import math
+import random
+from types import SimpleNamespace
+
+from app.boundary.constraintmining import get_rerank_pipeline
+from app.control.constraint_fitter import Instantiation
+from app.control.recommender import Recommender
+from tests.test_constraint_fitter import Config, make_template
+
+LEVELS = [Config.ACTIVITY, Config.OBJECT, Config.MULTI_OBJECT, Config.RESOURCE]
+
+
+def recommend_loop(recommender, constraints):
+    """
+    The original, per-object scoring of `Recommender.recommend`, without top-k selection.
+    """
+    max_support_per_level = {level: max([c.constraint.support for c in constraints if c.constraint.level == level],
+                                        default=0)
+                             for level in LEVELS}
+    config = recommender.recommender_config
+    for c in constraints:
+        sim_score = recommender.get_sim_score(c)
+        c.relevance = (1 - config.semantic_weight) * (c.constraint.support / max_support_per_level[c.constraint.level]) \
+            + config.semantic_weight * sim_score if c.constraint.support > 0 else 0
+    return [c for c in constraints if c.relevance >= config.relevance_thresh]
+
+
+def make_constraints(n, seed=0):
+    rng = random.Random(seed)
+    constraints = []
+    for i in range(n):
+        level = rng.choice(LEVELS)
+        template = make_template(level, f"left {i}", f"right {i}", f"object {i}", {})
+        template.constraint.support = rng.randint(0, 20)
+        instantiation = Instantiation(template, f"c{i}", template.constraint_str, f"left {i}", f"right {i}",
+                                      f"object {i}")
+        instantiation.similarity = {f"left {i}": rng.uniform(0.5, 1), f"right {i}": rng.uniform(0.5, 1),
+                                    f"object {i}": rng.uniform(0.5, 1)}
+        constraints.append(instantiation)
+    return constraints
+
+
+def make_recommender(top_k):
+    log_info = SimpleNamespace(objects=[], actions=[], labels=[], label_to_original_label={},
+                               object_to_original_labels={}, action_to_original_labels={})
+    return Recommender(Config, SimpleNamespace(semantic_weight=0.7, relevance_thresh=0.6, top_k=top_k), log_info)
+
+
+def test_vectorized_relevance_matches_loop():
+    expected = recommend_loop(make_recommender(None), make_constraints(500))
+    actual = make_recommender(None).recommend(make_constraints(500))
+    assert [c.id for c in actual] == [c.id for c in expected]
+    assert [c.relevance for c in actual] == [c.relevance for c in expected]
+
+
+def test_top_k_per_level():
+    expected = recommend_loop(make_recommender(None), make_constraints(500))
+    actual = make_recommender(10).recommend(make_constraints(500))
+    for level in LEVELS:
+        at_level = sorted((c.relevance for c in expected if c.constraint.level == level), reverse=True)
+        assert sorted((c.relevance for c in actual if c.constraint.level == level), reverse=True) == at_level[:10]
+
+
+def test_stored_components_reproduce_relevance_for_other_weights():
+    fitted = make_recommender(None).recommend(make_constraints(500))
+    recommender = make_recommender(None)
+    recommender.recommender_config.semantic_weight = 0.2
+    recommender.recommender_config.relevance_thresh = 0
+    expected = {c.id: c.relevance for c in recommender.recommend(make_constraints(500))}
+    for c in fitted:
+        relevance = 0.8 * c.normalized_support + 0.2 * c.sim_score if c.constraint.support > 0 else 0
+        assert abs(relevance - expected[c.id]) < 1e-12
+        assert c.materialize().max_level_support == c.max_level_support > 0
+
+
+def get_field(document, path):
+    for key in path.split("."):
+        document = document.get(key) if isinstance(document, dict) else None
+    return document
+
+
+def evaluate(expression, document):
+    """
+    Evaluates the aggregation expressions used by `get_rerank_pipeline`.
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        return get_field(document, expression[1:])
+    if not isinstance(expression, dict):
+        return expression
+    (operator, args), = expression.items()
+    values = [evaluate(arg, document) for arg in args]
+    if operator == "$add":
+        return sum(values)
+    if operator == "$multiply":
+        return math.prod(values)
+    if operator == "$gt":
+        return values[0] > values[1]
+    if operator == "$cond":
+        return values[1] if values[0] else values[2]
+    raise NotImplementedError(operator)
+
+
+def matches(document, query):
+    for path, condition in query.items():
+        value = get_field(document, path)
+        for operator, operand in (condition.items() if isinstance(condition, dict) else [("$eq", condition)]):
+            if not {"$eq": lambda: value == operand, "$ne": lambda: value != operand,
+                    "$gte": lambda: value is not None and value >= operand,
+                    "$lte": lambda: value is not None and value <= operand,
+                    "$in": lambda: value in operand,
+                    "$size": lambda: isinstance(value, list) and len(value) == operand}[operator]():
+                return False
+    return True
+
+
+def run_pipeline(documents, pipeline, database=None):
+    """
+    Runs the stages of `get_rerank_pipeline` and `get_unmatched_pipeline` on a list of documents, as MongoDB would.
+    `$lookup` stages read from the collections of `database`.
+    """
+    documents = [dict(document) for document in documents]
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            documents = [document for document in documents if matches(document, spec)]
+        elif name == "$set":
+            for document in documents:
+                document.update({field: evaluate(expression, document) for field, expression in spec.items()})
+        elif name == "$setWindowFields":
+            (sort_field, direction), = spec["sortBy"].items()
+            (output, _), = spec["output"].items()
+            partitions = {}
+            for document in documents:
+                partitions.setdefault(evaluate(spec["partitionBy"], document), []).append(document)
+            for partition in partitions.values():
+                partition.sort(key=lambda document: document[sort_field], reverse=direction < 0)
+                for number, document in enumerate(partition, start=1):
+                    document[output] = number
+        elif name == "$lookup":
+            foreign = database[spec["from"]].find({})
+            for document in documents:
+                local = document.get(spec["localField"])
+                document[spec["as"]] = run_pipeline([other for other in foreign
+                                                     if other.get(spec["foreignField"]) == local],
+                                                    spec.get("pipeline", []))
+        elif name == "$limit":
+            documents = documents[:spec]
+        elif name == "$project":
+            documents = [{k: v for k, v in document.items() if spec.get(k)} for document in documents]
+        elif name == "$unset":
+            documents = [{k: v for k, v in document.items() if k != spec} for document in documents]
+        elif name == "$sort":
+            (sort_field, direction), = spec.items()
+            documents.sort(key=lambda document: document[sort_field], reverse=direction < 0)
+        else:
+            raise NotImplementedError(name)
+    return documents
+
+
+def test_rerank_pipeline_matches_recommend():
+    # the stored components of all constraints, scored with another semantic weight and without a threshold
+    stored = Recommender(Config, SimpleNamespace(semantic_weight=0.2, relevance_thresh=0, top_k=None),
+                         make_recommender(None).log_info).recommend(make_constraints(500))
+    documents = [{"_id": c.id, "log": "log.xes", "relevance": c.relevance, "normalized_support": c.normalized_support,
+                  "sim_score": c.sim_score, "constraint": {"support": c.constraint.support,
+                                                           "level": c.constraint.level}}
+                 for c in stored]
+    documents.append({"_id": "other log", "log": "other.xes", "relevance": 1, "normalized_support": 1,
+                      "sim_score": 1, "constraint": {"support": 1, "level": Config.ACTIVITY}})
+    for top_k in [None, 10]:
+        expected = make_recommender(top_k).recommend(make_constraints(500))
+        actual = run_pipeline(documents, get_rerank_pipeline("log.xes", 0.7, 0.6, top_k))
+        assert sorted(document["_id"] for document in actual) == sorted(c.id for c in expected)
+        relevance = {c.id: c.relevance for c in expected}
+        assert all(math.isclose(document["relevance"], relevance[document["_id"]]) for document in actual)
+        assert [document["relevance"] for document in actual] == \
+               sorted((document["relevance"] for document in actual), reverse=True)
+        assert "rank" not in actual[0]
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+from app.control.similarity_computer import SimilarityComputer, get_action_equivalents
+from app.control.util import ok
+from tests.test_log_profile import Config, make_constraint
+from tests.test_similarity_engine import DummyNlpHelper
+
+LOG_INFO = SimpleNamespace(log_id="log.xes", objects=["order", "invoice"], labels=[], resources_to_tasks={},
+                           actions=["create", "make", "approve", "check"])
+
+
+class ThesaurusNlpHelper(DummyNlpHelper):
+    """
+    Synonyms and similar actions that overlap, both within and across the log actions.
+    """
+
+    SYNONYMS = {"create": {"create", "produce", "generate"}, "make": {"make", "produce", "build"},
+                "approve": {"approve", "accept", "sign"}, "check": {"check", "verify"}}
+    SIMILAR_ACTIONS = {"create": {"build", "make"}, "make": {"generate", "create"},
+                       "approve": {"verify", "confirm"}, "check": {"sign", "inspect", "approve"}}
+
+    def get_synonyms(self, action):
+        return self.SYNONYMS.get(action, set())
+
+    def get_similar_actions(self, action):
+        return self.SIMILAR_ACTIONS.get(action, set())
+
+
+def action_sims_loop(config, nlp_helper, log_info, constraint):
+    """
+    The original per-constraint matching of the actions of an object-level constraint.
+    """
+    action_sims = {}
+    for ext in log_info.actions:
+        synonyms = nlp_helper.get_synonyms(ext)
+        similar_actions = nlp_helper.get_similar_actions(ext)
+        if ok(config, constraint.left_operand):
+            if constraint.left_operand in synonyms or constraint.left_operand in similar_actions:
+                action_sims[constraint.left_operand] = ext
+        if ok(config, constraint.right_operand):
+            if constraint.right_operand in synonyms or constraint.right_operand in similar_actions:
+                action_sims[constraint.right_operand] = ext
+    return action_sims
+
+
+def test_action_equivalents_match_per_constraint_loop():
+    nlp_helper = ThesaurusNlpHelper()
+    terms = sorted(set().union(*ThesaurusNlpHelper.SYNONYMS.values(), *ThesaurusNlpHelper.SIMILAR_ACTIONS.values()))
+    constraints = [make_constraint(Config.OBJECT, left, right, object_type="order")
+                   for left in terms + ["send"] for right in ["", "produce", "sign", "send"]]
+    computer = SimilarityComputer(Config, nlp_helper, LOG_INFO, sim_threshold=0.1)
+    fitted = computer.compute_similarities(LOG_INFO, [], constraints, [], [], ["order"], [], [])
+    for constraint, fitted_constraint in zip(constraints, fitted):
+        assert fitted_constraint.similarity[Config.ACTION] == action_sims_loop(Config, nlp_helper, LOG_INFO,
+                                                                                 constraint)
+    equivalents = get_action_equivalents(nlp_helper, LOG_INFO.actions)
+    # terms that are equivalent to several log actions map to the last of them
+    assert equivalents["produce"] == "make" and equivalents["generate"] == "make"
+    assert equivalents["create"] == "make" and equivalents["build"] == "make"
+    assert equivalents["approve"] == "check" and equivalents["sign"] == "check" and equivalents["verify"] == "check"
+    assert "send" not in equivalents
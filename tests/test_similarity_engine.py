@@ -0,0 +1,73 @@
+import numpy as np
+
+from app.control.similarity_engine import SimilarityEngine
+
+
+class DummyNlpHelper:
+
+    def __init__(self):
+        self.known_embeddings = {}
+        self.embedded = []
+
+    def pre_compute_embeddings(self, sentences):
+        self.embedded.extend(sentences)
+        for sentence in sentences:
+            rng = np.random.default_rng(sum(map(ord, sentence)))
+            self.known_embeddings[sentence] = rng.normal(size=8)
+
+    def get_sims(self, combis):
+        sims = []
+        for x, y in combis:
+            a, b = self.known_embeddings[x], self.known_embeddings[y]
+            sims.append(float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b))))
+        return sims
+
+
+def test_block_matches_pairwise_similarities():
+    nlp_helper = DummyNlpHelper()
+    engine = SimilarityEngine(nlp_helper)
+    operands = ["order", "invoice", "order"]
+    terms = ["purchase order", "invoice", "bill"]
+    block = engine.block(operands, terms)
+    assert len(block.rows) == 2 and block.nnz == 6
+    for operand in operands:
+        row = block.row(operand)
+        assert list(row) == terms
+        assert np.allclose(list(row.values()), nlp_helper.get_sims([(operand, term) for term in terms]), atol=1e-5)
+
+
+def test_terms_are_embedded_once():
+    nlp_helper = DummyNlpHelper()
+    engine = SimilarityEngine(nlp_helper)
+    engine.block(["order"], ["invoice"])
+    engine.block(["invoice", "order"], ["invoice", "bill"])
+    assert sorted(nlp_helper.embedded) == ["bill", "invoice", "order"]
+
+
+def test_empty_block():
+    block = SimilarityEngine(DummyNlpHelper()).block(["order"], [])
+    assert block.row("order") == {}
+
+
+def test_threshold_keeps_only_similar_terms():
+    nlp_helper = DummyNlpHelper()
+    engine = SimilarityEngine(nlp_helper)
+    operands = ["order", "invoice"]
+    terms = ["purchase order", "invoice", "bill", "customer"]
+    dense = engine.block(operands, terms)
+    sparse = engine.block(operands, terms, threshold=0.1)
+    for operand in operands:
+        assert sparse.row(operand) == {term: sim for term, sim in dense.row(operand).items() if sim >= 0.1}
+    assert sparse.row("invoice")["invoice"] >= 0.99
+    assert sparse.nnz < dense.nnz
+
+
+def test_chunked_block_matches_block():
+    engine = SimilarityEngine(DummyNlpHelper())
+    operands = ["order", "invoice", "bill", "customer", "payment"]
+    terms = ["purchase order", "invoice", "bill"]
+    block = engine.block(operands, terms, threshold=0.1)
+    chunked = engine.block(operands, terms, threshold=0.1, chunk_size=2)
+    assert chunked.nnz == block.nnz
+    for operand in operands:
+        assert chunked.row(operand) == block.row(operand)